@@ -3,7 +3,19 @@ import os
 import sys
 import sqlite3
 import threading
-from datetime import datetime
+import heapq
+import csv
+import shutil
+import tempfile
+import queue
+import random
+import time
+import calendar
+import json
+import multiprocessing
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
@@ -26,14 +38,27 @@ except Exception:
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.graphics.barcode import code128
 
 # matplotlib for stats
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+from borrow_analytics import ToolAnalytics, TransactionSnapshot, match_returns
+import borrow_audit
+import borrow_reports
+import borrow_stocktake
+from borrow_sites import SiteFederation
+
+# Headless entry points: scheduled monthly reports, and the packaged exe
+# relaunching itself as a child process (see run_child_process). The frozen
+# stock-take pool workers also start here, hence freeze_support.
+HEADLESS_COMMANDS = {"--report": borrow_reports.main, "--stocktake": borrow_stocktake.main}
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] in HEADLESS_COMMANDS:
+        sys.exit(HEADLESS_COMMANDS[sys.argv[1]](sys.argv[2:]))
+
 # ---------------------------
 # Resource + Database path helper
 # ---------------------------
@@ -48,6 +73,20 @@ def resource_path(relative_path):
 # Default DB file (can be changed via UI)
 DB_FILE = resource_path("tools.db")
 
+# Lock handling for a DB shared between stations (e.g. on a NAS)
+DB_BUSY_TIMEOUT = 5.0      # วินาทีที่ sqlite รอ lock ก่อนโยน "database is locked"
+DB_WRITE_RETRIES = 4       # จำนวนครั้งที่ลองเขียนซ้ำเมื่อ DB ถูก lock
+DB_RETRY_BACKOFF = 0.25    # วินาที, เพิ่มเป็นสองเท่าทุกครั้งที่ลองใหม่
+
+def connect_db(path=None):
+    """Open a connection to the current DB with the configured busy timeout"""
+    return sqlite3.connect(path or DB_FILE, timeout=DB_BUSY_TIMEOUT)
+
+def connect_read():
+    """Connection for UI reads: the in-memory replica in read-snapshot mode, else the DB file"""
+    conn = read_replica.connection()
+    return conn if conn is not None else connect_db()
+
 # ---------------------------
 # Function to allow user choose DB file at runtime
 # ---------------------------
@@ -65,19 +104,51 @@ def choose_database():
         messagebox.showerror("Error", "ไม่พบไฟล์ฐานข้อมูลที่เลือก")
         return
     DB_FILE = path
+    disable_multi_site(refresh=False)
     db_label_var.set(os.path.basename(DB_FILE) if os.path.basename(DB_FILE) else DB_FILE)
     messagebox.showinfo("ข้อมูล", f"เลือกฐานข้อมูล: {DB_FILE}")
     try:
-        init_db()
+        init_db(progress=show_migration_progress)
     except Exception as e:
         messagebox.showwarning("Warning", f"ไม่สามารถ init DB ใหม่: {e}")
+    pending_var.set("")
+    loan_scheduler.rebuild()
+    stock_alerts.rebuild()
     refresh_tables()
 
 # ---------------------------
-# Database Setup & Helpers (with migration)
+# Schema migrations (PRAGMA user_version)
 # ---------------------------
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
+# Each migration runs once per database, inside its own transaction, and bumps
+# PRAGMA user_version. Append new migrations at the end; never edit or
+# renumber one that has shipped.
+def _add_column_if_missing(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _backfill_in_batches(conn, label, count_sql, ids_sql, update_sql, progress=None, batch=5000):
+    """
+    Apply update_sql (one '?' = row id) to every id returned by ids_sql,
+    batch by batch. ids_sql takes (last_id, batch) and must return ids in
+    ascending order, so rows are visited once even when the update changes
+    the column that ids_sql filters on.
+    """
+    cur = conn.cursor()
+    total = cur.execute(count_sql).fetchone()[0]
+    done = 0
+    last_id = 0
+    while True:
+        ids = [r[0] for r in cur.execute(ids_sql, (last_id, batch)).fetchall()]
+        if not ids:
+            break
+        cur.executemany(update_sql, [(i,) for i in ids])
+        done += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(label, done, total)
+
+def _migration_base_schema(conn, progress):
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS tools (
@@ -111,54 +182,368 @@ def init_db():
             FOREIGN KEY(tool_id) REFERENCES tools(id)
         )
     """)
-    conn.commit()
+    # older DBs were created before these columns existed
+    _add_column_if_missing(cur, "transactions", "reason", "TEXT")
+    _add_column_if_missing(cur, "transactions", "worker_type", "TEXT DEFAULT 'ช่างเหล็ก'")
+
+def _migration_indexes(conn, progress):
+    cur = conn.cursor()
+    if progress:
+        progress("สร้าง index", 0, 1)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_tool ON transactions(tool_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transactions_action_worker ON transactions(action, worker_type)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_disposals_tool ON disposals(tool_id)")
+    if progress:
+        progress("สร้าง index", 1, 1)
+
+def _migration_worker_type_backfill(conn, progress):
+    # rows written before worker_type existed, or with an explicit NULL
+    _backfill_in_batches(
+        conn, "เติมประเภทช่าง",
+        "SELECT COUNT(*) FROM transactions WHERE worker_type IS NULL",
+        "SELECT id FROM transactions WHERE worker_type IS NULL AND id > ? ORDER BY id LIMIT ?",
+        "UPDATE transactions SET worker_type='ช่างเหล็ก' WHERE id=?",
+        progress)
+
+def _migration_due_back(conn, progress):
+    cur = conn.cursor()
+    _add_column_if_missing(cur, "transactions", "due_at", "TIMESTAMP")
+    # on a ยืม row: id of the คืน row that closed it, 0 = closed before tracking existed
+    # (migration 8 replaces the 0s with the real return, or LEGACY_OPEN_LOAN)
+    _add_column_if_missing(cur, "transactions", "return_id", "INTEGER")
+    _backfill_in_batches(
+        conn, "ปิดรายการยืมเก่า",
+        "SELECT COUNT(*) FROM transactions WHERE action='ยืม' AND return_id IS NULL",
+        "SELECT id FROM transactions WHERE action='ยืม' AND return_id IS NULL AND id > ? ORDER BY id LIMIT ?",
+        "UPDATE transactions SET return_id=0 WHERE id=?",
+        progress)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_open_loans
+        ON transactions(tool_id, user) WHERE action='ยืม' AND return_id IS NULL
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_open_due
+        ON transactions(due_at) WHERE due_at IS NOT NULL AND return_id IS NULL
+    """)
+
+def _migration_hash_chain(conn, progress):
+    cur = conn.cursor()
+    _add_column_if_missing(cur, "transactions", "row_hash", "TEXT")
+    _add_column_if_missing(cur, "disposals", "row_hash", "TEXT")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS hash_checkpoints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            last_row_id INTEGER NOT NULL,
+            row_hash TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            signature TEXT NOT NULL
+        )
+    """)
+    borrow_audit.backfill_chain(conn, "transactions", progress, "hash ประวัติยืมคืน")
+    borrow_audit.backfill_chain(conn, "disposals", progress, "hash ประวัติการทิ้ง")
+
+# low = below the tool's minimum; NULL min_available means no threshold
+_LOW_NEW = "(NEW.min_available IS NOT NULL AND NEW.available_qty < NEW.min_available)"
+_LOW_OLD = "(OLD.min_available IS NOT NULL AND OLD.available_qty < OLD.min_available)"
+
+def _migration_stock_alerts(conn, progress):
+    cur = conn.cursor()
+    _add_column_if_missing(cur, "tools", "min_available", "INTEGER")
+    # append-only event log read by id; 'low' rows get cleared_at when stock recovers
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            available_qty INTEGER NOT NULL,
+            min_available INTEGER,
+            created_at TIMESTAMP NOT NULL,
+            cleared_at TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_alerts_open
+        ON stock_alerts(tool_id) WHERE kind='low' AND cleared_at IS NULL
+    """)
+    # the triggers fire only on a threshold crossing, inside the writing transaction
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tools_stock_low
+        AFTER UPDATE OF available_qty, total_qty, min_available ON tools
+        WHEN {_LOW_NEW} AND NOT {_LOW_OLD}
+        BEGIN
+            INSERT INTO stock_alerts (tool_id, kind, available_qty, min_available, created_at)
+            VALUES (NEW.id, 'low', NEW.available_qty, NEW.min_available, datetime('now', 'localtime'));
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tools_stock_recovered
+        AFTER UPDATE OF available_qty, total_qty, min_available ON tools
+        WHEN {_LOW_OLD} AND NOT {_LOW_NEW}
+        BEGIN
+            UPDATE stock_alerts SET cleared_at = datetime('now', 'localtime')
+            WHERE tool_id = NEW.id AND kind = 'low' AND cleared_at IS NULL;
+            INSERT INTO stock_alerts (tool_id, kind, available_qty, min_available, created_at)
+            VALUES (NEW.id, 'clear', NEW.available_qty, NEW.min_available, datetime('now', 'localtime'));
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tools_stock_low_insert
+        AFTER INSERT ON tools
+        WHEN {_LOW_NEW}
+        BEGIN
+            INSERT INTO stock_alerts (tool_id, kind, available_qty, min_available, created_at)
+            VALUES (NEW.id, 'low', NEW.available_qty, NEW.min_available, datetime('now', 'localtime'));
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tools_stock_deleted
+        AFTER DELETE ON tools
+        WHEN {_LOW_OLD}
+        BEGIN
+            UPDATE stock_alerts SET cleared_at = datetime('now', 'localtime')
+            WHERE tool_id = OLD.id AND kind = 'low' AND cleared_at IS NULL;
+            INSERT INTO stock_alerts (tool_id, kind, available_qty, min_available, created_at)
+            VALUES (OLD.id, 'clear', OLD.available_qty, OLD.min_available, datetime('now', 'localtime'));
+        END
+    """)
+
+# transactions rows are stored in transactions_data with action / user /
+# worker_type as ids into these small lookup tables; `transactions` is a view
+# with the original columns, so reads and the occasional INSERT/UPDATE
+# through it keep working unchanged
+TXN_LABEL_TABLES = {"action": "txn_actions", "user": "txn_users", "worker_type": "txn_worker_types"}
+# fixed so partial indexes and hot queries can name an action by id
+TXN_ACTION_IDS = {"ยืม": 1, "คืน": 2, "ทิ้ง": 3}
+TXN_COPY_BATCH = 50000
+
+def _txn_label_sql(column, value):
+    return f"(SELECT id FROM {TXN_LABEL_TABLES[column]} WHERE name = {value})"
+
+def _migration_compact_transactions(conn, progress):
+    cur = conn.cursor()
+    for table in TXN_LABEL_TABLES.values():
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+    cur.executemany("INSERT OR IGNORE INTO txn_actions (id, name) VALUES (?, ?)",
+                    [(i, name) for name, i in TXN_ACTION_IDS.items()])
+    for column, table in TXN_LABEL_TABLES.items():
+        cur.execute(f"INSERT OR IGNORE INTO {table} (name) "
+                    f"SELECT DISTINCT {column} FROM transactions WHERE {column} IS NOT NULL")
+    cur.execute("""
+        CREATE TABLE transactions_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tool_id INTEGER NOT NULL,
+            action_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            worker_type_id INTEGER,
+            reason TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            due_at TIMESTAMP,
+            return_id INTEGER,
+            row_hash TEXT,
+            FOREIGN KEY(tool_id) REFERENCES tools(id),
+            FOREIGN KEY(action_id) REFERENCES txn_actions(id),
+            FOREIGN KEY(user_id) REFERENCES txn_users(id),
+            FOREIGN KEY(worker_type_id) REFERENCES txn_worker_types(id)
+        )
+    """)
+    # copy in id ranges so progress can be shown on large histories
+    total = cur.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    done = last_id = 0
+    while True:
+        upper = cur.execute("SELECT MAX(id) FROM (SELECT id FROM transactions WHERE id > ? ORDER BY id LIMIT ?)",
+                            (last_id, TXN_COPY_BATCH)).fetchone()[0]
+        if upper is None:
+            break
+        cur.execute("""
+            INSERT INTO transactions_data
+            SELECT t.id, t.tool_id, a.id, u.id, w.id, t.reason, t.date, t.due_at, t.return_id, t.row_hash
+            FROM transactions t
+            JOIN txn_actions a ON a.name = t.action
+            JOIN txn_users u ON u.name = t.user
+            LEFT JOIN txn_worker_types w ON w.name = t.worker_type
+            WHERE t.id > ? AND t.id <= ?
+        """, (last_id, upper))
+        done += cur.rowcount
+        last_id = upper
+        if progress:
+            progress("บีบอัดประวัติยืมคืน", done, total)
+    # ids of deleted trailing rows are never handed out again. transactions_data
+    # has no sqlite_sequence row yet if the old table was emptied, and
+    # sqlite_sequence has no unique key to REPLACE on, so write the row afresh
+    seq = cur.execute("SELECT MAX(seq) FROM sqlite_sequence "
+                      "WHERE name IN ('transactions', 'transactions_data')").fetchone()[0]
+    if seq is not None:
+        cur.execute("DELETE FROM sqlite_sequence WHERE name = 'transactions_data'")
+        cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions_data', ?)", (seq,))
+    cur.execute("DROP TABLE transactions")
+    cur.execute("""
+        CREATE VIEW transactions AS
+        SELECT d.id, d.tool_id, a.name AS action, u.name AS user, w.name AS worker_type,
+               d.reason, d.date, d.due_at, d.return_id, d.row_hash
+        FROM transactions_data d
+        JOIN txn_actions a ON a.id = d.action_id
+        JOIN txn_users u ON u.id = d.user_id
+        LEFT JOIN txn_worker_types w ON w.id = d.worker_type_id
+    """)
+    cur.execute("CREATE INDEX idx_transactions_tool ON transactions_data(tool_id, id)")
+    cur.execute("CREATE INDEX idx_transactions_date ON transactions_data(date)")
+    cur.execute("CREATE INDEX idx_transactions_action_worker ON transactions_data(action_id, worker_type_id)")
+    cur.execute(f"""
+        CREATE INDEX idx_transactions_open_loans
+        ON transactions_data(tool_id, user_id) WHERE action_id = {TXN_ACTION_IDS['ยืม']} AND return_id IS NULL
+    """)
+    cur.execute("""
+        CREATE INDEX idx_transactions_open_due
+        ON transactions_data(due_at) WHERE due_at IS NOT NULL AND return_id IS NULL
+    """)
+    # writes through the view; worker_type / date fall back to the old column defaults
+    worker_type = "COALESCE(NEW.worker_type, 'ช่างเหล็ก')"
+    cur.execute(f"""
+        CREATE TRIGGER trg_transactions_insert
+        INSTEAD OF INSERT ON transactions
+        BEGIN
+            INSERT OR IGNORE INTO txn_actions (name) VALUES (NEW.action);
+            INSERT OR IGNORE INTO txn_users (name) VALUES (NEW.user);
+            INSERT OR IGNORE INTO txn_worker_types (name) VALUES ({worker_type});
+            INSERT INTO transactions_data
+                (id, tool_id, action_id, user_id, worker_type_id, reason, date, due_at, return_id, row_hash)
+            VALUES (NEW.id, NEW.tool_id, {_txn_label_sql('action', 'NEW.action')},
+                    {_txn_label_sql('user', 'NEW.user')}, {_txn_label_sql('worker_type', worker_type)},
+                    NEW.reason, COALESCE(NEW.date, CURRENT_TIMESTAMP), NEW.due_at, NEW.return_id, NEW.row_hash);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_transactions_update
+        INSTEAD OF UPDATE ON transactions
+        BEGIN
+            INSERT OR IGNORE INTO txn_actions (name) SELECT NEW.action WHERE NEW.action IS NOT OLD.action;
+            INSERT OR IGNORE INTO txn_users (name) SELECT NEW.user WHERE NEW.user IS NOT OLD.user;
+            INSERT OR IGNORE INTO txn_worker_types (name)
+                SELECT NEW.worker_type WHERE NEW.worker_type IS NOT OLD.worker_type;
+            UPDATE transactions_data
+            SET tool_id = NEW.tool_id,
+                action_id = {_txn_label_sql('action', 'NEW.action')},
+                user_id = {_txn_label_sql('user', 'NEW.user')},
+                worker_type_id = {_txn_label_sql('worker_type', 'NEW.worker_type')},
+                reason = NEW.reason, date = NEW.date, due_at = NEW.due_at,
+                return_id = NEW.return_id, row_hash = NEW.row_hash
+            WHERE id = OLD.id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_transactions_delete
+        INSTEAD OF DELETE ON transactions
+        BEGIN
+            DELETE FROM transactions_data WHERE id = OLD.id;
+        END
+    """)
+
+# return_id of a borrow from before loans were tracked for which no return
+# was found: still out, and the only kind of loan a colleague's return closes
+LEGACY_OPEN_LOAN = -1
 
-    # Migration to add 'reason' if missing
+def _migration_pair_legacy_loans(conn, progress):
+    """Replace migration 4's return_id=0 stamps with the return that closed each loan"""
+    cur = conn.cursor()
+    borrow, give_back = TXN_ACTION_IDS["ยืม"], TXN_ACTION_IDS["คืน"]
+    if progress:
+        progress("จับคู่ยืม-คืนเก่า", 0, 1)
+    tracked = {r[0] for r in cur.execute("SELECT return_id FROM transactions_data WHERE return_id > 0")}
+    rows = [r for r in cur.execute("""
+        SELECT id, tool_id, user_id, CASE action_id WHEN ? THEN 1 ELSE -1 END
+        FROM transactions_data
+        WHERE (action_id=? AND return_id=0) OR action_id=?
+        ORDER BY id
+    """, (borrow, borrow, give_back)) if r[3] == 1 or r[0] not in tracked]
+    if rows:
+        closed, still_out = match_returns(*zip(*rows))
+        cur.executemany("UPDATE transactions_data SET return_id=? WHERE id=?",
+                        [(return_id, borrow_id) for borrow_id, return_id in closed.items()])
+        cur.executemany("UPDATE transactions_data SET return_id=? WHERE id=?",
+                        [(LEGACY_OPEN_LOAN, borrow_id) for borrow_id in still_out])
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_transactions_legacy_loans
+        ON transactions_data(tool_id, user_id) WHERE action_id = {borrow} AND return_id = {LEGACY_OPEN_LOAN}
+    """)
+    if progress:
+        progress("จับคู่ยืม-คืนเก่า", 1, 1)
+
+MIGRATIONS = [
+    (1, "base schema", _migration_base_schema),
+    (2, "indexes for history, filters and stats", _migration_indexes),
+    (3, "backfill missing worker_type", _migration_worker_type_backfill),
+    (4, "due-back time and loan closing", _migration_due_back),
+    (5, "hash-chained transactions and disposals", _migration_hash_chain),
+    (6, "per-tool minimum stock and trigger-fed alerts", _migration_stock_alerts),
+    (7, "dictionary-encoded transactions behind a view", _migration_compact_transactions),
+    (8, "pair legacy borrows with their returns", _migration_pair_legacy_loans),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# migrations that free most of the file; VACUUM returns the space to the disk.
+# It rewrites the whole file, so it runs later on the backup thread once the
+# station is idle, not here on the Tk thread at startup.
+VACUUM_AFTER = {7}
+
+def init_db(progress=None):
+    """
+    Bring the current DB up to SCHEMA_VERSION. When it is already current this
+    is a single PRAGMA read. progress(label, done, total) is called during
+    long migrations.
+    """
+    conn = connect_db()
     try:
-        cur.execute("PRAGMA table_info(transactions)")
-        cols = [r[1] for r in cur.fetchall()]
-        if "reason" not in cols:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        conn.isolation_level = None     # transactions are managed explicitly below
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
             try:
-                cur.execute("ALTER TABLE transactions ADD COLUMN reason TEXT")
-                conn.commit()
-                print("Added 'reason' column to transactions table")
-            except Exception as e:
-                print("Failed to add 'reason' column:", e)
-    except Exception as e:
-        print("PRAGMA error:", e)
-
-    conn.close()
+                # another station may have migrated while we waited for the lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    conn.execute("COMMIT")
+                    continue
+                migrate(conn, progress)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"Applied migration {number}: {description}")
+            if number in VACUUM_AFTER:
+                backup_scheduler.vacuum_later(DB_FILE)
+    finally:
+        conn.close()
 
-def add_tool(name, code, qty, image_path=None):
-    conn = sqlite3.connect(DB_FILE)
+# Write helpers below take the writer connection as first argument and run
+# on the DB writer thread (see DBWriter) inside a single transaction.
+def add_tool(conn, name, code, qty, image_path=None):
     cur = conn.cursor()
     cur.execute("INSERT OR IGNORE INTO tools (name, code, total_qty, available_qty, image) VALUES (?, ?, ?, ?, ?)",
                 (name, code, qty, qty, image_path))
-    conn.commit()
-    conn.close()
 
-def delete_tool(tool_id):
-    conn = sqlite3.connect(DB_FILE)
+def delete_tool(conn, tool_id):
     cur = conn.cursor()
     cur.execute("DELETE FROM tools WHERE id=?", (tool_id,))
-    conn.commit()
-    conn.close()
 
 def get_tool_by_code(code):
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect_read()
     cur = conn.cursor()
     cur.execute("SELECT * FROM tools WHERE code=?", (code,))
     row = cur.fetchone()
     conn.close()
     return row
 
-def update_qty(tool_id, change):
-    conn = sqlite3.connect(DB_FILE)
+def update_qty(conn, tool_id, change):
     cur = conn.cursor()
     cur.execute("SELECT total_qty, available_qty FROM tools WHERE id=?", (tool_id,))
     res = cur.fetchone()
     if not res:
-        conn.close()
         return
     total_qty, avail = res
     new_avail = avail + change
@@ -167,29 +552,50 @@ def update_qty(tool_id, change):
     elif new_avail > total_qty:
         new_avail = total_qty
     cur.execute("UPDATE tools SET available_qty=? WHERE id=?", (new_avail, tool_id))
-    conn.commit()
-    conn.close()
 
-def insert_transaction(tool_id, action, user, worker_type, reason=None):
-    conn = sqlite3.connect(DB_FILE)
+def txn_label_id(conn, column, name):
+    """id of an action / user / worker_type value in its lookup table, added on first use"""
+    if name is None:
+        return None
+    table = TXN_LABEL_TABLES[column]
+    row = conn.execute(f"SELECT id FROM {table} WHERE name=?", (name,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+
+def insert_transaction(conn, tool_id, action, user, worker_type, reason=None, due_at=None):
     cur = conn.cursor()
+    # straight into the storage table: lastrowid is not set by an INSERT through the view
     cur.execute("""
-        INSERT INTO transactions (tool_id, action, user, worker_type, reason, date) 
-        VALUES (?, ?, ?, ?, ?, ?)""",
-        (tool_id, action, user, worker_type, reason, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
-
-def fetch_tools():
-    conn = sqlite3.connect(DB_FILE)
+        INSERT INTO transactions_data (tool_id, action_id, user_id, worker_type_id, reason, date, due_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (tool_id, txn_label_id(conn, "action", action), txn_label_id(conn, "user", user),
+         txn_label_id(conn, "worker_type", worker_type), reason,
+         datetime.now().strftime("%Y-%m-%d %H:%M:%S"), due_at))
+    row_id = cur.lastrowid
+    borrow_audit.chain_row(conn, "transactions", row_id, "transactions_data")
+    return row_id
+
+def fetch_tools(with_minimum=False):
+    conn = connect_read()
     cur = conn.cursor()
-    cur.execute("SELECT id, name, code, total_qty, available_qty, image FROM tools")
+    extra = ", IFNULL(min_available, '')" if with_minimum else ""
+    cur.execute(f"SELECT id, name, code, total_qty, available_qty, image{extra} FROM tools")
     rows = cur.fetchall()
     conn.close()
     return rows
 
+def worker_type_counts(conn, action):
+    """[(worker_type, count)] for one action, grouped on the encoded ids (index-only)"""
+    return conn.execute("""
+        SELECT w.name, d.n
+        FROM (SELECT worker_type_id, COUNT(*) AS n FROM transactions_data
+              WHERE action_id=? GROUP BY worker_type_id) d
+        LEFT JOIN txn_worker_types w ON w.id = d.worker_type_id
+    """, (TXN_ACTION_IDS[action],)).fetchall()
+
 def fetch_transactions():
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect_read()
     cur = conn.cursor()
     cur.execute("""
         SELECT tr.id, tl.name, tr.action, tr.user, IFNULL(tr.reason, ''), tr.date
@@ -201,21 +607,18 @@ def fetch_transactions():
     conn.close()
     return rows
 
-def dispose_tool(tool_id, quantity, reason):
+def dispose_tool(conn, tool_id, quantity, reason):
     """
     Reduce total_qty primarily. Do not touch available_qty unless it would become greater than new total,
     in which case set available_qty = new_total to keep consistency.
     """
-    conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
     cur.execute("SELECT total_qty, available_qty FROM tools WHERE id=?", (tool_id,))
     res = cur.fetchone()
     if not res:
-        conn.close()
         return False, "ไม่พบข้อมูลเครื่องมือนี้"
     total_qty, avail_qty = res
     if quantity > total_qty:
-        conn.close()
         return False, "จำนวนที่จะทิ้งมากกว่าจำนวนทั้งหมดในคลัง"
     new_total = total_qty - quantity
     new_avail = avail_qty
@@ -225,10 +628,670 @@ def dispose_tool(tool_id, quantity, reason):
                 (new_total, new_avail, tool_id))
     cur.execute("INSERT INTO disposals (tool_id, quantity, reason) VALUES (?, ?, ?)",
                 (tool_id, quantity, reason))
-    conn.commit()
-    conn.close()
+    borrow_audit.chain_row(conn, "disposals", cur.lastrowid)
     return True, "ทิ้งเรียบร้อย"
 
+def dispose_and_log(conn, tool_id, quantity, reason, disposer, worker_type):
+    """dispose_tool + its 'ทิ้ง' transaction row, committed together"""
+    success, msg = dispose_tool(conn, tool_id, quantity, reason)
+    if success:
+        insert_transaction(conn, tool_id, "ทิ้ง", disposer, worker_type, reason)
+    return success, msg
+
+def borrow_in_db(conn, code, user, worker_type, due_at=None):
+    """Returns (success, message, loan); loan is ("open", id, tool name, user, due_at) when due_at is set"""
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, total_qty, available_qty FROM tools WHERE code=?", (code,))
+    tool = cur.fetchone()
+    if not tool:
+        return False, f"ไม่พบเครื่องมือรหัส {code}", None
+    if tool[3] <= 0:
+        return False, f"เครื่องมือ {tool[1]} หมด", None
+    update_qty(conn, tool[0], -1)
+    loan_id = insert_transaction(conn, tool[0], "ยืม", user, worker_type, None, due_at)
+    return True, "", (("open", loan_id, tool[1], user, due_at) if due_at else None)
+
+def return_in_db(conn, code, user, worker_type):
+    """Returns (success, message, loan); loan is ("close", borrow id) for the loan this return closes"""
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, total_qty, available_qty FROM tools WHERE code=?", (code,))
+    tool = cur.fetchone()
+    if not tool:
+        return False, f"ไม่พบเครื่องมือรหัส {code}", None
+    if tool[3] >= tool[2]:
+        return False, f"เครื่องมือ {tool[1]} ครบจำนวนแล้ว", None
+    update_qty(conn, tool[0], 1)
+    return_id = insert_transaction(conn, tool[0], "คืน", user, worker_type, None)
+    borrow, user_id = TXN_ACTION_IDS["ยืม"], txn_label_id(conn, "user", user)
+    # close this user's oldest open loan of the tool; failing that, a loan
+    # carried over from before tracking (returned by a colleague). Another
+    # user's tracked loan is never closed: it stays on their due-back list.
+    cur.execute("""
+        SELECT id FROM transactions_data
+        WHERE tool_id=? AND action_id=? AND user_id=? AND return_id IS NULL
+        ORDER BY id
+        LIMIT 1
+    """, (tool[0], borrow, user_id))
+    loan = cur.fetchone()
+    if not loan:
+        cur.execute("""
+            SELECT id FROM transactions_data
+            WHERE tool_id=? AND action_id=? AND return_id=?
+            ORDER BY (user_id = ?) DESC, id
+            LIMIT 1
+        """, (tool[0], borrow, LEGACY_OPEN_LOAN, user_id))
+        loan = cur.fetchone()
+    if not loan:
+        return True, "", None
+    cur.execute("UPDATE transactions_data SET return_id=? WHERE id=?", (return_id, loan[0]))
+    return True, "", ("close", loan[0])
+
+def _chain_new_rows(conn, table, after_id, storage=None):
+    """Hash rows inserted in bulk (ids > after_id) in id order"""
+    ids = [r[0] for r in conn.execute(f"SELECT id FROM {storage or table} WHERE id > ? ORDER BY id", (after_id,))]
+    for row_id in ids:
+        borrow_audit.chain_row(conn, table, row_id, storage)
+
+def _max_id(conn, table):
+    return conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {table}").fetchone()[0]
+
+# ids per IN (...) lookup; SQLite before 3.32 allows only 999 bound variables
+BULK_ID_CHUNK = 500
+
+def bulk_update_tools(conn, op, tool_ids, qty=0, reason=None, user=None, worker_type=None):
+    """
+    Apply one operation to many tools in the writer's single transaction.
+      op: "delete" | "add" (total + available) | "reduce" (available only) | "dispose" (total)
+          | "min" (minimum available for low-stock alerts; qty 0 removes it)
+    Rows that fail validation are skipped and reported; the rest are written
+    with executemany. Returns (applied count, [(tool_id, name, message), ...]).
+    """
+    cur = conn.cursor()
+    ids = list(tool_ids)
+    found = {}
+    for i in range(0, len(ids), BULK_ID_CHUNK):
+        chunk = ids[i:i + BULK_ID_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur.execute(f"SELECT id, name, total_qty, available_qty FROM tools WHERE id IN ({marks})", chunk)
+        found.update((r[0], r) for r in cur.fetchall())
+    failures = []
+    valid = []
+    for tool_id in tool_ids:
+        row = found.get(tool_id)
+        if row is None:
+            failures.append((tool_id, "", "ไม่พบข้อมูลเครื่องมือ"))
+            continue
+        _, name, total_qty, avail_qty = row
+        if op == "reduce" and qty > avail_qty:
+            failures.append((tool_id, name, f"ไม่สามารถลดได้มากกว่า {avail_qty} (จำนวนที่คงเหลือในคลังตอนนี้)"))
+        elif op == "dispose" and qty > total_qty:
+            failures.append((tool_id, name, "จำนวนที่จะทิ้งมากกว่าจำนวนทั้งหมดในคลัง"))
+        else:
+            valid.append(row)
+
+    if op == "delete":
+        cur.executemany("DELETE FROM tools WHERE id=?", [(r[0],) for r in valid])
+    elif op == "add":
+        cur.executemany("UPDATE tools SET total_qty=total_qty+?, available_qty=MIN(available_qty+?, total_qty+?) WHERE id=?",
+                        [(qty, qty, qty, r[0]) for r in valid])
+    elif op == "reduce":
+        cur.executemany("UPDATE tools SET available_qty=available_qty-? WHERE id=?",
+                        [(qty, r[0]) for r in valid])
+    elif op == "min":
+        cur.executemany("UPDATE tools SET min_available=? WHERE id=?",
+                        [(qty or None, r[0]) for r in valid])
+    elif op == "dispose":
+        cur.executemany("UPDATE tools SET total_qty=total_qty-?, available_qty=MIN(available_qty, total_qty-?) WHERE id=?",
+                        [(qty, qty, r[0]) for r in valid])
+        last_disposal = _max_id(conn, "disposals")
+        cur.executemany("INSERT INTO disposals (tool_id, quantity, reason) VALUES (?, ?, ?)",
+                        [(r[0], qty, reason) for r in valid])
+        _chain_new_rows(conn, "disposals", last_disposal)
+        last_txn = _max_id(conn, "transactions_data")
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        labels = (TXN_ACTION_IDS["ทิ้ง"], txn_label_id(conn, "user", user),
+                  txn_label_id(conn, "worker_type", worker_type))
+        cur.executemany("""
+            INSERT INTO transactions_data (tool_id, action_id, user_id, worker_type_id, reason, date)
+            VALUES (?, ?, ?, ?, ?, ?)""", [(r[0],) + labels + (reason, now) for r in valid])
+        _chain_new_rows(conn, "transactions", last_txn, "transactions_data")
+    else:
+        raise ValueError(f"unknown bulk operation: {op}")
+    return len(valid), failures
+
+# ---------------------------
+# Background DB writer
+# ---------------------------
+def _is_lock_error(exc):
+    msg = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+class DBWriter:
+    """
+    Single thread that owns every write to the DB. Tk callbacks call submit(),
+    which returns a Future immediately; the job runs as one BEGIN IMMEDIATE
+    transaction and, if the file is locked by another station, is retried with
+    exponential backoff. on_done / on_error run on the Tk thread (handed over
+    through ui_updates.after_flush), so callbacks may touch widgets.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._conn_path = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.on_pending_change = None   # called from any thread with the pending count
+        self._stopping = False
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, job, *args, on_done=None, on_error=None):
+        fut = Future()
+        with self._lock:
+            self.pending += 1
+        self._notify_pending()
+        self._queue.put((DB_FILE, job, args, fut, on_done, on_error))
+        return fut
+
+    def release(self):
+        """Close the connection after the writes queued so far; the Future is done once it is closed"""
+        fut = Future()
+        self._queue.put((None, None, (), fut, None, None))
+        return fut
+
+    def stop(self, timeout=5.0):
+        """Finish queued writes and stop the thread (results are no longer posted to Tk)"""
+        self._stopping = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _notify_pending(self):
+        if self.on_pending_change is None or self._stopping:
+            return
+        try:
+            self.on_pending_change(self.pending)
+        except Exception:
+            pass
+
+    def _connection(self, path):
+        if self._conn is None or self._conn_path != path:
+            if self._conn is not None:
+                self._conn.close()
+            # autocommit mode; transactions are opened explicitly in _execute
+            self._conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+            self._conn_path = path
+        return self._conn
+
+    def _execute(self, path, job, args):
+        attempt = 0
+        while True:
+            conn = self._connection(path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                result = job(conn, *args)
+                conn.execute("COMMIT")
+                return result
+            except Exception as e:
+                if conn.in_transaction:
+                    try:
+                        conn.execute("ROLLBACK")
+                    except Exception:
+                        pass
+                if not _is_lock_error(e) or attempt >= DB_WRITE_RETRIES:
+                    raise
+                time.sleep(DB_RETRY_BACKOFF * (2 ** attempt))
+                attempt += 1
+
+    def _deliver(self, callback, value):
+        if callback is None or self._stopping:
+            return
+        ui_updates.after_flush(lambda: callback(value))
+
+    def _after_commit(self, on_done, result):
+        def deliver():
+            if not self._stopping:
+                ui_updates.request("alerts")    # triggers may have logged stock alerts
+            self._deliver(on_done, result)
+        if read_replica.enabled:
+            # the replica thread syncs (once for a burst of commits) and then
+            # delivers, so on_done's refresh reads what was just written without
+            # the next queued write waiting on a full copy
+            read_replica.sync_soon(deliver)
+        else:
+            deliver()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, job, args, fut, on_done, on_error = item
+            if job is None:     # release()
+                self._close()
+                fut.set_result(None)
+                continue
+            if fut.set_running_or_notify_cancel():
+                try:
+                    result = self._execute(path, job, args)
+                except Exception as e:
+                    fut.set_exception(e)
+                    self._deliver(on_error or _show_write_error, e)
+                else:
+                    fut.set_result(result)
+                    self._after_commit(on_done, result)
+            with self._lock:
+                self.pending -= 1
+            self._notify_pending()
+        self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = self._conn_path = None
+
+def _show_write_error(exc):
+    if _is_lock_error(exc):
+        messagebox.showerror("Error", f"ฐานข้อมูลถูกใช้งานโดยเครื่องอื่น บันทึกไม่สำเร็จ: {exc}")
+    else:
+        messagebox.showerror("Error", f"บันทึกข้อมูลไม่สำเร็จ: {exc}")
+
+db_writer = DBWriter()
+
+# ---------------------------
+# Read-snapshot mode: in-memory replica of a shared DB
+# ---------------------------
+READ_REPLICA_ENABLED = False
+REPLICA_POLL_SEC = 2.0          # how often PRAGMA data_version is checked
+REPLICA_BACKUP_PAGES = 256      # pages per backup step for a full copy
+REPLICA_LOCK_WAIT_SEC = 2.0     # how long a read waits out a delta sync's table locks
+# how each table is kept in sync after the first full copy:
+#   "append" copies rows with a higher id, "full" re-copies the (small) table
+REPLICA_TABLES = {
+    "tools": "full",
+    "txn_actions": "append",
+    "txn_users": "append",
+    "txn_worker_types": "append",
+    "transactions_data": "append",
+    "disposals": "append",
+    "hash_checkpoints": "append",
+    "stock_alerts": "append",
+}
+
+def _wait_table_lock(fn, *args):
+    """
+    Run fn, retrying while the shared-cache replica reports a table lock.
+    Shared-cache locks fail at once with SQLITE_LOCKED instead of going
+    through the busy timeout, so the wait has to happen here.
+    """
+    deadline = time.monotonic() + REPLICA_LOCK_WAIT_SEC
+    while True:
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e).lower() or time.monotonic() >= deadline:
+                raise
+            time.sleep(0.005)
+
+class _ReplicaCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        return _wait_table_lock(super().execute, sql, params)
+
+    def executemany(self, sql, seq):
+        return _wait_table_lock(super().executemany, sql, seq)
+
+class _ReplicaConnection(sqlite3.Connection):
+    """Reader connection to the replica: statements wait out a running delta sync"""
+
+    def cursor(self, factory=_ReplicaCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+class ReadReplica:
+    """
+    Keeps an in-memory copy of DB_FILE for UI reads. The first copy (and any
+    copy after a schema change or DB switch) uses the sqlite3 backup API;
+    after that, a change in PRAGMA data_version triggers a delta sync through
+    ATTACH: new rows of append-only tables, small tables re-copied, and
+    return_id of open loans. Readers get their own connection to a named
+    shared-cache memory DB. A delta sync is one transaction, so readers never
+    see it half applied; while it holds its table locks they wait briefly
+    (_wait_table_lock), and if a reader holds them first the sync retries.
+    Writes still go to the shared file through db_writer, which hands its
+    on_done to sync_soon() so the station sees its own changes immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.synced_at = None       # time.time() of the last check that found the replica current
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._master = None
+        self._uri = None
+        self._path = None
+        self._version = None
+        self._schema = None
+        self._generation = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._after_sync = queue.SimpleQueue()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="read-replica", daemon=True)
+            self._thread.start()
+
+    def set_enabled(self, flag):
+        # called on the Tk thread, so it never waits for _lock (a copy can hold
+        # it for seconds); readers stop using the replica at once and the
+        # replica thread drops it
+        self.enabled = flag
+        self._wake.set()
+
+    def connection(self):
+        uri = self._uri
+        if not self.enabled or uri is None or self._path != DB_FILE:
+            return None
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, factory=_ReplicaConnection)
+
+    def sync_soon(self, callback=None):
+        """Wake the replica thread to sync; callback runs on that thread once it has"""
+        if callback is not None:
+            self._after_sync.put(callback)
+        self._wake.set()
+
+    def staleness(self):
+        return None if self.synced_at is None else time.time() - self.synced_at
+
+    def _drop(self):
+        if self._master is not None:
+            self._master.close()
+        self._master = self._uri = self._path = None
+        self._version = self._schema = None
+        self.synced_at = None
+
+    def _full_copy(self, path):
+        self._generation += 1
+        uri = f"file:borrowmate_replica_{os.getpid()}_{self._generation}?mode=memory&cache=shared"
+        master = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                 timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+        src = connect_db(path)
+        try:
+            src.backup(master, pages=REPLICA_BACKUP_PAGES, sleep=0.001)
+        finally:
+            src.close()
+        # rows arrive from src already complete; the copied triggers would
+        # log a second set of stock alerts when tools is re-synced
+        for (name,) in master.execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall():
+            master.execute(f"DROP TRIGGER {name}")
+        master.execute("ATTACH DATABASE ? AS src", (path,))
+        # publish the new copy; readers still on the old one keep it alive until they close
+        old = self._master
+        self._master, self._uri, self._path = master, uri, path
+        if old is not None:
+            old.close()
+
+    def _delta_sync(self):
+        m = self._master
+        tables = {r[0] for r in m.execute("SELECT name FROM main.sqlite_master WHERE type='table'")}
+        m.execute("BEGIN")
+        try:
+            for table, how in REPLICA_TABLES.items():
+                if table not in tables:
+                    continue
+                if how == "full":
+                    m.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM src.{table}")
+                    m.execute(f"DELETE FROM main.{table} WHERE id NOT IN (SELECT id FROM src.{table})")
+                else:
+                    m.execute(f"""
+                        INSERT INTO main.{table} SELECT * FROM src.{table}
+                        WHERE id > (SELECT IFNULL(MAX(id), 0) FROM main.{table})
+                    """)
+            # the in-place updates the app makes: closing an open loan / a stock alert
+            for still_open in ("return_id IS NULL", f"return_id = {LEGACY_OPEN_LOAN}"):
+                m.execute(f"""
+                    UPDATE main.transactions_data
+                    SET return_id = (SELECT s.return_id FROM src.transactions_data s WHERE s.id = main.transactions_data.id)
+                    WHERE action_id={TXN_ACTION_IDS['ยืม']} AND {still_open}
+                """)
+            if "stock_alerts" in tables:
+                m.execute("""
+                    UPDATE main.stock_alerts
+                    SET cleared_at = (SELECT s.cleared_at FROM src.stock_alerts s WHERE s.id = main.stock_alerts.id)
+                    WHERE kind='low' AND cleared_at IS NULL
+                """)
+            m.execute("COMMIT")
+        except Exception:
+            m.execute("ROLLBACK")
+            raise
+
+    def sync(self):
+        """Bring the replica up to date with DB_FILE (any thread). Returns True if data changed"""
+        with self._lock:
+            if not self.enabled:
+                return False
+            path = DB_FILE
+            try:
+                changed = False
+                if self._master is None or self._path != path:
+                    self._full_copy(path)
+                    self._schema = None
+                    changed = True
+                version = self._master.execute("PRAGMA src.data_version").fetchone()[0]
+                schema = self._master.execute("PRAGMA src.schema_version").fetchone()[0]
+                if self._schema is not None and schema != self._schema:
+                    self._full_copy(path)       # migration ran somewhere: copy everything again
+                    changed = True
+                elif self._version is not None and version != self._version:
+                    _wait_table_lock(self._delta_sync)
+                    changed = True
+                self._version, self._schema = version, schema
+                self.synced_at = time.time()
+                self.last_error = None
+                return changed
+            except Exception as e:
+                self.last_error = e
+                return False
+
+    def run_once(self):
+        """One pass of the replica thread: sync, then run the callbacks queued before it"""
+        callbacks = [self._after_sync.get() for _ in range(self._after_sync.qsize())]
+        if self.enabled:
+            self.sync()
+        elif self._master is not None:
+            with self._lock:
+                if not self.enabled:
+                    self._drop()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"replica callback failed: {e}")
+
+    def _run(self):
+        while True:
+            self._wake.wait(REPLICA_POLL_SEC)
+            self._wake.clear()
+            self.run_once()
+
+read_replica = ReadReplica()
+read_replica.enabled = READ_REPLICA_ENABLED
+
+# ---------------------------
+# Online backup of the live DB
+# ---------------------------
+BACKUP_DIR = ""                 # NAS folder for backups; "" = choose in the UI
+BACKUP_INTERVAL_MIN = 60        # 0 = only when the button is pressed
+BACKUP_KEEP = 7                 # generations kept in BACKUP_DIR
+BACKUP_PAGES_PER_STEP = 64      # pages copied while holding the read lock
+BACKUP_STEP_SLEEP = 0.05        # seconds between steps, lets other stations write
+BACKUP_MAX_RESTARTS = 5         # source changed mid-copy this often -> copy in one step
+VACUUM_IDLE_SEC = 1.0           # how often a pending VACUUM checks that no write is queued
+
+class _BackupRestarted(Exception):
+    pass
+
+class BackupScheduler:
+    """
+    Copies the live DB with the sqlite3 backup API in small page steps into a
+    local temp file, checks it with PRAGMA integrity_check, then moves it to
+    BACKUP_DIR and keeps the newest BACKUP_KEEP generations. Slow NAS writes
+    happen after the copy, so the source DB is never locked by them. The same
+    thread runs the VACUUM that init_db asks for after a shrinking migration.
+    """
+
+    def __init__(self):
+        self.target_dir = BACKUP_DIR
+        self.last_report = None
+        self.on_report = None       # called on the Tk thread with each report dict
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._backup_requested = False
+        self._vacuum_path = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="backup", daemon=True)
+            self._thread.start()
+
+    def run_now(self):
+        self._backup_requested = True
+        self._wake.set()
+
+    def vacuum_later(self, path):
+        """VACUUM path on the backup thread once no write is queued"""
+        self._vacuum_path = path
+        self._wake.set()
+
+    def vacuum(self, path):
+        while db_writer.pending:
+            time.sleep(VACUUM_IDLE_SEC)
+        with self._lock:
+            started = time.time()
+            conn = connect_db(path)
+            try:
+                conn.execute("VACUUM")
+            except sqlite3.OperationalError as e:
+                # another station is using the file; freed pages are reused by later writes
+                print(f"VACUUM skipped: {e}")
+                return False
+            finally:
+                conn.close()
+            print(f"VACUUM {path}: {time.time() - started:.1f}s")
+            return True
+
+    def run_once(self, timed_out=False):
+        """Pending VACUUM, then a backup if one was asked for (report["manual"]) or is due"""
+        path, self._vacuum_path = self._vacuum_path, None
+        if path is not None:
+            self.vacuum(path)
+        requested, self._backup_requested = self._backup_requested, False
+        if not self.target_dir or not (requested or timed_out):
+            return None
+        report = self.backup_once()
+        report["manual"] = requested
+        self.last_report = report
+        if self.on_report is not None:
+            ui_updates.after_flush(lambda r=report: self.on_report(r))
+        return report
+
+    def _run(self):
+        while True:
+            timeout = BACKUP_INTERVAL_MIN * 60 if BACKUP_INTERVAL_MIN > 0 else None
+            timed_out = not self._wake.wait(timeout)
+            self._wake.clear()
+            self.run_once(timed_out)
+
+    def _copy(self, src_path, dst_path):
+        """Backup in page steps; returns the number of restarts caused by concurrent writes"""
+        state = {"remaining": None, "restarts": 0}
+
+        def progress(status, remaining, total):
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > BACKUP_MAX_RESTARTS:
+                    raise _BackupRestarted()
+            state["remaining"] = remaining
+            # backup() itself only sleeps on BUSY; pause here so the read lock is released between steps
+            time.sleep(BACKUP_STEP_SLEEP)
+
+        src = connect_db(src_path)
+        try:
+            dst = sqlite3.connect(dst_path)
+            try:
+                try:
+                    src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+                except _BackupRestarted:
+                    # busy DB: a local copy in one step is short enough to just take the lock
+                    src.backup(dst, pages=-1)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        return state["restarts"]
+
+    def backup_once(self):
+        with self._lock:
+            started = time.time()
+            src_path = DB_FILE
+            base = os.path.splitext(os.path.basename(src_path))[0]
+            name = f"{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+            report = {"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "file": None,
+                      "bytes": 0, "seconds": 0.0, "restarts": 0, "ok": False, "error": None}
+            fd, tmp_path = tempfile.mkstemp(suffix=".db")
+            os.close(fd)
+            try:
+                report["restarts"] = self._copy(src_path, tmp_path)
+                conn = sqlite3.connect(tmp_path)
+                try:
+                    check = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    conn.close()
+                if check != "ok":
+                    raise RuntimeError(f"integrity_check: {check}")
+                os.makedirs(self.target_dir, exist_ok=True)
+                final_path = os.path.join(self.target_dir, name)
+                part_path = final_path + ".part"
+                shutil.copyfile(tmp_path, part_path)
+                os.replace(part_path, final_path)
+                report["file"] = final_path
+                report["bytes"] = os.path.getsize(final_path)
+                report["ok"] = True
+                self._rotate(base)
+            except Exception as e:
+                report["error"] = str(e)
+            finally:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            report["seconds"] = time.time() - started
+            print(f"Backup {'ok' if report['ok'] else 'failed'}: {report}")
+            return report
+
+    def _rotate(self, base):
+        prefix = base + "_"
+        generations = sorted(f for f in os.listdir(self.target_dir)
+                             if f.startswith(prefix) and f.endswith(".db"))
+        for old in generations[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+            try:
+                os.remove(os.path.join(self.target_dir, old))
+            except OSError:
+                pass
+
+backup_scheduler = BackupScheduler()
+
 # ---------------------------
 # UI helpers
 # ---------------------------
@@ -237,121 +1300,1118 @@ tool_images = {}
 def refresh_tools_table_main():
     for i in tree_tools.get_children():
         tree_tools.delete(i)
+    if site_federation is not None:
+        rows, errors = site_federation.tools()
+        report_site_errors(errors)
+        for site, *values in rows:
+            tree_tools.insert("", tk.END, values=tuple(values) + (site,))
+        return
     for row in fetch_tools():
         tool_id, name, code, total, avail, image_path = row
         tool_images[tool_id] = image_path
         tree_tools.insert("", tk.END, values=(tool_id, name, code, total, avail))
 
 def refresh_transactions_all():
-    for i in tree_trans.get_children():
-        tree_trans.delete(i)
-    for row in fetch_transactions():
-        tree_trans.insert("", tk.END, values=row)
+    """Reload tree_trans in the background through the filter currently shown"""
+    history_filter.rerun()
 
 def refresh_tables():
     refresh_tools_table_main()
     refresh_transactions_all()
 
 # ---------------------------
-# Actions borrow/return
+# Multi-site view (read-only, federated over several station DBs)
 # ---------------------------
-def borrow_tool(code, user):
-    tool = get_tool_by_code(code)
-    if not tool:
-        messagebox.showerror("Error", f"ไม่พบเครื่องมือรหัส {code}")
-        return False
-    if tool[4] <= 0:
-        messagebox.showerror("Error", f"เครื่องมือ {tool[1]} หมด")
-        return False
-    update_qty(tool[0], -1)
-    insert_transaction(tool[0], "ยืม", user, worker_type_var.get(), None)
+# Scans and edits still go to this station's DB_FILE; only the main views,
+# the history filter and the worker stats read across sites.
+MULTI_SITE_DBS = []         # [(ชื่อสาขา, path), ...] รายการที่เลือกไว้ล่าสุด
+site_federation = None      # SiteFederation while multi-site mode is on
+
+# per-site history is sorted by date so the merged list stays in date order
+def _site_history_key(row):
+    return (str(row[6]), row[1])
+
+def report_site_errors(errors):
+    for site, err in errors:
+        ui_updates.notify(f"อ่านข้อมูลสาขา {site} ไม่ได้: {err}", "warning")
+
+def set_site_columns(visible):
+    tree_tools["displaycolumns"] = (("สาขา",) + cols_tools[:-1]) if visible else cols_tools[:-1]
+    tree_trans["displaycolumns"] = (("สาขา",) + cols_trans[:-1]) if visible else cols_trans[:-1]
+
+def enable_multi_site(sites):
+    global site_federation
+    federation = SiteFederation(sites)
+    disable_multi_site(refresh=False)
+    site_federation = federation
+    set_site_columns(True)
+    db_label_var.set(f"หลายสาขา ({len(sites)})")
+    tool_images.clear()
     refresh_tables()
-    return True
 
-def return_tool(code, user):
-    tool = get_tool_by_code(code)
-    if not tool:
-        messagebox.showerror("Error", f"ไม่พบเครื่องมือรหัส {code}")
-        return False
-    if tool[4] >= tool[3]:
-        messagebox.showerror("Error", f"เครื่องมือ {tool[1]} ครบจำนวนแล้ว")
-        return False
-    update_qty(tool[0], 1)
-    insert_transaction(tool[0], "คืน", user, worker_type_var.get(), None)
-    refresh_tables()
-    return True
+def disable_multi_site(refresh=True):
+    global site_federation
+    if site_federation is None:
+        return
+    site_federation.close()
+    site_federation = None
+    set_site_columns(False)
+    db_label_var.set(os.path.basename(DB_FILE) if os.path.basename(DB_FILE) else DB_FILE)
+    if refresh:
+        refresh_tables()
+
+# Scan bursts: every result used to rebuild both views and could open a modal
+# box. Results now mark views dirty / queue toasts, and one callback applies
+# them at most once per display frame.
+UI_FRAME_MS = 16        # ~60 Hz
+TOAST_SEC = 5           # status strip clears after this
+TOAST_HISTORY = 50      # messages kept for the "ดูทั้งหมด" view
+
+class UIUpdater:
+    """
+    Collects UI work from any thread: request(key) marks a registered view
+    dirty, notify() queues a status-strip message, after_flush() runs a
+    callback once the pending work has been applied. Callers only put items
+    on a queue; poll() runs on the Tk thread every UI_FRAME_MS, drains it and
+    flushes, so N requests in one frame cost one rebuild per view and Tk is
+    never called from a worker thread.
+    """
+
+    def __init__(self):
+        self._inbox = queue.SimpleQueue()
+        self._handlers = {}         # key -> callable, applied in registration order
+        self._after_id = None
+        self.on_toasts = None       # called on the Tk thread with [(message, level), ...]
+        # stats: requests collapsed per flush
+        self.requests = 0
+        self.flushes = 0
+        self.max_batch = 0
+
+    def register(self, key, handler):
+        self._handlers[key] = handler
+
+    def request(self, *keys):
+        self._inbox.put(("request", keys))
+
+    def notify(self, message, level="error"):
+        self._inbox.put(("toast", (message, level)))
+
+    def after_flush(self, callback):
+        self._inbox.put(("callback", callback))
+
+    def start(self):
+        """Begin polling; call once on the Tk thread after root exists"""
+        if self._after_id is None:
+            self._after_id = root.after(UI_FRAME_MS, self._tick)
+
+    def _tick(self):
+        self._after_id = None
+        try:
+            self.poll()
+        finally:
+            self._after_id = root.after(UI_FRAME_MS, self._tick)
+
+    def poll(self):
+        """Apply everything queued so far (Tk thread only). Returns True if anything was applied"""
+        dirty, toasts, callbacks, batch = set(), [], [], 0
+        while True:
+            try:
+                kind, value = self._inbox.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "request":
+                dirty.update(value)
+                batch += len(value)
+            elif kind == "toast":
+                toasts.append(value)
+                batch += 1
+            else:
+                callbacks.append(value)
+        if not (dirty or toasts or callbacks):
+            return False
+        # one failing view must not drop the rest of the frame
+        for key, handler in self._handlers.items():
+            if key in dirty:
+                try:
+                    handler()
+                except Exception as e:
+                    toasts.append((f"อัปเดตหน้าจอไม่สำเร็จ ({key}): {e}", "error"))
+        if toasts and self.on_toasts:
+            self.on_toasts(toasts)
+        self.requests += batch
+        self.flushes += 1
+        self.max_batch = max(self.max_batch, batch)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"UI callback failed: {e}")
+        return True
+
+    def stats(self):
+        return {"requests": self.requests, "flushes": self.flushes, "max_batch": self.max_batch,
+                "per_flush": round(self.requests / self.flushes, 2) if self.flushes else 0.0}
+
+ui_updates = UIUpdater()
+ui_updates.register("tools", refresh_tools_table_main)
+ui_updates.register("transactions", refresh_transactions_all)
+
+# ---------------------------
+# Actions borrow/return
+# ---------------------------
+def report_scan_error(msg):
+    if scan_load_test.active:
+        scan_load_test.errors += 1
+    ui_updates.notify(msg, "error")
+
+def _on_scan_written(result):
+    success, msg, loan = result
+    if not success:
+        report_scan_error(msg)
+        return
+    loan_scheduler.apply(loan)
+    ui_updates.request("tools", "transactions")
+
+def _on_scan_write_error(exc):
+    if _is_lock_error(exc):
+        report_scan_error(f"ฐานข้อมูลถูกใช้งานโดยเครื่องอื่น บันทึกไม่สำเร็จ: {exc}")
+    else:
+        report_scan_error(f"บันทึกข้อมูลไม่สำเร็จ: {exc}")
+
+def _scan_done_callback(probe):
+    if probe is None:
+        return _on_scan_written
+    def on_done(result):
+        _on_scan_written(result)
+        # the change is on screen once the coalesced refresh has run
+        ui_updates.after_flush(lambda: probe.visible(result))
+    return on_done
+
+def _scan_error_callback(probe):
+    if probe is None:
+        return _on_scan_write_error
+    def on_error(exc):
+        _on_scan_write_error(exc)
+        ui_updates.after_flush(lambda: probe.visible((False, str(exc), None)))
+    return on_error
+
+def _due_at_from_ui():
+    hours = loan_hours_var.get()
+    if not hours.isdigit():
+        return None
+    return (datetime.now() + timedelta(hours=int(hours))).strftime("%Y-%m-%d %H:%M:%S")
+
+def borrow_tool(code, user, probe=None):
+    fut = db_writer.submit(borrow_in_db, code, user, worker_type_var.get(), _due_at_from_ui(),
+                           on_done=_scan_done_callback(probe), on_error=_scan_error_callback(probe))
+    if probe is not None:
+        fut.add_done_callback(probe.committed)
+    return fut
+
+def return_tool(code, user, probe=None):
+    fut = db_writer.submit(return_in_db, code, user, worker_type_var.get(),
+                           on_done=_scan_done_callback(probe), on_error=_scan_error_callback(probe))
+    if probe is not None:
+        fut.add_done_callback(probe.committed)
+    return fut
+
+# ---------------------------
+# Due-back monitoring (min-heap of deadlines)
+# ---------------------------
+LOAN_HOUR_CHOICES = ["ไม่กำหนด", "1", "2", "4", "8", "24", "48", "72"]
+DEFAULT_LOAN_HOURS = "ไม่กำหนด"
+OVERDUE_MAX_SLEEP_MS = 60000    # re-arm at least this often so clock changes are noticed
+
+def _parse_db_time(text):
+    return datetime.strptime(str(text)[:19], "%Y-%m-%d %H:%M:%S")
+
+class LoanScheduler:
+    """
+    Open loans that have a due_at, kept in a heap ordered by deadline. The heap
+    is rebuilt from the partial index idx_transactions_open_due, then kept up
+    to date by this station's borrow/return results; poll() rebuilds it when
+    PRAGMA data_version shows that another station wrote to the shared DB
+    (e.g. returned a loan listed here). A single root.after timer sleeps until
+    the next deadline.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self.loans = {}         # borrow id -> (tool name, user, borrowed at, due_at)
+        self.overdue = set()
+        self._after_id = None
+        self._watch = None      # connection to DB_FILE whose data_version poll() compares
+        self._watch_path = None
+        self._version = None
+
+    def poll(self):
+        """Rebuild if the DB changed since the last rebuild (Tk thread, on the alerts poll)"""
+        try:
+            if self._watch is None or self._watch_path != DB_FILE:
+                if self._watch is not None:
+                    self._watch.close()
+                self._watch, self._watch_path, self._version = connect_db(), DB_FILE, None
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            return
+        if version != self._version:
+            # read the file itself: the replica may not have this change yet
+            self.rebuild(self._watch)
+            self._version = version
+
+    def rebuild(self, conn=None):
+        own = conn is None
+        conn = conn or connect_read()
+        try:
+            rows = conn.execute("""
+                SELECT tr.id, tl.name, tr.user, tr.date, tr.due_at
+                FROM transactions tr
+                JOIN tools tl ON tr.tool_id = tl.id
+                WHERE tr.due_at IS NOT NULL AND tr.return_id IS NULL
+            """).fetchall()
+        except sqlite3.OperationalError:
+            rows = []       # DB not migrated yet
+        finally:
+            if own:
+                conn.close()
+        self.loans = {}
+        self._heap = []
+        for loan_id, name, user, date, due_at in rows:
+            self.loans[loan_id] = (name, user, date, due_at)
+            self._heap.append((_parse_db_time(due_at), loan_id))
+        # loans already flagged stay flagged without a second alert
+        self.overdue &= self.loans.keys()
+        heapq.heapify(self._heap)
+        self._check()
+
+    def apply(self, loan):
+        """loan event from borrow_in_db / return_in_db"""
+        if not loan:
+            return
+        if loan[0] == "open":
+            _, loan_id, name, user, due_at = loan
+            self.loans[loan_id] = (name, user, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), due_at)
+            heapq.heappush(self._heap, (_parse_db_time(due_at), loan_id))
+        else:
+            # heap entry is dropped lazily when it reaches the top
+            self.loans.pop(loan[1], None)
+            self.overdue.discard(loan[1])
+        self._check()
+
+    def _check(self):
+        now = datetime.now()
+        newly_overdue = []
+        while self._heap and (self._heap[0][1] not in self.loans or self._heap[0][0] <= now):
+            due, loan_id = heapq.heappop(self._heap)
+            if loan_id in self.loans and loan_id not in self.overdue:
+                self.overdue.add(loan_id)
+                newly_overdue.append(loan_id)
+        if self._after_id is not None:
+            root.after_cancel(self._after_id)
+            self._after_id = None
+        delay = OVERDUE_MAX_SLEEP_MS
+        if self._heap:
+            delay = min(delay, max(0, int((self._heap[0][0] - now).total_seconds() * 1000)) + 50)
+        self._after_id = root.after(delay, self._check)
+        update_overdue_indicator(newly_overdue)
+
+    def overdue_rows(self):
+        """(borrow id, tool, user, borrowed at, due at, overdue) for every tracked loan, most overdue first"""
+        now = datetime.now()
+        rows = []
+        for loan_id, (name, user, date, due_at) in self.loans.items():
+            late = now - _parse_db_time(due_at)
+            status = f"เกิน {late.total_seconds() / 3600:.1f} ชม." if loan_id in self.overdue else "ยังไม่ถึงกำหนด"
+            rows.append((loan_id, name, user, date, due_at, status))
+        rows.sort(key=lambda r: r[4])
+        return rows
+
+loan_scheduler = LoanScheduler()
+ui_updates.register("loans", loan_scheduler.poll)
+
+def update_overdue_indicator(newly_overdue=()):
+    count = len(loan_scheduler.overdue)
+    btn_overdue.config(text=f"เกินกำหนดคืน ({count})" if count else "กำหนดคืน")
+    if newly_overdue:
+        try:
+            if winsound:
+                winsound.Beep(600, 300)
+        except Exception:
+            pass
+        names = [f"{loan_scheduler.loans[i][0]} ({loan_scheduler.loans[i][1]})" for i in newly_overdue[:5]]
+        more = f" และอีก {len(newly_overdue) - 5} รายการ" if len(newly_overdue) > 5 else ""
+        overdue_alert_var.set("เกินกำหนดคืน: " + ", ".join(names) + more)
+    elif not count:
+        overdue_alert_var.set("")
+
+def open_overdue_window():
+    loan_scheduler.rebuild()
+    win = tk.Toplevel(root)
+    win.title("กำหนดคืนเครื่องมือ")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.7, 0.6, 700, 400)
+
+    cols = ("ID", "ชื่อเครื่องมือ", "ผู้ยืม", "วันที่ยืม", "กำหนดคืน", "สถานะ")
+    tree = ttk.Treeview(win, columns=cols, show="headings")
+    for col in cols:
+        tree.heading(col, text=col)
+        tree.column(col, width=140, anchor="center")
+    tree.pack(fill="both", expand=True, padx=10, pady=10)
+    rows = loan_scheduler.overdue_rows()
+    for row in rows:
+        tree.insert("", tk.END, values=row)
+
+    def export_csv():
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+                                            initialfile="overdue_loans.csv")
+        if not path:
+            return
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(cols)
+            writer.writerows(loan_scheduler.overdue_rows())
+        messagebox.showinfo("สำเร็จ", f"บันทึกรายการที่ {path}")
+    ttk.Button(win, text="ส่งออก CSV", command=export_csv, style="Gold.TButton").pack(pady=5)
+
+# ---------------------------
+# Low-stock alerts (fed by triggers on tools)
+# ---------------------------
+ALERT_POLL_MS = 5000        # picks up alerts caused by other stations' writes
+
+def fetch_alerts_since(conn, last_id, limit=1000):
+    """New stock_alerts rows after last_id, oldest first (PK range scan, independent of catalogue size)"""
+    return conn.execute("""
+        SELECT a.id, a.tool_id, a.kind, a.available_qty, a.min_available, a.created_at,
+               IFNULL(t.name, 'ID ' || a.tool_id)
+        FROM stock_alerts a LEFT JOIN tools t ON t.id = a.tool_id
+        WHERE a.id > ? ORDER BY a.id LIMIT ?
+    """, (last_id, limit)).fetchall()
+
+class StockAlertMonitor:
+    """
+    Open low-stock alerts, kept current by reading stock_alerts incrementally
+    by id. rebuild() loads the open set from the partial index once; after
+    that each poll only reads rows newer than the last one seen.
+    """
+
+    def __init__(self):
+        self.open = {}          # tool_id -> (name, available, minimum, since)
+        self.last_id = 0
+        self._after_id = None
+
+    def rebuild(self):
+        conn = connect_read()
+        try:
+            try:
+                rows = conn.execute("""
+                    SELECT a.tool_id, IFNULL(t.name, 'ID ' || a.tool_id), a.available_qty, a.min_available, a.created_at
+                    FROM stock_alerts a LEFT JOIN tools t ON t.id = a.tool_id
+                    WHERE a.kind='low' AND a.cleared_at IS NULL
+                """).fetchall()
+                self.last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM stock_alerts").fetchone()[0]
+            except sqlite3.OperationalError:
+                rows, self.last_id = [], 0     # DB not migrated yet
+        finally:
+            conn.close()
+        self.open = {r[0]: r[1:] for r in rows}
+        update_stock_indicator()
+
+    def poll(self):
+        conn = connect_read()
+        try:
+            try:
+                rows = fetch_alerts_since(conn, self.last_id)
+            except sqlite3.OperationalError:
+                rows = []
+        finally:
+            conn.close()
+        if not rows:
+            return
+        newly_low = []
+        for alert_id, tool_id, kind, avail, minimum, created_at, name in rows:
+            if kind == "low":
+                self.open[tool_id] = (name, avail, minimum, created_at)
+                newly_low.append(f"{name} (เหลือ {avail}/{minimum})")
+            else:
+                self.open.pop(tool_id, None)
+            self.last_id = alert_id
+        update_stock_indicator()
+        if newly_low:
+            more = f" และอีก {len(newly_low) - 3} รายการ" if len(newly_low) > 3 else ""
+            ui_updates.notify("สต็อกต่ำกว่าขั้นต่ำ: " + ", ".join(newly_low[:3]) + more, "warning")
+        if len(rows) == 1000:
+            ui_updates.request("alerts")    # more to read
+
+    def schedule(self):
+        if self._after_id is not None:
+            root.after_cancel(self._after_id)
+        def tick():
+            self._after_id = None
+            ui_updates.request("alerts", "loans")
+            self.schedule()
+        self._after_id = root.after(ALERT_POLL_MS, tick)
+
+stock_alerts = StockAlertMonitor()
+ui_updates.register("alerts", stock_alerts.poll)
+
+def update_stock_indicator():
+    count = len(stock_alerts.open)
+    btn_stock_alerts.config(text=f"สต็อกต่ำ ({count})" if count else "สต็อกต่ำ")
+
+def open_stock_alerts_window():
+    win = tk.Toplevel(root)
+    win.title("เครื่องมือที่ต่ำกว่าขั้นต่ำ")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.6, 0.5, 600, 350)
+
+    cols = ("ID", "ชื่อเครื่องมือ", "คงเหลือ (ตอนแจ้ง)", "ขั้นต่ำ", "ตั้งแต่")
+    tree = ttk.Treeview(win, columns=cols, show="headings")
+    for col in cols:
+        tree.heading(col, text=col)
+        tree.column(col, width=130, anchor="center")
+    tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+    def rows():
+        return [(tool_id,) + tuple(info) for tool_id, info in
+                sorted(stock_alerts.open.items(), key=lambda kv: kv[1][3])]
+    for row in rows():
+        tree.insert("", tk.END, values=row)
+
+    def export_csv():
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+                                            initialfile="low_stock.csv")
+        if not path:
+            return
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(cols)
+            writer.writerows(rows())
+        messagebox.showinfo("สำเร็จ", f"บันทึกรายการที่ {path}")
+    ttk.Label(win, text="ตั้งค่าขั้นต่ำของแต่ละเครื่องมือได้ที่หน้าจัดการเครื่องมือ",
+              background="#0D1B2A", foreground="white").pack()
+    ttk.Button(win, text="ส่งออก CSV", command=export_csv, style="Gold.TButton").pack(pady=5)
+
+# ---------------------------
+# Audit: hash chain verification + signed checkpoints
+# ---------------------------
+AUDIT_CHECKPOINT_INTERVAL_MIN = 60     # background verify + checkpoint; 0 = only on demand
+_audit_running = False
+
+def run_audit(full=False, silent=False):
+    """Verify the chain on a worker thread; store checkpoints through db_writer if it is intact"""
+    global _audit_running
+    if _audit_running:
+        return
+    _audit_running = True
+    path = DB_FILE
+
+    def work():
+        try:
+            conn = connect_db(path)
+            try:
+                results = borrow_audit.verify_all(conn, use_checkpoint=not full)
+            finally:
+                conn.close()
+        except Exception as e:
+            # bind now: e is unset when the except block ends
+            ui_updates.after_flush(lambda err=e: finish(None, err))
+        else:
+            ui_updates.after_flush(lambda: finish(results, None))
+
+    def finish(results, error):
+        global _audit_running
+        _audit_running = False
+        if error is not None:
+            if not silent:
+                messagebox.showerror("Error", f"ตรวจสอบไม่สำเร็จ: {error}")
+            return
+        broken = any(r["broken"] for r in results)
+        if not broken and path == DB_FILE:
+            db_writer.submit(lambda conn: borrow_audit.checkpoint_results(conn, results),
+                             on_error=(lambda e: None) if silent else None)
+        if broken:
+            messagebox.showwarning("ตรวจพบการแก้ไขข้อมูล", borrow_audit.format_results(results))
+        elif not silent:
+            messagebox.showinfo("ผลการตรวจสอบ", borrow_audit.format_results(results))
+
+    threading.Thread(target=work, name="audit", daemon=True).start()
+
+def schedule_audit():
+    if AUDIT_CHECKPOINT_INTERVAL_MIN <= 0:
+        return
+    run_audit(silent=True)
+    root.after(AUDIT_CHECKPOINT_INTERVAL_MIN * 60 * 1000, schedule_audit)
+
+def open_audit_menu():
+    full = messagebox.askyesno("ตรวจสอบประวัติ",
+                               "ตรวจทุกแถวตั้งแต่ต้น?\n(ไม่ = ตรวจเฉพาะแถวหลัง checkpoint ล่าสุด)")
+    run_audit(full=full)
 
 # ---------------------------
 # Barcode Scanner (Threaded) + Sound
 # ---------------------------
-scanning = False
-_scanner_thread = None
-last_scan_time = {}
+# Camera sources: each entry gets its own capture thread.
+#   source: cv2.VideoCapture index or URL (e.g. rtsp://...)
+#   mode:   "borrow" / "return", None = follow the โหมด ยืม/คืน radio button
+#   user:   fixed user for this lane, None = name typed in ชื่อผู้ใช้ when scan starts
+CAMERA_SOURCES = [
+    {"name": "กล้อง 1", "source": 0, "mode": None, "user": None},
+    # {"name": "ช่องยืม", "source": 0, "mode": "borrow", "user": None},
+    # {"name": "ช่องคืน", "source": 1, "mode": "return", "user": None},
+]
+DECODE_WORKERS = 2          # threads shared by all cameras for pyzbar.decode
+SCAN_DEBOUNCE_SEC = 2       # same code ignored for this long (across all cameras)
+
+# In-window camera preview (ปิดได้บนเครื่องช้า)
+PREVIEW_ENABLED = True
+PREVIEW_FPS = 10            # display rate, independent of camera/decode rate
+PREVIEW_SIZE = (280, 210)
+PREVIEW_BOX_TTL = 0.5       # seconds a decoded box stays drawn
 
-def _scanner_loop(user):
-    global scanning
-    cap = cv2.VideoCapture(0)
-    while scanning:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        barcodes = pyzbar.decode(frame)
-        for barcode in barcodes:
-            code = barcode.data.decode("utf-8")
-            import time
+last_scan_time = {}
+_last_scan_lock = threading.Lock()
+
+def _decode_frame(frame):
+    return [(b.data.decode("utf-8"), b.rect) for b in pyzbar.decode(frame)]
+
+class CameraWorker:
+    """Capture loop for one camera; decoding is handed to the shared pool"""
+
+    def __init__(self, manager, name, source, mode, user):
+        self.manager = manager
+        self.name = name
+        self.source = source
+        self.mode = mode
+        self.user = user
+        self.running = True     # set before start() so the manager never sees a new camera as finished
+        self.status = "กำลังเปิดกล้อง"
+        self._thread = None
+        self._inflight = None
+        # latest frame / boxes are plain references swapped by the capture and
+        # decode threads; the preview reads them at its own rate, no copies here
+        self.latest_frame = None
+        self.latest_boxes = ([], 0.0)
+        # stats
+        self.frames = 0
+        self.decoded = 0
+        self.codes = 0
+        self.decode_time = 0.0
+        self.fps = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"camera-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        # opening a camera can take seconds; it happens here so other cameras keep running
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            self.status = "เปิดกล้องไม่ได้"
+            self.running = False
+        else:
+            self.status = "กำลังสแกน"
+        fps_start = time.time()
+        fps_frames = 0
+        while self.running:
+            ret, frame = cap.read()
+            if not ret:
+                self.status = "อ่านภาพไม่ได้"
+                break
+            self.frames += 1
+            self.latest_frame = frame
+            fps_frames += 1
             now = time.time()
-            if code not in last_scan_time or now - last_scan_time[code] > 2:
-                last_scan_time[code] = now
-                root.after(0, lambda c=code, u=user: handle_scanned_code(c, u))
-                try:
-                    if winsound:
-                        winsound.Beep(1000, 120)
-                except Exception:
-                    pass
-        cv2.imshow("Scanner", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    cap.release()
-    cv2.destroyAllWindows()
-    scanning = False
-    root.after(0, update_scan_button_state)
-
-def handle_scanned_code(code, user):
-    if mode_var.get() == "borrow":
-        borrow_tool(code, user)
-    else:
-        return_tool(code, user)
+            if now - fps_start >= 1.0:
+                self.fps = fps_frames / (now - fps_start)
+                fps_start, fps_frames = now, 0
+            # drop frames while the previous one is still being decoded
+            if self._inflight is None or self._inflight.done():
+                self._inflight = self.manager.submit_decode(self, frame)
+        cap.release()
+        self.latest_frame = None
+        self.running = False
+        self.manager.camera_finished(self)
+
+    def on_decoded(self, codes, elapsed):
+        self.decoded += 1
+        self.decode_time += elapsed
+        if codes:
+            self.latest_boxes = (codes, time.time())
+        for code, rect in codes:
+            self.codes += 1
+            self.manager.dispatch(self, code)
+
+    def stats_text(self):
+        avg_ms = (self.decode_time / self.decoded * 1000) if self.decoded else 0.0
+        if not self.running:
+            return f"{self.name}: {self.status}"
+        return f"{self.name}: {self.fps:.1f} fps, decode {avg_ms:.0f} ms, {self.codes} codes"
+
+class ScannerManager:
+    """Runs N cameras sharing one decode pool and one debounce table (last_scan_time)"""
+
+    def __init__(self):
+        self.cameras = []
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        with self._lock:
+            return any(c.running for c in self.cameras)
+
+    def _ensure_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+        return self._pool
+
+    def add_camera(self, name, source, mode=None, user=None):
+        """Start a camera; None if source is already being scanned"""
+        with self._lock:
+            if any(c.running and c.source == source for c in self.cameras):
+                return None
+            taken = {c.name for c in self.cameras}
+            unique, n = name, 2
+            while unique in taken:
+                unique, n = f"{name} ({n})", n + 1
+            cam = CameraWorker(self, unique, source, mode, user)
+            self._ensure_pool()
+            self.cameras.append(cam)
+        cam.start()
+        return cam
+
+    def stop(self):
+        with self._lock:
+            cams = list(self.cameras)
+        for cam in cams:
+            cam.stop()
+
+    def submit_decode(self, cam, frame):
+        start = time.perf_counter()
+        try:
+            fut = self._ensure_pool().submit(_decode_frame, frame)
+        except RuntimeError:
+            return None   # pool shut down
+
+        def done(f):
+            try:
+                codes = f.result()
+            except Exception:
+                codes = []
+            cam.on_decoded(codes, time.perf_counter() - start)
+        fut.add_done_callback(done)
+        return fut
+
+    def dispatch(self, cam, code):
+        if not submit_scan(code, cam.user, cam.mode):
+            return
+        try:
+            if winsound:
+                winsound.Beep(1000, 120)
+        except Exception:
+            pass
+
+    def camera_finished(self, cam):
+        with self._lock:
+            if cam in self.cameras:
+                self.cameras.remove(cam)
+            pool = None
+            if not self.cameras:
+                pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+        if cam.status != "กำลังสแกน":
+            # the camera is gone from the stats line, so say why it stopped
+            ui_updates.notify(f"{cam.name}: {cam.status}", "warning")
+        ui_updates.after_flush(update_scan_button_state)
+
+scanner = ScannerManager()
+
+def submit_scan(code, user, mode=None, probe=None):
+    """
+    Entry point for a decoded code (camera threads, load test): drop repeats
+    inside SCAN_DEBOUNCE_SEC, then handle it on the Tk thread. Returns False
+    when the code was debounced, or is a camera scan during the load test.
+    """
+    now = time.time()
+    with _last_scan_lock:
+        if code in last_scan_time and now - last_scan_time[code] <= SCAN_DEBOUNCE_SEC:
+            return False
+        last_scan_time[code] = now
+    if probe is None and scan_load_test.active:
+        # DB_FILE is a scratch DB while the load test runs; a real scan would land there
+        ui_updates.notify(f"กำลังทดสอบโหลด ไม่ได้บันทึกการสแกน {code}", "warning")
+        return False
+    ui_updates.after_flush(lambda: handle_scanned_code(code, user, mode, probe))
+    return True
+
+def handle_scanned_code(code, user, mode=None, probe=None):
+    if (mode or mode_var.get()) == "borrow":
+        return borrow_tool(code, user, probe)
+    return return_tool(code, user, probe)
+
+def _parse_camera_source(text):
+    text = str(text).strip()
+    return int(text) if text.isdigit() else text
 
 def start_camera_scan():
-    global scanning, _scanner_thread
-    if scanning:
+    if scanner.running:
         return
-    user = entry_user.get().strip()
-    if not user:
+    typed_user = entry_user.get().strip()
+    if not typed_user and any(not cfg.get("user") for cfg in CAMERA_SOURCES):
         messagebox.showerror("Error", "กรุณากรอกชื่อผู้ใช้ก่อนสแกน")
         return
-    scanning = True
+    for cfg in CAMERA_SOURCES:
+        scanner.add_camera(cfg["name"], cfg["source"], cfg.get("mode"), cfg.get("user") or typed_user)
     update_scan_button_state()
-    _scanner_thread = threading.Thread(target=_scanner_loop, args=(user,), daemon=True)
-    _scanner_thread.start()
 
 def stop_camera_scan():
-    global scanning
-    scanning = False
+    scanner.stop()
     update_scan_button_state()
 
 def toggle_scan():
-    if scanning:
+    if scanner.running:
         stop_camera_scan()
     else:
         start_camera_scan()
 
+def add_camera_dialog():
+    """Start one extra camera while the others keep scanning"""
+    win = tk.Toplevel(root)
+    win.title("เพิ่มกล้อง")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.3, 0.3, 340, 240)
+    win.grab_set()
+
+    ttk.Label(win, text="กล้อง (เลข index หรือ URL):").pack(pady=(10, 2))
+    entry_source = ttk.Entry(win, width=30)
+    entry_source.insert(0, str(len(scanner.cameras)))
+    entry_source.pack(pady=4)
+    cam_mode = tk.StringVar(value="")
+    ttk.Radiobutton(win, text="ตามโหมดหลัก", variable=cam_mode, value="").pack()
+    ttk.Radiobutton(win, text="โหมด ยืม", variable=cam_mode, value="borrow").pack()
+    ttk.Radiobutton(win, text="โหมด คืน", variable=cam_mode, value="return").pack()
+
+    def confirm():
+        user = entry_user.get().strip()
+        if not user:
+            messagebox.showerror("Error", "กรุณากรอกชื่อผู้ใช้ก่อนสแกน")
+            return
+        source = _parse_camera_source(entry_source.get())
+        if source == "":
+            messagebox.showerror("Error", "กรุณาระบุกล้อง")
+            return
+        if scanner.add_camera(f"กล้อง {source}", source, cam_mode.get() or None, user) is None:
+            messagebox.showerror("Error", f"กล้อง {source} กำลังสแกนอยู่แล้ว")
+            return
+        update_scan_button_state()
+        win.destroy()
+    ttk.Button(win, text="เริ่ม", command=confirm, style="Gold.TButton").pack(pady=10)
+
 def update_scan_button_state():
-    if scanning:
+    if scanner.running:
         btn_scan.config(text="Stop Scan", style="Gold.TButton")
     else:
         btn_scan.config(text="Start Scan (กล้อง)", style="Gold.TButton")
 
+def refresh_camera_stats():
+    cams = list(scanner.cameras)
+    camera_stats_var.set("   ".join(c.stats_text() for c in cams))
+    st = ui_updates.stats()
+    if st["flushes"]:
+        ui_stats_var.set(f"UI {st['requests']} งาน / {st['flushes']} รอบวาด "
+                         f"(เฉลี่ย {st['per_flush']}, สูงสุด {st['max_batch']} ต่อรอบ)")
+    names = [c.name for c in cams]
+    if list(preview_camera_combo["values"]) != names:
+        preview_camera_combo["values"] = names
+        if preview_camera_var.get() not in names:
+            preview_camera_var.set(names[0] if names else "")
+    root.after(1000, refresh_camera_stats)
+
+_preview_state = {"frame": None, "image": None}
+
+def _preview_camera():
+    name = preview_camera_var.get()
+    for cam in list(scanner.cameras):
+        if cam.name == name:
+            return cam
+    return None
+
+def render_camera_preview():
+    """Draw the selected camera's latest frame + barcode boxes at PREVIEW_FPS"""
+    cam = _preview_camera() if preview_on_var.get() else None
+    frame = cam.latest_frame if cam else None
+    if frame is None:
+        if _preview_state["frame"] is not None:
+            _preview_state["frame"] = None
+            _preview_state["image"] = None
+            camera_preview.config(image="", text="ไม่มีภาพกล้อง")
+    elif frame is not _preview_state["frame"]:
+        _preview_state["frame"] = frame
+        h, w = frame.shape[:2]
+        pw, ph = PREVIEW_SIZE
+        scale = min(pw / w, ph / h)
+        # resize first so colour conversion and drawing only touch the small image
+        small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(small, cv2.COLOR_BGR2RGB, dst=small)
+        codes, stamp = cam.latest_boxes
+        if codes and time.time() - stamp <= PREVIEW_BOX_TTL:
+            for code, (left, top, bw, bh) in codes:
+                p1 = (int(left * scale), int(top * scale))
+                p2 = (int((left + bw) * scale), int((top + bh) * scale))
+                cv2.rectangle(small, p1, p2, (255, 215, 0), 2)
+                cv2.putText(small, code, (p1[0], max(10, p1[1] - 4)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 215, 0), 1)
+        img_tk = ImageTk.PhotoImage(Image.fromarray(small))
+        _preview_state["image"] = img_tk
+        camera_preview.config(image=img_tk, text="")
+    root.after(int(1000 / PREVIEW_FPS), render_camera_preview)
+
+# ---------------------------
+# Scan load test (python Borrowcode.py --loadtest ...)
+# ---------------------------
+# Injects synthetic scans through submit_scan -> db_writer -> _on_scan_written
+# against scratch databases of several history sizes, and reports throughput,
+# commit latency and scan-to-screen latency. The real DB is never touched:
+# camera scans are refused while the test runs.
+LOADTEST_RATE = 5.0             # scans per second
+LOADTEST_DURATION = 30          # seconds of injection per DB size
+LOADTEST_SIZES = (1000, 10000, 50000)   # rows of history in each scratch DB
+LOADTEST_TOOLS = 200
+LOADTEST_MIX = {"borrow": 0.55, "return": 0.3, "unknown": 0.05, "duplicate": 0.1}
+LOADTEST_DRAIN_SEC = 60         # give up waiting for outstanding scans after this
+
+def _percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    out = {f"p{p}": round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 1) for p in points}
+    out["max"] = round(values[-1] * 1000, 1)
+    return out
+
+def build_loadtest_db(path, history_rows, tools=LOADTEST_TOOLS):
+    """Scratch DB at the current schema with `tools` tools and `history_rows` past transactions"""
+    global DB_FILE
+    saved, DB_FILE = DB_FILE, path
+    try:
+        init_db()
+    finally:
+        DB_FILE = saved
+    conn = connect_db(path)
+    try:
+        conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, 1000, 1000)",
+                         [(f"เครื่องมือทดสอบ {i}", f"LT{i:05d}") for i in range(1, tools + 1)])
+        start = datetime.now() - timedelta(days=365)
+        step = 365 * 86400 / max(history_rows, 1)
+        rows = []
+        for i in range(history_rows):
+            when = (start + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S")
+            rows.append((1 + (i // 2) % tools, "ยืม" if i % 2 == 0 else "คืน", f"worker{i % 50}",
+                         ("ช่างเหล็ก", "ช่างปูน")[i % 2], when))
+        conn.executemany("INSERT INTO transactions (tool_id, action, user, worker_type, date) VALUES (?, ?, ?, ?, ?)",
+                         rows)
+        borrow_audit.backfill_chain(conn, "transactions")
+        conn.commit()
+    finally:
+        conn.close()
+
+class _ScanProbe:
+    """Timestamps of one injected scan; committed() runs on the writer thread, visible() on Tk"""
+
+    def __init__(self, test, kind, code):
+        self.test = test
+        self.kind = kind
+        self.code = code
+        self.t_inject = time.perf_counter()
+        self.t_commit = None
+        self.t_visible = None
+        self.ok = None
+
+    def committed(self, fut):
+        self.t_commit = time.perf_counter()
+
+    def visible(self, result):
+        self.t_visible = time.perf_counter()
+        self.ok = result[0]
+        self.test.outstanding -= 1
+
+class ScanLoadTest:
+    def __init__(self):
+        self.active = False
+        self.errors = 0
+        self.outstanding = 0
+        self.results = []
+        self._rng = None
+
+    def run(self, sizes=LOADTEST_SIZES, rate=LOADTEST_RATE, duration=LOADTEST_DURATION,
+            mix=None, on_finished=None):
+        self._rng = random.Random(1)
+        self.active = True
+        self.results = []
+        self._sizes = list(sizes)
+        self._rate = rate
+        self._duration = duration
+        self._mix = mix or LOADTEST_MIX
+        self._on_finished = on_finished
+        self._saved_db = DB_FILE
+        self._tmpdir = tempfile.mkdtemp(prefix="borrowmate_loadtest_")
+        self._next_size()
+
+    def _switch_db(self, path):
+        global DB_FILE
+        DB_FILE = path
+        last_scan_time.clear()
+        loan_scheduler.poll()       # also moves its data_version connection to path
+        stock_alerts.rebuild()
+        refresh_tables()
+
+    def _next_size(self):
+        if not self._sizes:
+            self._finish()
+            return
+        size = self._sizes.pop(0)
+        pending_var.set(f"load test: สร้างฐานข้อมูลทดสอบ {size:,} แถว...")
+        root.update_idletasks()
+        path = os.path.join(self._tmpdir, f"loadtest_{size}.db")
+        build_loadtest_db(path, size)
+        self._switch_db(path)
+        self._size = size
+        self._probes = []
+        self._debounced = 0
+        self._lags = []
+        self._out = []          # (code, borrowed at) for later returns
+        self._last_code = None
+        self.errors = 0
+        self.outstanding = 0
+        self._ui_before = ui_updates.stats()
+        self._t0 = time.perf_counter()
+        self._count = int(self._rate * self._duration)
+        self._sent = 0
+        pending_var.set(f"load test: {size:,} แถว, {self._rate:g} scan/s")
+        self._inject()
+
+    def _pick(self):
+        r = self._rng.random()
+        kind = "return"
+        for name, share in self._mix.items():
+            if r < share:
+                kind = name
+                break
+            r -= share
+        now = time.perf_counter()
+        if kind == "duplicate" and self._last_code:
+            return kind, self._last_code, self._last_mode
+        if kind == "unknown":
+            return kind, f"NOPE{self._rng.randint(0, 10 ** 6):07d}", "borrow"
+        if kind == "return":
+            for i, (code, at) in enumerate(self._out):
+                if now - at > SCAN_DEBOUNCE_SEC + 0.1:
+                    del self._out[i]
+                    return kind, code, "return"
+        code = f"LT{self._rng.randint(1, LOADTEST_TOOLS):05d}"
+        self._out.append((code, now))
+        return "borrow", code, "borrow"
+
+    def _inject(self):
+        # absolute schedule: a late callback shows up as lag instead of drifting the rate
+        due = self._t0 + self._sent / self._rate
+        self._lags.append(max(0.0, time.perf_counter() - due))
+        kind, code, mode = self._pick()
+        probe = _ScanProbe(self, kind, code)
+        self._last_code, self._last_mode = code, mode
+        if submit_scan(code, f"loadtest{self._sent % 10}", mode, probe):
+            self.outstanding += 1
+            self._probes.append(probe)
+        else:
+            self._debounced += 1
+        self._sent += 1
+        if self._sent < self._count:
+            delay = self._t0 + self._sent / self._rate - time.perf_counter()
+            root.after(max(0, int(delay * 1000)), self._inject)
+        else:
+            self._drain_deadline = time.perf_counter() + LOADTEST_DRAIN_SEC
+            self._drain()
+
+    def _drain(self):
+        if self.outstanding > 0 and time.perf_counter() < self._drain_deadline:
+            root.after(50, self._drain)
+            return
+        self._collect()
+        self._next_size()
+
+    def _collect(self):
+        done = [p for p in self._probes if p.t_visible is not None]
+        span = (max(p.t_visible for p in done) - self._t0) if done else 0.0
+        self.results.append({
+            "history_rows": self._size,
+            "target_rate": self._rate,
+            "sent": self._sent,
+            "debounced": self._debounced,
+            "completed": len(done),
+            "unfinished": len(self._probes) - len(done),
+            "rejected": self.errors,
+            "throughput_per_min": round(len(done) / span * 60, 1) if span else 0.0,
+            "commit_ms": _percentiles([p.t_commit - p.t_inject for p in done if p.t_commit]),
+            "visible_ms": _percentiles([p.t_visible - p.t_inject for p in done]),
+            "inject_lag_ms": _percentiles(self._lags),
+            "ui_requests": ui_updates.requests - self._ui_before["requests"],
+            "ui_flushes": ui_updates.flushes - self._ui_before["flushes"],
+        })
+
+    def _finish(self):
+        self.active = False
+        self._switch_db(self._saved_db)
+        # the writer still has the last scratch DB open; remove it once it lets go
+        tmpdir = self._tmpdir
+        db_writer.release().add_done_callback(lambda f: shutil.rmtree(tmpdir, ignore_errors=True))
+        pending_var.set("")
+        if self._on_finished:
+            self._on_finished(self.results)
+
+scan_load_test = ScanLoadTest()
+
+def format_load_test(results):
+    lines = []
+    for r in results:
+        lines.append(f"history {r['history_rows']:>8,} rows | sent {r['sent']} @ {r['target_rate']:g}/s, "
+                     f"debounced {r['debounced']}, rejected {r['rejected']}, unfinished {r['unfinished']} | "
+                     f"{r['throughput_per_min']:.0f} scans/min | UI {r['ui_requests']} updates in "
+                     f"{r['ui_flushes']} flushes")
+        for key in ("commit_ms", "visible_ms", "inject_lag_ms"):
+            pct = r[key]
+            lines.append(f"    {key:<14}" + "  ".join(f"{k}={v}" for k, v in pct.items()))
+    return "\n".join(lines)
+
+def _loadtest_options(argv):
+    """--rate N --duration SEC --sizes 1000,100000 --json FILE"""
+    opts = {"rate": LOADTEST_RATE, "duration": LOADTEST_DURATION, "sizes": LOADTEST_SIZES, "json": None}
+    args = iter(argv)
+    for arg in args:
+        if arg == "--rate":
+            opts["rate"] = float(next(args))
+        elif arg == "--duration":
+            opts["duration"] = float(next(args))
+        elif arg == "--sizes":
+            opts["sizes"] = [int(x) for x in next(args).split(",") if x.strip()]
+        elif arg == "--json":
+            opts["json"] = next(args)
+    return opts
+
+def start_load_test_from_cli(argv):
+    opts = _loadtest_options(argv)
+
+    def finished(results):
+        print(format_load_test(results))
+        if opts["json"]:
+            with open(opts["json"], "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        on_closing()
+    scan_load_test.run(opts["sizes"], opts["rate"], opts["duration"], on_finished=finished)
+
 # ---------------------------
 # Barcode generation and PDF
 # ---------------------------
@@ -371,41 +2431,6 @@ def generate_barcode():
     barcode_obj.save(filepath)
     messagebox.showinfo("สำเร็จ", f"บาร์โค้ด {code} ถูกบันทึกที่\n{filepath}")
 
-def _register_th_font_prefer_paths():
-    font_name = "THSarabunNew"
-    possible_paths = [
-        resource_path("THSarabunNew.ttf"),
-        os.path.join(os.getcwd(), "THSarabunNew.ttf"),
-        r"C:\Windows\Fonts\THSarabunNew.ttf",
-        r"C:\Windows\Fonts\THSarabun.ttf",
-        "/usr/share/fonts/truetype/THSarabunNew.ttf",
-        "/usr/share/fonts/truetype/sarabun/THSarabunNew.ttf",
-        "/Library/Fonts/THSarabunNew.ttf",
-    ]
-    for p in possible_paths:
-        try:
-            if p and os.path.exists(p):
-                pdfmetrics.registerFont(TTFont(font_name, p))
-                return font_name
-        except Exception:
-            continue
-    try:
-        search_dirs = ["/usr/share/fonts", "/Library/Fonts", r"C:\Windows\Fonts"]
-        for sd in search_dirs:
-            if os.path.exists(sd):
-                for rootf, dirsf, filesf in os.walk(sd):
-                    for ff in filesf:
-                        if "sarabun" in ff.lower():
-                            candidate = os.path.join(rootf, ff)
-                            try:
-                                pdfmetrics.registerFont(TTFont(font_name, candidate))
-                                return font_name
-                            except Exception:
-                                continue
-    except Exception:
-        pass
-    return "Helvetica"
-
 def print_all_barcodes_centered_code():
     tools = fetch_tools()
     if not tools:
@@ -421,7 +2446,7 @@ def print_all_barcodes_centered_code():
     if not pdf_path:
         return
 
-    font_name = _register_th_font_prefer_paths()
+    font_name = borrow_reports.register_th_font()
     c = canvas.Canvas(pdf_path, pagesize=A4)
     width, height = A4
     c.setFont(font_name, 14)
@@ -478,6 +2503,377 @@ def print_all_barcodes_centered_code():
     c.save()
     messagebox.showinfo("สำเร็จ", f"สร้าง PDF เรียบร้อย: {pdf_path}")
 
+# ---------------------------
+# Child processes (reports, stock-take)
+# ---------------------------
+def _child_command(module, flag, args):
+    if getattr(sys, "frozen", False):
+        return [sys.executable, flag] + args
+    return [sys.executable, os.path.abspath(module.__file__)] + args
+
+def run_child_process(module, flag, args, on_done):
+    """
+    Run a sibling module's CLI in a child process and hand its JSON result
+    (written to a temp file via --json) to on_done on the Tk thread.
+    """
+    fd, result_path = tempfile.mkstemp(prefix="borrowmate_", suffix=".json")
+    os.close(fd)
+
+    def worker():
+        try:
+            proc = subprocess.run(_child_command(module, flag, args + ["--json", result_path]),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            try:
+                with open(result_path, encoding="utf-8") as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                err = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+                result = {"error": err[-1] if err else f"exit code {proc.returncode}"}
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            try:
+                os.remove(result_path)
+            except OSError:
+                pass
+        ui_updates.after_flush(lambda: on_done(result))
+    threading.Thread(target=worker, daemon=True).start()
+
+# ---------------------------
+# Monthly usage reports (separate process)
+# ---------------------------
+REPORT_DIR = ""         # ว่าง = โฟลเดอร์ reports ข้างไฟล์ฐานข้อมูล
+
+def run_report_process(period, formats, on_done, force=False):
+    """Build a report in a child process; on_done(result dict) runs on the Tk thread"""
+    args = [DB_FILE, "--month", period, "--format", ",".join(formats)]
+    if REPORT_DIR:
+        args += ["--out", REPORT_DIR]
+    if force:
+        args.append("--force")
+    run_child_process(borrow_reports, "--report", args, on_done)
+
+def open_report_dialog():
+    win = tk.Toplevel(root)
+    win.title("รายงานประจำเดือน")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.35, 0.4, 380, 300)
+
+    ttk.Label(win, text="เดือน:", background="#0D1B2A", foreground="white",
+              font=("TH Sarabun New", 13)).pack(pady=(12, 2))
+    month_var = tk.StringVar(value=borrow_reports.previous_month())
+    ttk.Combobox(win, textvariable=month_var, values=borrow_reports.recent_months(24),
+                 width=12, state="readonly").pack()
+    fmt_vars = {fmt: tk.BooleanVar(value=True) for fmt in borrow_reports.REPORT_FORMATS}
+    fmt_frame = ttk.Frame(win)
+    fmt_frame.pack(pady=8)
+    for fmt, var in fmt_vars.items():
+        ttk.Checkbutton(fmt_frame, text=fmt.upper(), variable=var).pack(side="left", padx=8)
+    force_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(win, text="สร้างใหม่แม้มีไฟล์เดิมอยู่แล้ว", variable=force_var).pack()
+    status_var = tk.StringVar(value="")
+    ttk.Label(win, textvariable=status_var, background="#0D1B2A", foreground="#FFD700",
+              font=("TH Sarabun New", 12), wraplength=340).pack(pady=8)
+
+    def on_done(result):
+        if win.winfo_exists():
+            btn.config(state="normal")
+        if "error" in result:
+            if win.winfo_exists():
+                status_var.set("")
+            messagebox.showerror("Error", f"สร้างรายงานไม่สำเร็จ: {result['error']}")
+            return
+        how = "ใช้ไฟล์เดิม (ข้อมูลไม่เปลี่ยน)" if result["cached"] else f"สร้างใหม่ใน {result['seconds']:.1f} วินาที"
+        if win.winfo_exists():
+            status_var.set(how)
+        messagebox.showinfo("รายงานประจำเดือน",
+                            f"รายงาน {result['period']}: {how}\n" + "\n".join(result["files"].values()))
+
+    def generate():
+        formats = [fmt for fmt, var in fmt_vars.items() if var.get()]
+        if not formats:
+            messagebox.showerror("Error", "กรุณาเลือกรูปแบบไฟล์อย่างน้อยหนึ่งแบบ")
+            return
+        btn.config(state="disabled")
+        status_var.set("กำลังสร้างรายงาน...")
+        run_report_process(month_var.get(), formats, on_done, force=force_var.get())
+
+    btn = ttk.Button(win, text="สร้างรายงาน", command=generate, style="Gold.TButton")
+    btn.pack(pady=6)
+
+
+# ---------------------------
+# Stock-take from shelf photos
+# ---------------------------
+STOCKTAKE_WORKERS = 0       # 0 = ทุกคอร์ของเครื่อง
+
+def start_stocktake():
+    paths = filedialog.askopenfilenames(
+        title="เลือกรูปถ่ายชั้นวาง / บอร์ดเครื่องมือ",
+        filetypes=[("Images", "*.jpg *.jpeg *.png *.tif *.tiff *.bmp"), ("All files", "*.*")])
+    if not paths:
+        return
+    args = [DB_FILE] + list(paths)
+    if STOCKTAKE_WORKERS:
+        args += ["--workers", str(STOCKTAKE_WORKERS)]
+    btn_stocktake.config(state="disabled")
+    pending_var.set(f"กำลังตรวจนับจากรูป {len(paths)} รูป...")
+    run_child_process(borrow_stocktake, "--stocktake", args, show_stocktake_result)
+
+def show_stocktake_result(result):
+    btn_stocktake.config(state="normal")
+    pending_var.set("")
+    if "error" in result:
+        messagebox.showerror("Error", f"ตรวจนับไม่สำเร็จ: {result['error']}")
+        return
+    win = tk.Toplevel(root)
+    win.title("ผลการตรวจนับสต็อก")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.8, 0.7, 800, 450)
+    stats = result["stats"]
+    ttk.Label(win, text=(f"รูป {stats['images']} รูป, {stats['tiles']} ช่อง, {stats['workers']} process, "
+                         f"{stats['seconds']} วินาที | พบ {len(result['present'])} รายการ, "
+                         f"ไม่พบ {len(result['missing'])}, ไม่รู้จัก {len(result['unknown'])}"),
+              background="#0D1B2A", foreground="#FFD700", font=("TH Sarabun New", 13)).pack(pady=6)
+
+    body = ttk.Frame(win)
+    body.pack(fill="both", expand=True, padx=10)
+    tool_cols = ("รหัส", "ชื่อเครื่องมือ", "พบในรูป", "คงเหลือ", "ทั้งหมด")
+    sections = (("พบ", tool_cols, result["present"]),
+                ("ไม่พบในรูป", tool_cols, result["missing"]),
+                ("รหัสที่ไม่รู้จัก", ("รหัส", "พบในรูป"), result["unknown"]))
+    for title, cols, rows in sections:
+        frame = ttk.LabelFrame(body, text=f"{title} ({len(rows)})")
+        frame.pack(side="left", fill="both", expand=True, padx=4)
+        tree = ttk.Treeview(frame, columns=cols, show="headings")
+        for col in cols:
+            tree.heading(col, text=col)
+            tree.column(col, width=70 if col != "ชื่อเครื่องมือ" else 150, anchor="center")
+        for row in rows:
+            tree.insert("", tk.END, values=row)
+        tree.pack(fill="both", expand=True)
+
+    def export_csv():
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")],
+                                            initialfile="stocktake.csv")
+        if not path:
+            return
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(("สถานะ",) + tool_cols)
+            for title, cols, rows in sections:
+                for row in rows:
+                    writer.writerow([title] + list(row) if len(row) == len(tool_cols)
+                                    else [title, row[0], "", row[1], "", ""])
+        messagebox.showinfo("สำเร็จ", f"บันทึกผลตรวจนับที่ {path}")
+    ttk.Button(win, text="ส่งออก CSV", command=export_csv, style="Gold.TButton").pack(pady=6)
+
+# ---------------------------
+# History filter (worker thread, rows handed to the Tk side in chunks)
+# ---------------------------
+# In-memory columnar copy of transactions used by the history filter (optional)
+TXN_SNAPSHOT_ENABLED = True
+_txn_snapshot = None
+_txn_snapshot_lock = threading.Lock()
+
+FILTER_CHUNK_ROWS = 500     # rows inserted into tree_trans per UI tick
+HISTORY_ALL = ("", "ทั้งหมด", None, None)    # (user, action, start, end) matching every row
+
+def get_txn_snapshot():
+    """TransactionSnapshot for the current DB, extended with rows committed since the last call"""
+    global _txn_snapshot
+    if _txn_snapshot is None or _txn_snapshot.db_path != DB_FILE:
+        _txn_snapshot = TransactionSnapshot(DB_FILE, connect=connect_read)
+    _txn_snapshot.extend()
+    return _txn_snapshot
+
+def _filter_query(user_val, action_val, start_val, end_val):
+    query = """
+        SELECT tr.id, tl.name, tr.action, tr.user, IFNULL(tr.reason, ''), tr.date
+        FROM transactions tr
+        JOIN tools tl ON tr.tool_id = tl.id
+        WHERE 1=1
+    """
+    params = []
+    if user_val:
+        query += " AND tr.user LIKE ?"
+        params.append(f"%{user_val}%")
+    if action_val != "ทั้งหมด":
+        query += " AND tr.action=?"
+        params.append(action_val)
+    if start_val and end_val:
+        # plain range on the column so idx_transactions_date applies (also per site)
+        query += " AND tr.date >= ? AND tr.date < ?"
+        params.append(start_val.strftime("%Y-%m-%d"))
+        params.append((end_val + timedelta(days=1)).strftime("%Y-%m-%d"))
+    query += " ORDER BY tr.id DESC"
+    return query, params
+
+def _filter_rows_snapshot(user_val, action_val, start_val, end_val):
+    """Returns (rows, info text); safe to call off the Tk thread"""
+    tool_names = {row[0]: row[1] for row in fetch_tools()}
+    start_ts = end_ts = None
+    if start_val and end_val:
+        start_ts = calendar.timegm(start_val.timetuple())
+        end_ts = calendar.timegm((end_val + timedelta(days=1)).timetuple())
+    with _txn_snapshot_lock:
+        snap = get_txn_snapshot()
+        positions = snap.filter(user=user_val or None,
+                                action=None if action_val == "ทั้งหมด" else action_val,
+                                start=start_ts, end=end_ts, tool_ids=tool_names.keys())
+        info = (f"snapshot: {len(snap):,} แถว, {snap.memory_bytes() / 1e6:.1f} MB "
+                f"({snap.bytes_per_million_rows() / 1e6:.1f} MB/ล้านแถว)")
+        rows = snap.rows(positions, tool_names)
+    return rows, info
+
+class HistoryFilter:
+    """
+    Runs history filters on a worker thread. Starting a new filter supersedes
+    the previous one: its SQL statement is aborted through the progress
+    handler / Connection.interrupt(), and any of its rows still queued are
+    dropped. Rows reach the tree FILTER_CHUNK_ROWS at a time so the first
+    ones show up immediately.
+    """
+
+    def __init__(self, tree, status_var, info_var, snapshot_var):
+        self.tree = tree                    # history Treeview
+        self.status_var = status_var        # progress / result count
+        self.info_var = info_var            # snapshot size, site count
+        self.snapshot_var = snapshot_var    # "กรองในหน่วยความจำ" checkbox
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._results = queue.Queue()
+        self._active = False        # a filter of the current generation is still delivering
+        self._pumping = False
+        self._shown = 0
+        self.criteria = HISTORY_ALL     # what the tree is showing, rerun after each write
+
+    def cancel(self):
+        self._active = False
+        with self._lock:
+            self._generation += 1
+            if self._conn is not None:
+                try:
+                    self._conn.interrupt()
+                except Exception:
+                    pass
+
+    def start(self, user_val, action_val, start_val, end_val, use_snapshot=None):
+        if use_snapshot is None:
+            # the snapshot holds this station's history only
+            use_snapshot = self.snapshot_var.get() and site_federation is None
+        self.cancel()
+        with self._lock:
+            generation = self._generation
+        self.criteria = (user_val, action_val, start_val, end_val)
+        self._shown = 0
+        self._active = True
+        self._set_status("กำลังกรอง...")
+        threading.Thread(target=self._work, name="history-filter", daemon=True,
+                         args=(generation, user_val, action_val, start_val, end_val, use_snapshot)).start()
+        if not self._pumping:
+            self._pumping = True
+            root.after(0, self._pump)
+
+    def rerun(self):
+        """Run the current filter again, e.g. after a write or a DB switch"""
+        self.start(*self.criteria)
+
+    def _set_status(self, text):
+        # the unfiltered history is not a filter result; leave the status empty
+        self.status_var.set(text if self.criteria != HISTORY_ALL else "")
+
+    def _current(self, generation):
+        return generation == self._generation
+
+    def _work(self, generation, user_val, action_val, start_val, end_val, use_snapshot):
+        try:
+            if use_snapshot:
+                rows, info = _filter_rows_snapshot(user_val, action_val, start_val, end_val)
+                self._results.put((generation, "info", info))
+                for i in range(0, len(rows), FILTER_CHUNK_ROWS):
+                    if not self._current(generation):
+                        return
+                    self._results.put((generation, "rows", rows[i:i + FILTER_CHUNK_ROWS]))
+            elif site_federation is not None:
+                federation = site_federation
+                self._results.put((generation, "info", f"{len(federation.sites)} สาขา"))
+                query, params = _filter_query(user_val, action_val, start_val, end_val)
+                query = query.replace("ORDER BY tr.id DESC", "ORDER BY tr.date DESC, tr.id DESC")
+                rows, errors = federation.merged(query, params, key=_site_history_key,
+                                                 cancelled=lambda: not self._current(generation))
+                if errors:
+                    ui_updates.after_flush(lambda: report_site_errors(errors))
+                for i in range(0, len(rows), FILTER_CHUNK_ROWS):
+                    if not self._current(generation):
+                        return
+                    self._results.put((generation, "rows", [tuple(r[1:]) + (r[0],)
+                                                            for r in rows[i:i + FILTER_CHUNK_ROWS]]))
+            else:
+                self._results.put((generation, "info", ""))
+                conn = connect_read()
+                # returning non-zero aborts the running statement
+                conn.set_progress_handler(lambda: 0 if self._current(generation) else 1, 1000)
+                with self._lock:
+                    if not self._current(generation):
+                        conn.close()
+                        return
+                    self._conn = conn
+                try:
+                    cur = conn.cursor()
+                    cur.execute(*_filter_query(user_val, action_val, start_val, end_val))
+                    while True:
+                        rows = cur.fetchmany(FILTER_CHUNK_ROWS)
+                        if not rows or not self._current(generation):
+                            break
+                        self._results.put((generation, "rows", rows))
+                finally:
+                    with self._lock:
+                        if self._conn is conn:
+                            self._conn = None
+                    conn.close()
+        except sqlite3.OperationalError as e:
+            if self._current(generation):
+                self._results.put((generation, "error", e))
+            return
+        except Exception as e:
+            self._results.put((generation, "error", e))
+            return
+        self._results.put((generation, "done", None))
+
+    def _pump(self):
+        """Tk side: apply at most one chunk of rows per tick"""
+        while True:
+            try:
+                generation, kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if not self._current(generation):
+                continue
+            if kind == "info":
+                for i in self.tree.get_children():
+                    self.tree.delete(i)
+                self.info_var.set(payload)
+                continue
+            if kind == "rows":
+                for row in payload:
+                    self.tree.insert("", tk.END, values=row)
+                self._shown += len(payload)
+                self._set_status(f"กำลังกรอง... {self._shown:,} รายการ")
+                break
+            self._active = False
+            if kind == "done":
+                self._set_status(f"พบ {self._shown:,} รายการ")
+            elif kind == "error":
+                self.status_var.set("")
+                messagebox.showerror("Error", f"กรองข้อมูลไม่สำเร็จ: {payload}")
+        if self._active:
+            root.after(15, self._pump)
+        else:
+            self._pumping = False
+
 # ---------------------------
 # small helper to set popup sizes responsively
 # ---------------------------
@@ -549,9 +2945,51 @@ style.configure("Treeview.Heading",
 frame_top = ttk.Frame(root, padding=10)
 frame_top.pack(fill="x")
 
-for i in range(14):
+for i in range(15):
     frame_top.grid_columnconfigure(i, weight=1)
 
+# Status strip: non-blocking notifications (scan errors etc.) instead of message boxes
+frame_status = tk.Frame(root, bg="#1B263B")
+frame_status.pack(fill="x", padx=10)
+toast_var = tk.StringVar(value="")
+toast_label = tk.Label(frame_status, textvariable=toast_var, anchor="w", bg="#1B263B", fg="white",
+                       font=("TH Sarabun New", 12))
+toast_label.pack(side="left", fill="x", expand=True, padx=6)
+ui_stats_var = tk.StringVar(value="")
+tk.Label(frame_status, textvariable=ui_stats_var, bg="#1B263B", fg="#778DA9",
+         font=("TH Sarabun New", 10)).pack(side="right", padx=6)
+_toast_state = {"after": None, "history": []}
+TOAST_COLORS = {"error": "#FF6B6B", "warning": "#FFD700", "info": "white"}
+
+def show_toasts(toasts):
+    history = _toast_state["history"]
+    stamp = datetime.now().strftime("%H:%M:%S")
+    history.extend((stamp, msg, level) for msg, level in toasts)
+    del history[:-TOAST_HISTORY]
+    message, level = toasts[-1]
+    if any(lvl == "error" for _, lvl in toasts):
+        level = "error"
+    extra = f"  (+{len(toasts) - 1} รายการ)" if len(toasts) > 1 else ""
+    toast_var.set(f"{stamp}  {message}{extra}")
+    toast_label.config(fg=TOAST_COLORS.get(level, "white"))
+    if _toast_state["after"] is not None:
+        root.after_cancel(_toast_state["after"])
+    _toast_state["after"] = root.after(TOAST_SEC * 1000, clear_toast)
+
+def clear_toast():
+    _toast_state["after"] = None
+    toast_var.set("")
+
+def show_toast_history(event=None):
+    history = _toast_state["history"]
+    if not history:
+        return
+    messagebox.showinfo("การแจ้งเตือนล่าสุด",
+                        "\n".join(f"{stamp}  {msg}" for stamp, msg, _ in history[-20:]))
+
+toast_label.bind("<Button-1>", show_toast_history)
+ui_updates.on_toasts = show_toasts
+
 ttk.Label(frame_top, text="ชื่อผู้ใช้:", font=("TH Sarabun New", 12),
           foreground="white", background="#0D1B2A").grid(row=0, column=0, padx=5, pady=5, sticky="w")
 entry_user = ttk.Entry(frame_top, width=20, font=("TH Sarabun New", 12))
@@ -567,8 +3005,25 @@ ttk.Label(frame_top, text="ประเภทช่าง:", font=("TH Sarabun N
 ttk.Radiobutton(frame_top, text="ช่างเหล็ก", variable=worker_type_var, value="ช่างเหล็ก").grid(row=1, column=1, padx=5, sticky="w")
 ttk.Radiobutton(frame_top, text="ช่างปูน", variable=worker_type_var, value="ช่างปูน").grid(row=1, column=2, padx=5, sticky="w")
 
+ttk.Label(frame_top, text="กำหนดคืน (ชม.):", font=("TH Sarabun New", 12),
+          foreground="white", background="#0D1B2A").grid(row=1, column=5, padx=5, pady=5, sticky="e")
+loan_hours_var = tk.StringVar(value=DEFAULT_LOAN_HOURS)
+ttk.Combobox(frame_top, textvariable=loan_hours_var, values=LOAN_HOUR_CHOICES,
+             state="readonly", width=8).grid(row=1, column=6, padx=5, sticky="w")
+btn_overdue = ttk.Button(frame_top, text="กำหนดคืน", command=open_overdue_window, style="Gold.TButton")
+btn_overdue.grid(row=1, column=7, padx=8, sticky="e")
+btn_stock_alerts = ttk.Button(frame_top, text="สต็อกต่ำ", command=open_stock_alerts_window, style="Gold.TButton")
+btn_stock_alerts.grid(row=1, column=3, padx=8, sticky="e")
+overdue_alert_var = tk.StringVar(value="")
+ttk.Label(frame_top, textvariable=overdue_alert_var, font=("TH Sarabun New", 12, "bold"),
+          foreground="#FF6B6B", background="#0D1B2A").grid(row=3, column=0, columnspan=12, padx=5, sticky="w")
+
 btn_scan = ttk.Button(frame_top, text="Start Scan (กล้อง)", command=toggle_scan, style="Gold.TButton")
 btn_scan.grid(row=0, column=4, padx=8, sticky="e")
+ttk.Button(frame_top, text="เพิ่มกล้อง", command=add_camera_dialog, style="Gold.TButton").grid(row=1, column=4, padx=8, sticky="e")
+camera_stats_var = tk.StringVar(value="")
+ttk.Label(frame_top, textvariable=camera_stats_var, font=("TH Sarabun New", 11),
+          foreground="white", background="#0D1B2A").grid(row=2, column=0, columnspan=12, padx=5, sticky="w")
 ttk.Button(frame_top, text="สร้างบาร์โค้ด", command=generate_barcode, style="Gold.TButton").grid(row=0, column=5, padx=8, sticky="e")
 ttk.Button(frame_top, text="จัดการเครื่องมือ", command=lambda: open_manage_tools(), style="Gold.TButton").grid(row=0, column=6, padx=8, sticky="e")
 ttk.Button(frame_top, text="พิมพ์บาร์โค้ดทั้งหมด (PDF)", command=print_all_barcodes_centered_code, style="Gold.TButton").grid(row=0, column=7, padx=8, sticky="e")
@@ -579,23 +3034,191 @@ db_label_var.set(os.path.basename(DB_FILE) if os.path.basename(DB_FILE) else DB_
 ttk.Button(frame_top, text="เลือกฐานข้อมูล", command=choose_database, style="Gold.TButton").grid(row=0, column=11, padx=8, sticky="e")
 ttk.Label(frame_top, textvariable=db_label_var, font=("TH Sarabun New", 11), foreground="white", background="#0D1B2A").grid(row=1, column=11, padx=8, sticky="e")
 
+# Pending writes indicator (fed by db_writer)
+pending_var = tk.StringVar(value="")
+ttk.Label(frame_top, textvariable=pending_var, font=("TH Sarabun New", 11),
+          foreground="#FFD700", background="#0D1B2A").grid(row=1, column=10, padx=8, sticky="e")
+
+def update_pending_indicator(count):
+    pending_var.set(f"กำลังบันทึก... ({count})" if count > 0 else "")
+
+ui_updates.register("pending", lambda: update_pending_indicator(db_writer.pending))
+db_writer.on_pending_change = lambda count: ui_updates.request("pending")
+
+# Read-snapshot mode toggle + replica staleness
+replica_on_var = tk.BooleanVar(value=READ_REPLICA_ENABLED)
+replica_status_var = tk.StringVar(value="")
+
+def toggle_read_replica():
+    read_replica.set_enabled(replica_on_var.get())
+    if replica_on_var.get():
+        # first copy runs off the Tk thread; views switch over once it is ready
+        replica_status_var.set("สำเนาอ่าน: กำลังคัดลอก...")
+        read_replica.sync_soon(lambda: ui_updates.after_flush(refresh_tables))
+    else:
+        refresh_tables()
+
+def refresh_replica_status():
+    if read_replica.enabled:
+        age = read_replica.staleness()
+        if read_replica.last_error is not None:
+            replica_status_var.set(f"สำเนาอ่าน: ซิงก์ไม่ได้ ({age or 0:.0f} วิ)")
+        elif age is not None:
+            replica_status_var.set(f"สำเนาอ่าน: ล่าสุด {age:.0f} วิ")
+    else:
+        replica_status_var.set("")
+    root.after(1000, refresh_replica_status)
+
+# Backup button + last result
+backup_status_var = tk.StringVar(value="")
+
+def show_backup_report(report):
+    if report["ok"]:
+        backup_status_var.set(f"สำรองล่าสุด {report['time'][11:16]}: {report['bytes'] / 1e6:.1f} MB, "
+                              f"{report['seconds']:.1f} วิ")
+    else:
+        backup_status_var.set(f"สำรองล้มเหลว {report['time'][11:16]}")
+        if report.get("manual"):
+            messagebox.showerror("Backup", f"สำรองข้อมูลไม่สำเร็จ: {report['error']}")
+        else:
+            # scheduled run: nobody is waiting on it, so no modal over the scan screen
+            ui_updates.notify(f"สำรองข้อมูลอัตโนมัติไม่สำเร็จ: {report['error']}", "error")
+
+def backup_now():
+    if not backup_scheduler.target_dir:
+        folder = filedialog.askdirectory(title="เลือกโฟลเดอร์สำรองข้อมูล (NAS)")
+        if not folder:
+            return
+        backup_scheduler.target_dir = folder
+    backup_status_var.set("กำลังสำรองข้อมูล...")
+    backup_scheduler.run_now()
+
+backup_scheduler.on_report = show_backup_report
+ttk.Button(frame_top, text="สำรองข้อมูล", command=backup_now, style="Gold.TButton").grid(row=0, column=13, padx=8, sticky="e")
+ttk.Button(frame_top, text="รายงานประจำเดือน", command=open_report_dialog,
+           style="Gold.TButton").grid(row=0, column=14, padx=8, sticky="e")
+btn_stocktake = ttk.Button(frame_top, text="ตรวจนับสต็อก (รูปถ่าย)", command=start_stocktake, style="Gold.TButton")
+btn_stocktake.grid(row=1, column=14, padx=8, sticky="e")
+ttk.Label(frame_top, textvariable=backup_status_var, font=("TH Sarabun New", 11),
+          foreground="white", background="#0D1B2A").grid(row=1, column=13, padx=5, sticky="e")
+
+ttk.Checkbutton(frame_top, text="โหมดสำเนาอ่าน", variable=replica_on_var,
+                command=toggle_read_replica).grid(row=0, column=12, padx=5, sticky="w")
+ttk.Label(frame_top, textvariable=replica_status_var, font=("TH Sarabun New", 11),
+          foreground="#FFD700", background="#0D1B2A").grid(row=1, column=12, padx=5, sticky="w")
+
+def show_migration_progress(label, done, total):
+    pending_var.set(f"อัปเดตฐานข้อมูล: {label} {done}/{total}")
+    root.update_idletasks()
+
 # Stats buttons
+def show_site_stats():
+    """Multi-site mode: borrows by worker type per site + catalogue availability per site"""
+    win = tk.Toplevel(root)
+    win.title("สถิติหลายสาขา")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.7, 0.7, 700, 500)
+
+    stats, errors = site_federation.worker_stats()
+    avail, avail_errors = site_federation.availability()
+    report_site_errors(errors + avail_errors)
+
+    cols = ("สาขา", "จำนวนรายการเครื่องมือ", "จำนวนทั้งหมด", "คงเหลือ", "ถูกยืมอยู่")
+    tree = ttk.Treeview(win, columns=cols, show="headings", height=min(len(avail), 10) or 1)
+    for col in cols:
+        tree.heading(col, text=col)
+        tree.column(col, width=130, anchor="center")
+    for row in avail:
+        tree.insert("", tk.END, values=row)
+    tree.pack(fill="x", padx=10, pady=10)
+
+    if not stats:
+        ttk.Label(win, text="No borrowing data available.", background="#0D1B2A", foreground="white").pack(pady=20)
+        return
+    sites = [name for name, _ in site_federation.sites]
+    worker_types = sorted({row[1] or "-" for row in stats})
+    counts = {(site, wt or "-"): n for site, wt, n in stats}
+    fig, ax = plt.subplots(figsize=(7, 4))
+    width = 0.8 / max(len(worker_types), 1)
+    for k, wt in enumerate(worker_types):
+        ax.bar([i + k * width for i in range(len(sites))], [counts.get((site, wt), 0) for site in sites],
+               width=width, label=wt)
+    ax.set_xticks([i + width * (len(worker_types) - 1) / 2 for i in range(len(sites))])
+    ax.set_xticklabels(sites)
+    ax.set_ylabel("Borrow count")
+    ax.set_title("Borrows by Worker Type per Site", fontsize=14, color="gold", weight="bold")
+    ax.legend(title="Worker Type")
+    canvas = FigureCanvasTkAgg(fig, master=win)
+    canvas.draw()
+    canvas.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=10)
+
+def open_multi_site_dialog():
+    win = tk.Toplevel(root)
+    win.title("มุมมองหลายสาขา")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.45, 0.5, 480, 360)
+
+    ttk.Label(win, text="ฐานข้อมูลสาขา (อ่านอย่างเดียว, ไม่คัดลอกข้อมูล)", background="#0D1B2A",
+              foreground="white", font=("TH Sarabun New", 13)).pack(pady=(10, 4))
+    listbox = tk.Listbox(win, height=8, bg="#1B263B", fg="white", selectmode="extended")
+    listbox.pack(fill="both", expand=True, padx=10)
+    include_local_var = tk.BooleanVar(value=True)
+    ttk.Checkbutton(win, text=f"รวมฐานข้อมูลของเครื่องนี้ ({os.path.basename(DB_FILE)})",
+                    variable=include_local_var).pack(pady=4)
+
+    def reload_list():
+        listbox.delete(0, tk.END)
+        for name, path in MULTI_SITE_DBS:
+            listbox.insert(tk.END, f"{name} — {path}")
+    reload_list()
+
+    def add_sites():
+        paths = filedialog.askopenfilenames(title="เลือกฐานข้อมูลสาขา (.db)",
+                                            filetypes=[("SQLite Database", "*.db"), ("All files", "*.*")])
+        for path in paths:
+            if all(path != p for _, p in MULTI_SITE_DBS):
+                MULTI_SITE_DBS.append((os.path.splitext(os.path.basename(path))[0], path))
+        reload_list()
+
+    def remove_sites():
+        for index in reversed(listbox.curselection()):
+            del MULTI_SITE_DBS[index]
+        reload_list()
+
+    def open_view():
+        sites = list(MULTI_SITE_DBS)
+        if include_local_var.get() and all(os.path.abspath(p) != os.path.abspath(DB_FILE) for _, p in sites):
+            sites.insert(0, ("สาขานี้", DB_FILE))
+        try:
+            enable_multi_site(sites)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        win.destroy()
+
+    def close_view():
+        disable_multi_site()
+        win.destroy()
+
+    btns = ttk.Frame(win)
+    btns.pack(pady=8)
+    ttk.Button(btns, text="เพิ่มไฟล์", command=add_sites, style="Gold.TButton").pack(side="left", padx=4)
+    ttk.Button(btns, text="ลบที่เลือก", command=remove_sites, style="Gold.TButton").pack(side="left", padx=4)
+    ttk.Button(btns, text="เปิดมุมมองรวม", command=open_view, style="Gold.TButton").pack(side="left", padx=4)
+    ttk.Button(btns, text="ปิดมุมมองรวม", command=close_view, style="Gold.TButton").pack(side="left", padx=4)
+
 def show_worker_stats():
+    if site_federation is not None:
+        show_site_stats()
+        return
     win = tk.Toplevel(root)
     win.title("Borrowing Statistics by Worker Type")
     win.configure(bg="#0D1B2A")
     set_toplevel_size(win, 0.6, 0.6, 600, 400)
     win.grab_set()
 
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT worker_type, COUNT(*) as count
-        FROM transactions
-        WHERE action='ยืม'
-        GROUP BY worker_type
-    """)
-    data = cur.fetchall()
+    conn = connect_read()
+    data = worker_type_counts(conn, "ยืม")
     conn.close()
 
     if not data:
@@ -633,15 +3256,8 @@ def show_disposal_stats():
     set_toplevel_size(win, 0.6, 0.6, 600, 400)
     win.grab_set()
 
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT worker_type, COUNT(*) as count
-        FROM transactions
-        WHERE action='ทิ้ง'
-        GROUP BY worker_type
-    """)
-    data = cur.fetchall()
+    conn = connect_read()
+    data = worker_type_counts(conn, "ทิ้ง")
     conn.close()
 
     if not data:
@@ -671,9 +3287,108 @@ def show_disposal_stats():
     canvas.draw()
     canvas.get_tk_widget().pack(fill="both", expand=True, padx=10, pady=10)
 
+_analytics = None
+
+def get_analytics():
+    """ToolAnalytics for the current DB (kept between calls so refreshes are incremental)"""
+    global _analytics
+    if _analytics is None or _analytics.db_path != DB_FILE:
+        _analytics = ToolAnalytics(DB_FILE, connect=connect_read)
+    return _analytics
+
+def show_utilization_stats():
+    win = tk.Toplevel(root)
+    win.title("Tool Utilization")
+    win.configure(bg="#0D1B2A")
+    set_toplevel_size(win, 0.85, 0.85, 900, 600)
+    win.grab_set()
+
+    frame_range = ttk.Frame(win, padding=5)
+    frame_range.pack(fill="x")
+    ttk.Label(frame_range, text="วันที่เริ่ม:").pack(side="left", padx=5)
+    range_start = DateEntry(frame_range, width=12, date_pattern="yyyy-mm-dd")
+    range_start.pack(side="left", padx=5)
+    ttk.Label(frame_range, text="วันที่สิ้นสุด:").pack(side="left", padx=5)
+    range_end = DateEntry(frame_range, width=12, date_pattern="yyyy-mm-dd")
+    range_end.pack(side="left", padx=5)
+    today = datetime.now().date()
+    range_start.set_date(today - timedelta(days=30))
+    range_end.set_date(today)
+    summary_var = tk.StringVar(value="")
+    ttk.Label(frame_range, textvariable=summary_var).pack(side="right", padx=10)
+
+    body = ttk.Frame(win)
+    body.pack(fill="both", expand=True)
+    frame_unused = ttk.LabelFrame(body, text="ไม่เคยถูกยืมในช่วงนี้", padding=5)
+    frame_unused.pack(side="right", fill="y", padx=10, pady=10)
+    tree_unused = ttk.Treeview(frame_unused, columns=("ID", "ชื่อเครื่องมือ", "จำนวนทั้งหมด"),
+                               show="headings", height=20)
+    for col, w in (("ID", 50), ("ชื่อเครื่องมือ", 200), ("จำนวนทั้งหมด", 90)):
+        tree_unused.heading(col, text=col)
+        tree_unused.column(col, width=w, anchor="center")
+    tree_unused.pack(fill="y", expand=True)
+
+    fig, axes = plt.subplots(2, 2, figsize=(10, 7))
+    fig.patch.set_facecolor("#0D1B2A")
+    canvas = FigureCanvasTkAgg(fig, master=body)
+    canvas.get_tk_widget().pack(side="left", fill="both", expand=True, padx=10, pady=10)
+
+    def style_axis(ax, title):
+        ax.set_title(title, fontsize=12, color="gold", weight="bold")
+        ax.set_facecolor("#0D1B2A")
+        ax.tick_params(axis='x', colors='white')
+        ax.tick_params(axis='y', colors='white')
+
+    def compute():
+        start_val = range_start.get_date()
+        end_val = range_end.get_date()
+        if start_val > end_val:
+            messagebox.showerror("Error", "วันที่เริ่มไม่ควรมากกว่าวันที่สิ้นสุด")
+            return
+        start_ts = calendar.timegm(start_val.timetuple())
+        end_ts = calendar.timegm((end_val + timedelta(days=1)).timetuple())
+        try:
+            result = get_analytics().rollup(start_ts, end_ts)
+        except Exception as e:
+            messagebox.showerror("Error", f"คำนวณสถิติไม่สำเร็จ: {e}")
+            return
+
+        rows = result["tools"]
+        label = lambda r: f"{r[0]} {str(r[1])[:25]}"   # id keeps same-name tools apart
+        top_util = sorted(rows, key=lambda r: r[5], reverse=True)[:15][::-1]
+        top_dur = sorted([r for r in rows if r[4] > 0], key=lambda r: r[4], reverse=True)[:15][::-1]
+        for ax in axes.flat:
+            ax.clear()
+        ax_util, ax_dur, ax_peak, ax_loans = axes.flat
+        ax_util.barh([label(r) for r in top_util], [r[5] * 100 for r in top_util], color="gold")
+        style_axis(ax_util, "Utilization (%)")
+        ax_dur.barh([label(r) for r in top_dur], [r[4] for r in top_dur], color="#4FC3F7")
+        style_axis(ax_dur, "Average Loan Duration (hours)")
+        ax_peak.bar(range(24), result["peak_by_hour"], color="#81C784")
+        ax_peak.set_xticks(range(0, 24, 2))
+        style_axis(ax_peak, "Peak Concurrent Checkouts by Hour")
+        top_loans = sorted(rows, key=lambda r: r[3], reverse=True)[:15][::-1]
+        ax_loans.barh([label(r) for r in top_loans], [r[3] for r in top_loans], color="#FF8A65")
+        style_axis(ax_loans, "Loans in Range")
+        fig.tight_layout()
+        canvas.draw()
+
+        for i in tree_unused.get_children():
+            tree_unused.delete(i)
+        for row in result["never_used"]:
+            tree_unused.insert("", tk.END, values=row)
+        summary_var.set(f"ยืมค้างอยู่: {result['open_loans']}   ไม่เคยถูกยืม: {len(result['never_used'])} รายการ")
+
+    ttk.Button(frame_range, text="คำนวณ", command=compute, style="Gold.TButton").pack(side="left", padx=10)
+    compute()
+
 ttk.Button(frame_top, text="สถิติการยืม", command=show_worker_stats, style="Gold.TButton").grid(row=0, column=8, padx=8, sticky="e")
 ttk.Button(frame_top, text="สถิติการทิ้ง", command=show_disposal_stats, style="Gold.TButton").grid(row=0, column=9, padx=8, sticky="e")
 ttk.Button(frame_top, text="ทิ้งเครื่องมือ", command=lambda: open_disposal_window_wrapper(), style="Gold.TButton").grid(row=0, column=10, padx=8, sticky="e")
+ttk.Button(frame_top, text="สถิติการใช้งาน", command=show_utilization_stats, style="Gold.TButton").grid(row=1, column=8, padx=8, sticky="e")
+ttk.Button(frame_top, text="หลายสาขา", command=open_multi_site_dialog,
+           style="Gold.TButton").grid(row=2, column=14, padx=8, sticky="e")
+ttk.Button(frame_top, text="ตรวจสอบประวัติ", command=open_audit_menu, style="Gold.TButton").grid(row=1, column=9, padx=8, sticky="e")
 
 # wrapper because open_disposal_window uses tree_tools which is defined later; define wrapper now
 def open_disposal_window_wrapper():
@@ -687,8 +3402,8 @@ frame_left.pack(side="left", fill="both", expand=True)
 frame_right = ttk.Frame(frame_tools, width=280)
 frame_right.pack(side="right", fill="y", padx=10)
 
-cols_tools = ("ID", "ชื่อเครื่องมือ", "รหัส", "จำนวนทั้งหมด", "จำนวนคงเหลือ")
-tree_tools = ttk.Treeview(frame_left, columns=cols_tools, show="headings")
+cols_tools = ("ID", "ชื่อเครื่องมือ", "รหัส", "จำนวนทั้งหมด", "จำนวนคงเหลือ", "สาขา")
+tree_tools = ttk.Treeview(frame_left, columns=cols_tools, show="headings", displaycolumns=cols_tools[:-1])
 for col in cols_tools:
     tree_tools.heading(col, text=col)
     tree_tools.column(col, width=140, anchor="center")
@@ -723,6 +3438,18 @@ def show_preview(event):
 
 tree_tools.bind("<<TreeviewSelect>>", show_preview)
 
+# Camera preview (replaces the separate cv2.imshow window)
+frame_camera = ttk.LabelFrame(frame_right, text="กล้อง", padding=5)
+frame_camera.pack(fill="x", pady=(0, 10))
+preview_on_var = tk.BooleanVar(value=PREVIEW_ENABLED)
+ttk.Checkbutton(frame_camera, text="แสดงภาพกล้อง", variable=preview_on_var).pack(anchor="w")
+preview_camera_var = tk.StringVar(value="")
+preview_camera_combo = ttk.Combobox(frame_camera, textvariable=preview_camera_var,
+                                    state="readonly", width=20)
+preview_camera_combo.pack(fill="x", pady=3)
+camera_preview = tk.Label(frame_camera, text="ไม่มีภาพกล้อง", relief="ridge", bg="#1B263B", fg="white")
+camera_preview.pack()
+
 # Transactions + Filter
 frame_trans = ttk.LabelFrame(root, text="ประวัติการยืมคืน", padding=10)
 frame_trans.pack(fill="both", expand=True, padx=10, pady=5)
@@ -754,7 +3481,14 @@ filter_end = DateEntry(frame_filter, width=12, background="darkblue", foreground
                        borderwidth=2, date_pattern="yyyy-mm-dd", font=("TH Sarabun New", 12))
 filter_end.grid(row=0, column=7, padx=5)
 
+FILTER_DEBOUNCE_MS = 300    # wait after the last keystroke in ผู้ใช้ before filtering
+_filter_after_id = None
+
 def apply_filter():
+    global _filter_after_id
+    if _filter_after_id is not None:
+        root.after_cancel(_filter_after_id)
+        _filter_after_id = None
     user_val = filter_user.get().strip()
     action_val = filter_action.get()
     start_val = filter_start.get_date()
@@ -762,33 +3496,14 @@ def apply_filter():
     if start_val and end_val and start_val > end_val:
         messagebox.showerror("Error", "วันที่เริ่มไม่ควรมากกว่าวันที่สิ้นสุด")
         return
-    for i in tree_trans.get_children():
-        tree_trans.delete(i)
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    query = """
-        SELECT tr.id, tl.name, tr.action, tr.user, IFNULL(tr.reason, ''), tr.date
-        FROM transactions tr
-        JOIN tools tl ON tr.tool_id = tl.id
-        WHERE 1=1
-    """
-    params = []
-    if user_val:
-        query += " AND tr.user LIKE ?"
-        params.append(f"%{user_val}%")
-    if action_val != "ทั้งหมด":
-        query += " AND tr.action=?"
-        params.append(action_val)
-    if start_val and end_val:
-        query += " AND DATE(tr.date) BETWEEN ? AND ?"
-        params.append(start_val.strftime("%Y-%m-%d"))
-        params.append(end_val.strftime("%Y-%m-%d"))
-    query += " ORDER BY tr.id DESC"
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    for row in rows:
-        tree_trans.insert("", tk.END, values=row)
+    history_filter.start(user_val, action_val, start_val, end_val)
+
+def schedule_filter(event=None):
+    """As-you-type filtering on ผู้ใช้, debounced by FILTER_DEBOUNCE_MS"""
+    global _filter_after_id
+    if _filter_after_id is not None:
+        root.after_cancel(_filter_after_id)
+    _filter_after_id = root.after(FILTER_DEBOUNCE_MS, apply_filter)
 
 def reset_filter():
     filter_user.delete(0, tk.END)
@@ -796,13 +3511,23 @@ def reset_filter():
     today = datetime.now().date()
     filter_start.set_date(today)
     filter_end.set_date(today)
-    refresh_transactions_all()
+    history_filter.start(*HISTORY_ALL)
 
 ttk.Button(frame_filter, text="กรอง", command=apply_filter, style="Gold.TButton").grid(row=0, column=8, padx=10)
 ttk.Button(frame_filter, text="รีเซ็ต", command=reset_filter, style="Gold.TButton").grid(row=0, column=9, padx=5)
-
-cols_trans = ("ID", "ชื่อเครื่องมือ", "การทำรายการ", "ผู้ใช้", "เหตุผล", "วันที่")
-tree_trans = ttk.Treeview(frame_trans, columns=cols_trans, show="headings", height=8)
+snapshot_on_var = tk.BooleanVar(value=TXN_SNAPSHOT_ENABLED)
+ttk.Checkbutton(frame_filter, text="กรองในหน่วยความจำ", variable=snapshot_on_var).grid(row=0, column=10, padx=5)
+snapshot_info_var = tk.StringVar(value="")
+ttk.Label(frame_filter, textvariable=snapshot_info_var, font=("TH Sarabun New", 11),
+          background="#0D1B2A", foreground="white").grid(row=0, column=11, padx=5)
+filter_status_var = tk.StringVar(value="")
+ttk.Label(frame_filter, textvariable=filter_status_var, font=("TH Sarabun New", 11),
+          background="#0D1B2A", foreground="#FFD700").grid(row=0, column=12, padx=5)
+filter_user.bind("<KeyRelease>", schedule_filter)
+
+cols_trans = ("ID", "ชื่อเครื่องมือ", "การทำรายการ", "ผู้ใช้", "เหตุผล", "วันที่", "สาขา")
+tree_trans = ttk.Treeview(frame_trans, columns=cols_trans, show="headings", height=8,
+                          displaycolumns=cols_trans[:-1])
 for col in cols_trans:
     tree_trans.heading(col, text=col)
     if col == "เหตุผล":
@@ -810,6 +3535,7 @@ for col in cols_trans:
     else:
         tree_trans.column(col, width=140, anchor="center")
 tree_trans.pack(fill="both", expand=True, padx=5, pady=(5,10))
+history_filter = HistoryFilter(tree_trans, filter_status_var, snapshot_info_var, snapshot_on_var)
 
 # ---------------------------
 # Disposal window (actual implementation)
@@ -868,21 +3594,26 @@ def open_disposal_window():
             messagebox.showerror("Error", "จำนวนต้องมากกว่า 0")
             return
 
-        success, msg = dispose_tool(tool_id, qty, reason)
-        if not success:
-            messagebox.showerror("Error", msg)
-            return
-
-        try:
-            insert_transaction(tool_id, "ทิ้ง", disposer, worker_type_var.get(), reason)
-        except Exception:
-            messagebox.showwarning("Warning", "ทิ้งเรียบร้อย แต่ไม่สามารถบันทึกเป็น transaction ได้")
+        def on_done(result):
+            success, msg = result
+            if not success:
+                messagebox.showerror("Error", msg)
+                return
+            messagebox.showinfo("สำเร็จ", msg)
+            refresh_tables()
+            if win.winfo_exists():
+                win.destroy()
 
-        messagebox.showinfo("สำเร็จ", msg)
-        refresh_tables()
-        win.destroy()
+        btn_confirm.config(state="disabled")
+        def on_error(exc):
+            _show_write_error(exc)
+            if win.winfo_exists():
+                btn_confirm.config(state="normal")
+        db_writer.submit(dispose_and_log, tool_id, qty, reason, disposer, worker_type_var.get(),
+                         on_done=on_done, on_error=on_error)
 
-    ttk.Button(frame, text="ยืนยันการทิ้ง", command=confirm_disposal, style="Gold.TButton").pack(pady=10)
+    btn_confirm = ttk.Button(frame, text="ยืนยันการทิ้ง", command=confirm_disposal, style="Gold.TButton")
+    btn_confirm.pack(pady=10)
 
 # ---------------------------
 # Manage Tools Window
@@ -928,9 +3659,10 @@ def open_manage_tools():
         if not name or not code or not qty.isdigit():
             messagebox.showerror("Error", "กรอกข้อมูลไม่ถูกต้อง")
             return
-        add_tool(name, code, int(qty), image_path)
-        refresh_tools_table_in_manage()
-        refresh_tables()
+        def on_done(_):
+            refresh_tools_table_in_manage()
+            refresh_tables()
+        db_writer.submit(add_tool, name, code, int(qty), image_path, on_done=on_done)
         entry_name.delete(0, tk.END)
         entry_code.delete(0, tk.END)
         entry_qty.delete(0, tk.END)
@@ -940,146 +3672,152 @@ def open_manage_tools():
     frame_list = ttk.LabelFrame(win, text="รายการเครื่องมือ", padding=10)
     frame_list.pack(fill="both", expand=True, padx=10, pady=10)
 
-    cols = ("ID", "ชื่อเครื่องมือ", "รหัส", "จำนวนทั้งหมด", "จำนวนคงเหลือ", "รูป")
-    tree_manage = ttk.Treeview(frame_list, columns=cols, show="headings")
+    cols = ("ID", "ชื่อเครื่องมือ", "รหัส", "จำนวนทั้งหมด", "จำนวนคงเหลือ", "รูป", "ขั้นต่ำ")
+    tree_manage = ttk.Treeview(frame_list, columns=cols, show="headings", selectmode="extended")
     for col in cols:
         tree_manage.heading(col, text=col)
         tree_manage.column(col, width=140, anchor="center")
     tree_manage.pack(fill="both", expand=True)
 
     def refresh_tools_table_in_manage():
+        if not tree_manage.winfo_exists():
+            return
         for i in tree_manage.get_children():
             tree_manage.delete(i)
-        for row in fetch_tools():
+        for row in fetch_tools(with_minimum=True):
             tree_manage.insert("", tk.END, values=row)
     refresh_tools_table_in_manage()
 
-    def delete_selected():
-        selected = tree_manage.selection()
-        if not selected:
-            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะลบ")
-            return
-        item = tree_manage.item(selected[0])['values']
-        tool_id = item[0]
-        confirm = messagebox.askyesno("ยืนยัน", f"ต้องการลบ {item[1]} ใช่หรือไม่?")
-        if confirm:
-            delete_tool(tool_id)
+    def selected_tools():
+        return [tree_manage.item(i)['values'] for i in tree_manage.selection()]
+
+    def run_bulk(op, items, qty=0, reason=None, user=None):
+        tool_ids = [item[0] for item in items]
+
+        def on_done(result):
+            applied, failures = result
             refresh_tools_table_in_manage()
             refresh_tables()
-
-    def increase_selected():
-        selected = tree_manage.selection()
-        if not selected:
-            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะเพิ่มจำนวน")
-            return
-        item = tree_manage.item(selected[0])['values']
-        tool_id = item[0]
-        name = item[1]
+            if failures:
+                lines = [f"- {name or tool_id}: {msg}" for tool_id, name, msg in failures[:15]]
+                if len(failures) > 15:
+                    lines.append(f"... และอีก {len(failures) - 15} รายการ")
+                messagebox.showwarning("บางรายการไม่สำเร็จ",
+                                       f"สำเร็จ {applied} รายการ, ไม่สำเร็จ {len(failures)} รายการ\n" + "\n".join(lines))
+        db_writer.submit(bulk_update_tools, op, tool_ids, qty, reason, user, worker_type_var.get(),
+                         on_done=on_done)
+
+    def ask_bulk_qty(title, prompt, items, op, with_reason=False):
         qty_win = tk.Toplevel(win)
-        qty_win.title("เพิ่มจำนวน")
+        qty_win.title(title)
         qty_win.configure(bg="#0D1B2A")
-        set_toplevel_size(qty_win, 0.35, 0.25, 320, 160)
+        set_toplevel_size(qty_win, 0.35, 0.4 if with_reason else 0.25, 340, 300 if with_reason else 170)
         qty_win.grab_set()
 
-        ttk.Label(qty_win, text=f"เพิ่มจำนวนให้ {name}", font=("TH Sarabun New", 13),
-                  background="#0D1B2A", foreground="white").pack(pady=10)
-        entry_add = ttk.Entry(qty_win, width=12, font=("TH Sarabun New", 12))
-        entry_add.pack(pady=5)
-        def confirm_add():
-            val = entry_add.get().strip()
+        names = ", ".join(str(item[1]) for item in items[:3])
+        if len(items) > 3:
+            names += f" และอีก {len(items) - 3} รายการ"
+        ttk.Label(qty_win, text=f"{prompt} ({len(items)} รายการ): {names}", font=("TH Sarabun New", 13),
+                  background="#0D1B2A", foreground="white", wraplength=320).pack(pady=8)
+        entry_qty_bulk = ttk.Entry(qty_win, width=12, font=("TH Sarabun New", 12))
+        entry_qty_bulk.pack(pady=5)
+        entry_by = reason_box = None
+        if with_reason:
+            ttk.Label(qty_win, text="ผู้ทำรายการ:").pack()
+            entry_by = ttk.Entry(qty_win, width=30)
+            entry_by.insert(0, entry_user.get().strip())
+            entry_by.pack(pady=3)
+            ttk.Label(qty_win, text="เหตุผล (หมายเหตุ):").pack()
+            reason_box = tk.Text(qty_win, height=3, width=36)
+            reason_box.pack(pady=3)
+
+        def confirm():
+            val = entry_qty_bulk.get().strip()
             if not val.isdigit() or int(val) <= 0:
                 messagebox.showerror("Error", "กรุณากรอกจำนวนที่ถูกต้อง (ตัวเลข > 0)")
                 return
-            add_val = int(val)
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("SELECT total_qty, available_qty FROM tools WHERE id=?", (tool_id,))
-            res = cur.fetchone()
-            if not res:
-                conn.close()
-                messagebox.showerror("Error", "ไม่พบข้อมูลเครื่องมือ")
-                qty_win.destroy()
-                return
-            total_qty, avail_qty = res
-            new_total = total_qty + add_val
-            new_avail = avail_qty + add_val
-            if new_avail > new_total:
-                new_avail = new_total
-            cur.execute("UPDATE tools SET total_qty=?, available_qty=? WHERE id=?",
-                        (new_total, new_avail, tool_id))
-            conn.commit()
-            conn.close()
-            refresh_tools_table_in_manage()
-            refresh_tables()
+            user = reason = None
+            if with_reason:
+                user = entry_by.get().strip()
+                if not user:
+                    messagebox.showerror("Error", "กรุณากรอกชื่อผู้ทำรายการ")
+                    return
+                reason = reason_box.get("1.0", tk.END).strip()
+            run_bulk(op, items, int(val), reason, user)
             qty_win.destroy()
-        ttk.Button(qty_win, text="ยืนยัน", command=confirm_add, style="Gold.TButton").pack(pady=10)
+        ttk.Button(qty_win, text="ยืนยัน", command=confirm, style="Gold.TButton").pack(pady=10)
 
-    def decrease_selected():
-        selected = tree_manage.selection()
-        if not selected:
-            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะลดจำนวน")
+    def delete_selected():
+        items = selected_tools()
+        if not items:
+            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะลบ")
             return
-        item = tree_manage.item(selected[0])['values']
-        tool_id = item[0]
-        name = item[1]
-        qty_win = tk.Toplevel(win)
-        qty_win.title("ลดจำนวน (ลดเฉพาะจำนวนคงเหลือ)")
-        qty_win.configure(bg="#0D1B2A")
-        set_toplevel_size(qty_win, 0.35, 0.3, 320, 180)
-        qty_win.grab_set()
+        label = items[0][1] if len(items) == 1 else f"{len(items)} รายการ"
+        if messagebox.askyesno("ยืนยัน", f"ต้องการลบ {label} ใช่หรือไม่?"):
+            run_bulk("delete", items)
 
-        ttk.Label(qty_win, text=f"ลดจำนวนคงเหลือของ {name}", font=("TH Sarabun New", 13),
-                  background="#0D1B2A", foreground="white").pack(pady=8)
-        ttk.Label(qty_win, text="ใส่จำนวนที่จะลด (จะลดเฉพาะจำนวนคงเหลือ)", font=("TH Sarabun New", 11),
-                  background="#0D1B2A", foreground="white").pack()
-        entry_dec = ttk.Entry(qty_win, width=12, font=("TH Sarabun New", 12))
-        entry_dec.pack(pady=6)
+    def increase_selected():
+        items = selected_tools()
+        if not items:
+            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะเพิ่มจำนวน")
+            return
+        ask_bulk_qty("เพิ่มจำนวน", "เพิ่มจำนวนให้", items, "add")
 
-        def confirm_dec():
-            val = entry_dec.get().strip()
-            if not val.isdigit() or int(val) <= 0:
-                messagebox.showerror("Error", "กรุณากรอกจำนวนที่ถูกต้อง (ตัวเลข > 0)")
-                return
-            dec_val = int(val)
-            conn = sqlite3.connect(DB_FILE)
-            cur = conn.cursor()
-            cur.execute("SELECT total_qty, available_qty FROM tools WHERE id=?", (tool_id,))
-            res = cur.fetchone()
-            if not res:
-                conn.close()
-                messagebox.showerror("Error", "ไม่พบข้อมูลเครื่องมือ")
-                qty_win.destroy()
-                return
-            total_qty, avail_qty = res
+    def decrease_selected():
+        items = selected_tools()
+        if not items:
+            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะลดจำนวน")
+            return
+        ask_bulk_qty("ลดจำนวน (ลดเฉพาะจำนวนคงเหลือ)", "ลดจำนวนคงเหลือของ", items, "reduce")
 
-            if dec_val > avail_qty:
-                conn.close()
-                messagebox.showerror("Error", f"ไม่สามารถลดได้มากกว่า {avail_qty} (จำนวนที่คงเหลือในคลังตอนนี้)")
+    def set_minimum_selected():
+        items = selected_tools()
+        if not items:
+            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะตั้งค่าขั้นต่ำ")
+            return
+        min_win = tk.Toplevel(win)
+        min_win.title("จำนวนขั้นต่ำ (แจ้งเตือนสต็อกต่ำ)")
+        min_win.configure(bg="#0D1B2A")
+        set_toplevel_size(min_win, 0.35, 0.25, 340, 170)
+        min_win.grab_set()
+        ttk.Label(min_win, text=f"แจ้งเตือนเมื่อคงเหลือต่ำกว่า ({len(items)} รายการ, 0 = ไม่แจ้ง)",
+                  background="#0D1B2A", foreground="white", font=("TH Sarabun New", 13)).pack(pady=8)
+        entry_min = ttk.Entry(min_win, width=12, font=("TH Sarabun New", 12))
+        entry_min.pack(pady=5)
+
+        def confirm():
+            val = entry_min.get().strip()
+            if not val.isdigit():
+                messagebox.showerror("Error", "กรุณากรอกจำนวนที่ถูกต้อง (ตัวเลข >= 0)")
                 return
-            new_avail = avail_qty - dec_val
-            cur.execute("UPDATE tools SET available_qty=? WHERE id=?", (new_avail, tool_id))
-            conn.commit()
-            conn.close()
-            refresh_tools_table_in_manage()
-            refresh_tables()
-            qty_win.destroy()
-
-        ttk.Button(qty_win, text="ยืนยัน", command=confirm_dec, style="Gold.TButton").pack(pady=10)
+            run_bulk("min", items, int(val))
+            min_win.destroy()
+        ttk.Button(min_win, text="ยืนยัน", command=confirm, style="Gold.TButton").pack(pady=10)
+
+    def dispose_selected():
+        items = selected_tools()
+        if not items:
+            messagebox.showerror("Error", "กรุณาเลือกเครื่องมือที่จะทิ้ง")
+            return
+        ask_bulk_qty("ทิ้งเครื่องมือ", "จำนวนที่จะทิ้งต่อรายการ", items, "dispose", with_reason=True)
 
     btn_frame = ttk.Frame(win)
     btn_frame.pack(pady=5)
     ttk.Button(btn_frame, text="ลบเครื่องมือที่เลือก", command=delete_selected, style="Gold.TButton").pack(side="left", padx=5)
     ttk.Button(btn_frame, text="เพิ่มจำนวน (บวก)", command=increase_selected, style="Gold.TButton").pack(side="left", padx=5)
     ttk.Button(btn_frame, text="ลดจำนวน (ลบ)", command=decrease_selected, style="Gold.TButton").pack(side="left", padx=5)
+    ttk.Button(btn_frame, text="ทิ้งที่เลือก", command=dispose_selected, style="Gold.TButton").pack(side="left", padx=5)
+    ttk.Button(btn_frame, text="ตั้งค่าขั้นต่ำ", command=set_minimum_selected, style="Gold.TButton").pack(side="left", padx=5)
 
 # ---------------------------
 # Initialize DB and run UI
 # ---------------------------
 # Initialize DB (will create file/tables if needed)
 try:
-    init_db()
+    init_db(progress=show_migration_progress)
 except Exception as e:
     messagebox.showwarning("Warning", f"init_db failed: {e}")
+pending_var.set("")
 
 # Set filters default dates
 try:
@@ -1088,14 +3826,30 @@ try:
 except Exception:
     pass
 
+db_writer.start()
+read_replica.start()
+backup_scheduler.start()
+if read_replica.enabled:
+    read_replica.sync()
+loan_scheduler.rebuild()
+stock_alerts.rebuild()
+stock_alerts.schedule()
+ui_updates.start()
 refresh_tables()
 update_scan_button_state()
+refresh_camera_stats()
+render_camera_preview()
+refresh_replica_status()
+if AUDIT_CHECKPOINT_INTERVAL_MIN > 0:
+    root.after(AUDIT_CHECKPOINT_INTERVAL_MIN * 60 * 1000, schedule_audit)
 
 def on_closing():
-    global scanning
-    if scanning:
-        scanning = False
+    scanner.stop()
+    db_writer.on_pending_change = None
+    db_writer.stop()
     root.after(200, root.destroy)
 
 root.protocol("WM_DELETE_WINDOW", on_closing)
+if "--loadtest" in sys.argv:
+    root.after(500, lambda: start_load_test_from_cli(sys.argv[sys.argv.index("--loadtest") + 1:]))
 root.mainloop() 
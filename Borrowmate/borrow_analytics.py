@@ -0,0 +1,405 @@
+# borrow_analytics.py
+# NumPy column stores over the transactions table for BorrowMate:
+# tool utilization analytics (สถิติการใช้งาน) and the in-memory history filter
+import calendar
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+CHUNK_ROWS = 50000          # rows pulled from transactions per query
+CACHE_TTL_SEC = 60          # rollups whose range reaches "now" are recomputed after this
+
+ACTION_CODES = {"ยืม": 1, "คืน": -1}   # anything else (ทิ้ง) is ignored for loans
+
+
+def pair_loans(group, ts, act):
+    """
+    FIFO-pair borrows (act=1) with returns (act=-1) inside each group,
+    fully vectorized.
+
+    Returns (borrow_pos, return_pos) index arrays into the inputs; return_pos
+    is -1 for loans that are still open. A return with no earlier unmatched
+    borrow in its group (e.g. history older than the DB) is ignored.
+    """
+    n = len(ts)
+    if n == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    order = np.lexsort((np.arange(n), ts, group))
+    g = group[order]
+    a = act[order].astype(np.int64)
+
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = g[1:] != g[:-1]
+    gidx = np.cumsum(new_group) - 1
+    starts = np.flatnonzero(new_group)
+
+    def per_group_cumsum(values):
+        c = np.cumsum(values)
+        before = np.concatenate(([0], c))[starts]
+        return c - before[gidx]
+
+    # running balance per group; a return is an orphan when it pushes the
+    # balance to a new low below zero. The gidx*big offset makes
+    # maximum.accumulate restart at every group.
+    bal = per_group_cumsum(a)
+    big = 2 * n + 1
+    deficit = np.maximum.accumulate(gidx * big - bal) - gidx * big
+    deficit = np.maximum(deficit, 0)
+    prev_deficit = np.concatenate(([0], deficit[:-1]))
+    prev_deficit[new_group] = 0
+    is_borrow = a == 1
+    is_return = (a == -1) & (deficit <= prev_deficit)
+
+    # k-th valid return in a group closes the k-th borrow of that group
+    rank_b = per_group_cumsum(is_borrow)
+    rank_r = per_group_cumsum(is_return)
+    bpos = np.flatnonzero(is_borrow)
+    rpos = np.flatnonzero(is_return)
+    bkey = gidx[bpos] * (n + 1) + rank_b[bpos]
+    rkey = gidx[rpos] * (n + 1) + rank_r[rpos]
+    match = np.searchsorted(bkey, rkey)
+
+    return_pos = np.full(len(bpos), -1, dtype=np.int64)
+    return_pos[match] = order[rpos]
+    return order[bpos], return_pos
+
+
+def match_returns(ids, tools, users, act):
+    """
+    Which return closed which borrow, for history written before loans were
+    tracked. Rows are ordered by id. The first pass pairs FIFO per (tool, user);
+    borrows and returns left over are then paired per tool, since a colleague
+    may have returned the item. Returns ({borrow id: return id}, [borrow ids
+    with no later return]).
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    tools = np.asarray(tools, dtype=np.int64)
+    users = np.asarray(users, dtype=np.int64)
+    act = np.asarray(act, dtype=np.int8)
+    closed = {}
+    rest = np.arange(len(ids))
+    for group in (tools * (int(users.max(initial=0)) + 1) + users, tools):
+        bpos, rpos = pair_loans(group[rest], ids[rest], act[rest])
+        paired = rpos >= 0
+        closed.update(zip(ids[rest[bpos[paired]]].tolist(), ids[rest[rpos[paired]]].tolist()))
+        used = np.zeros(len(rest), dtype=bool)
+        used[bpos[paired]] = True
+        used[rpos[paired]] = True
+        rest = rest[~used]
+    still_out = ids[rest[act[rest] == 1]].tolist()
+    return closed, still_out
+
+
+def peak_concurrency_by_hour(starts, ends, range_start, range_end):
+    """Highest number of tools out at once for each hour of the day (0-23)"""
+    peak = np.zeros(24, dtype=np.int64)
+    if len(starts) == 0:
+        return peak
+    times = np.concatenate((starts, ends))
+    deltas = np.concatenate((np.ones(len(starts), dtype=np.int64),
+                             -np.ones(len(ends), dtype=np.int64)))
+    order = np.lexsort((deltas, times))     # returns before borrows at the same second
+    times = times[order]
+    level = np.cumsum(deltas[order])
+    # level carried into every hour boundary, so long loans count in hours without events
+    first_hour = -(-range_start // 3600) * 3600
+    bounds = np.arange(first_hour, range_end, 3600, dtype=np.int64)
+    pos = np.searchsorted(times, bounds, side="right") - 1
+    bound_level = np.where(pos >= 0, level[np.maximum(pos, 0)], 0)
+    inside = times < range_end
+    np.maximum.at(peak, (times[inside] // 3600) % 24, level[inside])
+    np.maximum.at(peak, (bounds // 3600) % 24, bound_level)
+    return peak
+
+
+class ToolAnalytics:
+    """
+    Column arrays of the transactions table, loaded in chunks and extended
+    incrementally (id > last loaded id). Rollups are cached per date range
+    and only recomputed when new rows fall inside the range.
+    """
+
+    def __init__(self, db_path, connect=None):
+        self.db_path = db_path
+        self._connect = connect or (lambda: sqlite3.connect(db_path))
+        self.last_id = 0
+        self.users = {}
+        self._chunks = []
+        self._arrays = None
+        self._cache = {}
+
+    def _columns(self):
+        if self._chunks:
+            parts = [self._arrays] if self._arrays is not None else []
+            parts += self._chunks
+            self._arrays = tuple(np.concatenate(cols) for cols in zip(*parts))
+            self._chunks = []
+        if self._arrays is None:
+            self._arrays = (np.empty(0, np.int64), np.empty(0, np.int64),
+                            np.empty(0, np.int64), np.empty(0, np.int8))
+        return self._arrays
+
+    def refresh(self):
+        """Load transactions added since the last call. Returns (rows, oldest new timestamp)"""
+        conn = self._connect()
+        cur = conn.cursor()
+        loaded = 0
+        oldest = None
+        try:
+            while True:
+                cur.execute("""
+                    SELECT id, tool_id, user, action, CAST(strftime('%s', date) AS INTEGER)
+                    FROM transactions
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (self.last_id, CHUNK_ROWS))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                ids, tools, users, actions, dates = zip(*rows)
+                user_codes = [self.users.setdefault(u, len(self.users)) for u in users]
+                act = np.array([ACTION_CODES.get(a, 0) for a in actions], dtype=np.int8)
+                ts = np.array([d or 0 for d in dates], dtype=np.int64)
+                self._chunks.append((np.array(tools, dtype=np.int64),
+                                     np.array(user_codes, dtype=np.int64), ts, act))
+                self.last_id = ids[-1]
+                loaded += len(rows)
+                chunk_oldest = int(ts[ts > 0].min()) if (ts > 0).any() else None
+                if chunk_oldest is not None and (oldest is None or chunk_oldest < oldest):
+                    oldest = chunk_oldest
+        finally:
+            conn.close()
+        return loaded, oldest
+
+    def _compute(self, range_start, range_end):
+        tool, user, ts, act = self._columns()
+        keep = (ts > 0) & (ts < range_end) & (act != 0)
+        tool, user, ts, act = tool[keep], user[keep], ts[keep], act[keep]
+        size = int(tool.max()) + 1 if len(tool) else 1
+
+        group = tool * (len(self.users) + 1) + user
+        bpos, rpos = pair_loans(group, ts, act)
+        loan_tool = tool[bpos]
+        loan_start = ts[bpos]
+        closed = rpos >= 0
+        loan_end = np.where(closed, ts[np.maximum(rpos, 0)], range_end)
+
+        in_range = loan_start >= range_start
+        loans = np.bincount(loan_tool[in_range], minlength=size)
+        done = in_range & closed
+        closed_count = np.bincount(loan_tool[done], minlength=size)
+        closed_secs = np.bincount(loan_tool[done], weights=(loan_end - loan_start)[done], minlength=size)
+
+        clip_start = np.maximum(loan_start, range_start)
+        clip_end = np.minimum(loan_end, range_end)
+        overlap = clip_end > clip_start
+        busy_secs = np.bincount(loan_tool[overlap], weights=(clip_end - clip_start)[overlap], minlength=size)
+        peak = peak_concurrency_by_hour(clip_start[overlap], clip_end[overlap], range_start, range_end)
+        return {
+            "loans": loans,
+            "closed_count": closed_count,
+            "closed_secs": closed_secs,
+            "busy_secs": busy_secs,
+            "peak_by_hour": peak,
+            "open_loans": int((~closed).sum()),
+        }
+
+    def rollup(self, range_start, range_end):
+        """
+        Per-tool utilization for [range_start, range_end) (epoch seconds, local
+        wall-clock as stored in the DB). Returns a dict with "tools" rows
+        (id, name, total_qty, loans, avg_hours, utilization), "never_used",
+        "peak_by_hour" and "open_loans".
+        """
+        now = calendar.timegm(time.localtime())   # DB stores local wall-clock time
+        _, oldest_new = self.refresh()
+        if oldest_new is not None:
+            # new rows only change ranges that end after them
+            for key in [k for k in self._cache if oldest_new < k[1]]:
+                del self._cache[key]
+        key = (range_start, range_end)
+        entry = self._cache.get(key)
+        if entry is None or (range_end > entry[0] and time.time() - entry[2] > CACHE_TTL_SEC):
+            effective_end = min(range_end, now)
+            entry = (effective_end, self._compute(range_start, max(effective_end, range_start + 1)), time.time())
+            self._cache[key] = entry
+        effective_end, raw, _ = entry
+
+        conn = self._connect()
+        try:
+            tools = conn.execute("SELECT id, name, total_qty FROM tools ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+        span = max(effective_end - range_start, 1)
+        size = len(raw["loans"])
+        rows = []
+        never_used = []
+        for tool_id, name, total_qty in tools:
+            inside = 0 <= tool_id < size
+            loans = int(raw["loans"][tool_id]) if inside else 0
+            closed_count = int(raw["closed_count"][tool_id]) if inside else 0
+            avg_hours = float(raw["closed_secs"][tool_id] / closed_count / 3600) if closed_count else 0.0
+            busy = float(raw["busy_secs"][tool_id]) if inside else 0.0
+            utilization = busy / (span * total_qty) if total_qty else 0.0
+            rows.append((tool_id, name, total_qty, loans, avg_hours, utilization))
+            if loans == 0 and busy == 0:
+                never_used.append((tool_id, name, total_qty))
+        return {
+            "tools": rows,
+            "never_used": never_used,
+            "peak_by_hour": raw["peak_by_hour"].tolist(),
+            "open_loans": raw["open_loans"],
+        }
+
+
+class _Dictionary:
+    """value <-> small int code, codes assigned in order of first appearance"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, items):
+        codes = self.codes
+        out = []
+        for item in items:
+            code = codes.get(item)
+            if code is None:
+                code = codes[item] = len(self.values)
+                self.values.append(item)
+            out.append(code)
+        return out
+
+    def matching(self, predicate):
+        return np.array([c for c, v in enumerate(self.values) if predicate(v)], dtype=np.int32)
+
+    def nbytes(self):
+        return sum(sys.getsizeof(v) for v in self.values) + sys.getsizeof(self.codes)
+
+
+class TransactionSnapshot:
+    """
+    In-memory columnar copy of the transactions table for client-side
+    filtering. user / action / worker_type are dictionary-encoded, dates are
+    epoch seconds (local wall-clock), and every column is a NumPy array so a
+    filter is a handful of vectorized masks. Built once, then extend() only
+    reads rows with id > the last loaded id.
+    """
+
+    COLUMNS = (("id", np.int64), ("tool_id", np.int32), ("action", np.int8),
+               ("user", np.int32), ("worker_type", np.int16), ("reason", np.int32),
+               ("date", np.int64))
+
+    def __init__(self, db_path, connect=None):
+        self.db_path = db_path
+        self._connect = connect or (lambda: sqlite3.connect(db_path))
+        self.last_id = 0
+        self.actions = _Dictionary()
+        self.users = _Dictionary()
+        self.worker_types = _Dictionary()
+        self.reasons = _Dictionary()
+        self.reasons.encode([""])   # code 0 = no reason
+        self._chunks = []
+        self._cols = {name: np.empty(0, dtype) for name, dtype in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.columns()["id"])
+
+    def columns(self):
+        if self._chunks:
+            merged = {}
+            for name, _ in self.COLUMNS:
+                merged[name] = np.concatenate([self._cols[name]] + [c[name] for c in self._chunks])
+            self._cols = merged
+            self._chunks = []
+        return self._cols
+
+    def extend(self):
+        """Append rows committed since the last call. Returns the number of new rows"""
+        conn = self._connect()
+        cur = conn.cursor()
+        added = 0
+        try:
+            while True:
+                cur.execute("""
+                    SELECT id, tool_id, action, user, worker_type, reason,
+                           IFNULL(CAST(strftime('%s', date) AS INTEGER), 0)
+                    FROM transactions
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (self.last_id, CHUNK_ROWS))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                ids, tools, actions, users, worker_types, reasons, dates = zip(*rows)
+                self._chunks.append({
+                    "id": np.array(ids, dtype=np.int64),
+                    "tool_id": np.array(tools, dtype=np.int32),
+                    "action": np.array(self.actions.encode(actions), dtype=np.int8),
+                    "user": np.array(self.users.encode(users), dtype=np.int32),
+                    "worker_type": np.array(self.worker_types.encode(worker_types), dtype=np.int16),
+                    "reason": np.array(self.reasons.encode([r or "" for r in reasons]), dtype=np.int32),
+                    "date": np.array(dates, dtype=np.int64),
+                })
+                self.last_id = ids[-1]
+                added += len(rows)
+        finally:
+            conn.close()
+        return added
+
+    def filter(self, user=None, action=None, start=None, end=None, tool_ids=None):
+        """
+        Row positions matching the same rules as the SQL filter in the history
+        pane (user LIKE %user%, exact action, start <= date < end), newest first.
+        tool_ids limits rows to tools that still exist, like the JOIN on tools.
+        """
+        cols = self.columns()
+        mask = np.ones(len(cols["id"]), dtype=bool)
+        if user:
+            needle = user.lower()
+            mask &= np.isin(cols["user"], self.users.matching(lambda v: needle in str(v).lower()))
+        if action is not None:
+            code = self.actions.codes.get(action)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= cols["action"] == code
+        if start is not None:
+            mask &= cols["date"] >= start
+        if end is not None:
+            mask &= cols["date"] < end
+        if tool_ids is not None:
+            mask &= np.isin(cols["tool_id"], np.fromiter(tool_ids, dtype=np.int32))
+        return np.flatnonzero(mask)[::-1]
+
+    def rows(self, positions, tool_names):
+        """(id, tool name, action, user, reason, date) tuples, same shape as fetch_transactions"""
+        if len(positions) == 0:
+            return []           # np.char.replace cannot size an empty result
+        cols = self.columns()
+        dates = np.char.replace(cols["date"][positions].astype("datetime64[s]").astype(str), "T", " ")
+        return list(zip(
+            cols["id"][positions].tolist(),
+            [tool_names.get(t, "") for t in cols["tool_id"][positions].tolist()],
+            [self.actions.values[c] for c in cols["action"][positions].tolist()],
+            [self.users.values[c] for c in cols["user"][positions].tolist()],
+            [self.reasons.values[c] for c in cols["reason"][positions].tolist()],
+            dates.tolist(),
+        ))
+
+    def memory_bytes(self):
+        cols = self.columns()
+        total = sum(a.nbytes for a in cols.values())
+        for d in (self.actions, self.users, self.worker_types, self.reasons):
+            total += d.nbytes()
+        return total
+
+    def bytes_per_million_rows(self):
+        n = len(self)
+        return self.memory_bytes() * 1_000_000 / n if n else 0.0
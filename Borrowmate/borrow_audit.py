@@ -0,0 +1,240 @@
+# borrow_audit.py
+# Hash chain over transactions / disposals for BorrowMate, plus signed
+# checkpoints so verification only has to rehash rows added since the last one.
+#
+#   python borrow_audit.py tools.db            verify from the last checkpoint
+#   python borrow_audit.py tools.db --full     verify every row
+#   python borrow_audit.py tools.db --checkpoint   verify, then store a checkpoint
+#
+# Checkpoint keys: each signature is stored as "<key id>:<hmac>". A station
+# only trusts checkpoints signed with its own key and skips the others, so on
+# a shared DB another station's checkpoints just mean verifying from an older
+# one (or from the first row), never a false "invalid". Give every station the
+# same BORROWMATE_AUDIT_KEY to let them share checkpoints.
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import sys
+from datetime import datetime
+
+# Columns covered by the hash, per table. transactions.return_id is left out
+# on purpose: it is filled in later when the loan is returned.
+HASHED_COLUMNS = {
+    "transactions": ("id", "tool_id", "action", "user", "worker_type", "reason", "date", "due_at"),
+    "disposals": ("id", "tool_id", "quantity", "reason", "date"),
+}
+GENESIS_HASH = "0" * 64
+VERIFY_CHUNK_ROWS = 10000
+
+AUDIT_KEY_ENV = "BORROWMATE_AUDIT_KEY"
+AUDIT_KEY_FILE = os.path.join(os.path.expanduser("~"), ".borrowmate", "audit.key")
+
+
+def load_audit_key():
+    """HMAC key for checkpoints: $BORROWMATE_AUDIT_KEY, else a per-user key file (created on first use)"""
+    env = os.environ.get(AUDIT_KEY_ENV)
+    if env:
+        return env.encode("utf-8")
+    if not os.path.exists(AUDIT_KEY_FILE):
+        os.makedirs(os.path.dirname(AUDIT_KEY_FILE), exist_ok=True)
+        with open(AUDIT_KEY_FILE, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(AUDIT_KEY_FILE) as f:
+        return f.read().strip().encode("utf-8")
+
+
+def row_digest(prev_hash, values):
+    payload = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256((prev_hash + payload).encode("utf-8")).hexdigest()
+
+
+def _select_columns(table):
+    return ", ".join(HASHED_COLUMNS[table])
+
+
+def chain_row(conn, table, row_id, storage=None):
+    """
+    Set row_hash of a freshly inserted row. Must run in the same write
+    transaction as the INSERT. storage: the table holding row_hash when
+    `table` is a view over it (read and written directly, skipping the view).
+    """
+    storage = storage or table
+    cur = conn.cursor()
+    cur.execute(f"SELECT row_hash FROM {storage} WHERE id < ? ORDER BY id DESC LIMIT 1", (row_id,))
+    prev = cur.fetchone()
+    prev_hash = prev[0] if prev and prev[0] else GENESIS_HASH
+    cur.execute(f"SELECT {_select_columns(table)} FROM {table} WHERE id=?", (row_id,))
+    values = cur.fetchone()
+    digest = row_digest(prev_hash, values)
+    cur.execute(f"UPDATE {storage} SET row_hash=? WHERE id=?", (digest, row_id))
+    return digest
+
+
+def backfill_chain(conn, table, progress=None, label=None, batch=5000):
+    """Hash every row of table in id order (used by the migration that introduces row_hash)"""
+    cur = conn.cursor()
+    total = cur.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    prev_hash = GENESIS_HASH
+    last_id = 0
+    done = 0
+    while True:
+        rows = cur.execute(f"SELECT {_select_columns(table)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                           (last_id, batch)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for values in rows:
+            prev_hash = row_digest(prev_hash, values)
+            updates.append((prev_hash, values[0]))
+        cur.executemany(f"UPDATE {table} SET row_hash=? WHERE id=?", updates)
+        last_id = rows[-1][0]
+        done += len(rows)
+        if progress:
+            progress(label or table, done, total)
+
+
+def _checkpoint_message(table, last_row_id, row_hash, row_count, created_at):
+    return f"{table}|{last_row_id}|{row_hash}|{row_count}|{created_at}".encode("utf-8")
+
+
+def sign_checkpoint(key, table, last_row_id, row_hash, row_count, created_at):
+    return hmac.new(key, _checkpoint_message(table, last_row_id, row_hash, row_count, created_at),
+                    hashlib.sha256).hexdigest()
+
+
+def key_id(key):
+    """Short public fingerprint of a checkpoint key, stored in front of each signature"""
+    return hmac.new(key, b"borrowmate-checkpoint-key-id", hashlib.sha256).hexdigest()[:16]
+
+
+def write_checkpoint(conn, table, last_row_id, row_hash, row_count, key=None):
+    key = key or load_audit_key()
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    signature = key_id(key) + ":" + sign_checkpoint(key, table, last_row_id, row_hash, row_count, created_at)
+    conn.execute("""
+        INSERT INTO hash_checkpoints (table_name, last_row_id, row_hash, row_count, created_at, signature)
+        VALUES (?, ?, ?, ?, ?, ?)""", (table, last_row_id, row_hash, row_count, created_at, signature))
+
+
+def _latest_valid_checkpoint(conn, table, key, problems):
+    rows = conn.execute("""
+        SELECT id, last_row_id, row_hash, row_count, created_at, signature
+        FROM hash_checkpoints WHERE table_name=? ORDER BY id DESC
+    """, (table,)).fetchall()
+    mine = key_id(key)
+    for cp_id, last_row_id, row_hash, row_count, created_at, signature in rows:
+        signer, _, digest = (signature or "").rpartition(":")
+        if signer and signer != mine:
+            continue        # signed with another station's key: cannot be checked here
+        expected = sign_checkpoint(key, table, last_row_id, row_hash, row_count, created_at)
+        if hmac.compare_digest(expected, digest):
+            return last_row_id, row_hash, row_count
+        if signer:
+            # unlabelled ones predate key ids and may be another station's
+            problems.append(f"checkpoint #{cp_id} ลายเซ็นไม่ถูกต้อง")
+    return None
+
+
+def verify_chain(conn, table, use_checkpoint=True, key=None, progress=None):
+    """
+    Rehash table in a single streaming pass, starting after the newest
+    checkpoint with a valid signature (or from the first row). Memory use is
+    bounded by VERIFY_CHUNK_ROWS. Returns a dict with "checked", "last_id",
+    "last_hash", "row_count", "from_checkpoint", "problems" and "broken",
+    which is (row id, reason) for the first bad link or None.
+    """
+    key = key or load_audit_key()
+    problems = []
+    result = {"table": table, "checked": 0, "last_id": 0, "last_hash": GENESIS_HASH,
+              "row_count": 0, "from_checkpoint": None, "problems": problems, "broken": None}
+    cur = conn.cursor()
+    start_id = 0
+    prev_hash = GENESIS_HASH
+    count = 0
+    checkpoint = _latest_valid_checkpoint(conn, table, key, problems) if use_checkpoint else None
+    if checkpoint:
+        start_id, prev_hash, count = checkpoint
+        stored = cur.execute(f"SELECT row_hash FROM {table} WHERE id=?", (start_id,)).fetchone()
+        if not stored or stored[0] != prev_hash:
+            result["broken"] = (start_id, "แถวที่ checkpoint อ้างถึงถูกแก้ไขหรือลบ")
+            return result
+        result["from_checkpoint"] = start_id
+    total = cur.execute(f"SELECT COUNT(*) FROM {table} WHERE id > ?", (start_id,)).fetchone()[0]
+
+    # keyset chunks: each query is short, so the shared lock never blocks
+    # other stations' writes for long
+    last_id = start_id
+    checked = 0
+    while True:
+        rows = cur.execute(f"SELECT {_select_columns(table)}, row_hash FROM {table} "
+                           f"WHERE id > ? ORDER BY id LIMIT ?", (last_id, VERIFY_CHUNK_ROWS)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            values, stored_hash = row[:-1], row[-1]
+            if stored_hash is None:
+                result["broken"] = (values[0], "แถวไม่มี hash (เพิ่มโดยโปรแกรมรุ่นเก่าหรือแก้ไขตรงในไฟล์)")
+            elif row_digest(prev_hash, values) != stored_hash:
+                result["broken"] = (values[0], "hash ไม่ตรง: แถวนี้หรือแถวก่อนหน้าถูกแก้ไข/ลบ")
+            if result["broken"]:
+                result.update(checked=checked, last_id=last_id, last_hash=prev_hash, row_count=count)
+                return result
+            prev_hash = stored_hash
+            last_id = values[0]
+            checked += 1
+            count += 1
+        if progress:
+            progress(table, checked, total)
+    result.update(checked=checked, last_id=last_id, last_hash=prev_hash, row_count=count)
+    return result
+
+
+def verify_all(conn, use_checkpoint=True, key=None, progress=None):
+    return [verify_chain(conn, table, use_checkpoint, key, progress) for table in HASHED_COLUMNS]
+
+
+def checkpoint_results(conn, results, key=None):
+    """Store a checkpoint for every table that verified cleanly and has new rows"""
+    for res in results:
+        if res["broken"] is None and res["checked"] > 0:
+            write_checkpoint(conn, res["table"], res["last_id"], res["last_hash"], res["row_count"], key)
+
+
+def format_results(results):
+    lines = []
+    for res in results:
+        start = f"ต่อจาก checkpoint ที่แถว id {res['from_checkpoint']}" if res["from_checkpoint"] else "ตรวจทั้งหมด"
+        lines.append(f"{res['table']}: ตรวจ {res['checked']:,} แถว ({start})")
+        for problem in res["problems"]:
+            lines.append(f"  ! {problem}")
+        if res["broken"]:
+            row_id, reason = res["broken"]
+            lines.append(f"  ✗ ลิงก์แรกที่เสีย: id {row_id} - {reason}")
+        else:
+            lines.append("  ✓ ถูกต้อง")
+    return "\n".join(lines)
+
+
+def main(argv):
+    if not argv or argv[0].startswith("-"):
+        print("usage: python borrow_audit.py DB_FILE [--full] [--checkpoint]")
+        return 2
+    conn = sqlite3.connect(argv[0])
+    try:
+        results = verify_all(conn, use_checkpoint="--full" not in argv,
+                             progress=lambda t, d, n: print(f"\r{t}: {d:,}/{n:,}", end="", file=sys.stderr))
+        print(file=sys.stderr)
+        print(format_results(results))
+        if "--checkpoint" in argv:
+            checkpoint_results(conn, results)
+            conn.commit()
+        return 1 if any(r["broken"] for r in results) else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,374 @@
+# borrow_reports.py
+# Monthly usage reports (PDF / Excel) for BorrowMate. Runs as its own process
+# so the UI never waits on it; the app launches it through this CLI and cron /
+# Task Scheduler can call the same command headless.
+#
+#   python borrow_reports.py tools.db                    last month, pdf + xlsx
+#   python borrow_reports.py tools.db --month 2025-03 --format pdf
+#   python borrow_reports.py tools.db --out D:\reports --force
+#   python borrow_reports.py tools.db --json result.json   also write the result there
+#
+# Output goes to <out>/report_<YYYY-MM>.{pdf,xlsx} next to a .json manifest.
+# A report is regenerated only when the rows for that month changed, so a
+# scheduled run over a closed month is a couple of COUNT queries.
+import json
+import os
+import sqlite3
+import sys
+from datetime import date, datetime
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from borrow_sites import readonly_uri
+
+try:
+    from openpyxl import Workbook
+except ImportError:         # Excel output is optional; PDF still works
+    Workbook = None
+
+STREAM_ROWS = 5000          # rows per fetchmany while summarising
+REPORT_FORMATS = ("pdf", "xlsx")
+DEFAULT_REPORT_DIR = "reports"      # relative to the DB file
+
+ACTION_BORROW = "ยืม"
+ACTION_RETURN = "คืน"
+ACTION_DISPOSE = "ทิ้ง"
+
+
+def resource_path(relative_path):
+    """คืนค่า path ที่ถูกต้องทั้งในโหมดรันปกติและหลัง build ด้วย PyInstaller"""
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+def register_th_font():
+    """Register TH Sarabun New with reportlab; falls back to Helvetica"""
+    font_name = "THSarabunNew"
+    possible_paths = [
+        resource_path("THSarabunNew.ttf"),
+        os.path.join(os.getcwd(), "THSarabunNew.ttf"),
+        r"C:\Windows\Fonts\THSarabunNew.ttf",
+        r"C:\Windows\Fonts\THSarabun.ttf",
+        "/usr/share/fonts/truetype/THSarabunNew.ttf",
+        "/usr/share/fonts/truetype/sarabun/THSarabunNew.ttf",
+        "/Library/Fonts/THSarabunNew.ttf",
+    ]
+    for p in possible_paths:
+        try:
+            if p and os.path.exists(p):
+                pdfmetrics.registerFont(TTFont(font_name, p))
+                return font_name
+        except Exception:
+            continue
+    try:
+        search_dirs = ["/usr/share/fonts", "/Library/Fonts", r"C:\Windows\Fonts"]
+        for sd in search_dirs:
+            if os.path.exists(sd):
+                for rootf, dirsf, filesf in os.walk(sd):
+                    for ff in filesf:
+                        if "sarabun" in ff.lower():
+                            candidate = os.path.join(rootf, ff)
+                            try:
+                                pdfmetrics.registerFont(TTFont(font_name, candidate))
+                                return font_name
+                            except Exception:
+                                continue
+    except Exception:
+        pass
+    return "Helvetica"
+
+
+# ---------------------------
+# Periods
+# ---------------------------
+def month_range(period):
+    """'YYYY-MM' -> ('YYYY-MM-01 00:00:00', first second of the next month)"""
+    year, month = (int(p) for p in period.split("-"))
+    start = date(year, month, 1)
+    end = date(year + (month == 12), month % 12 + 1, 1)
+    return start.strftime("%Y-%m-%d 00:00:00"), end.strftime("%Y-%m-%d 00:00:00")
+
+
+def previous_month(today=None):
+    today = today or date.today()
+    year, month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+    return f"{year:04d}-{month:02d}"
+
+
+def recent_months(count=12, today=None):
+    today = today or date.today()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+
+# ---------------------------
+# Summaries
+# ---------------------------
+def _is_encoded(conn):
+    """True when transactions is the view over dictionary-encoded transactions_data"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='transactions_data'").fetchone() is not None
+
+
+def period_fingerprint(conn, start, end):
+    """Cheap change detector for a period: row counts and last ids in the date range"""
+    parts = []
+    storage = {"transactions": "transactions_data" if _is_encoded(conn) else "transactions"}
+    for table in ("transactions", "disposals"):
+        count, last_id = conn.execute(
+            f"SELECT COUNT(*), IFNULL(MAX(id), 0) FROM {storage.get(table, table)} WHERE date >= ? AND date < ?",
+            (start, end)).fetchone()
+        parts.append(f"{table}:{count}:{last_id}")
+    parts.append("tools:%d:%d" % conn.execute("SELECT COUNT(*), IFNULL(MAX(id), 0) FROM tools").fetchone())
+    return "|".join(parts)
+
+
+def _new_counts():
+    return {"borrow": 0, "return": 0, "dispose": 0, "disposed_qty": 0}
+
+
+def summarize(conn, start, end):
+    """
+    One streaming pass over transactions and disposals in [start, end).
+    Memory is bounded by the number of distinct tools / users / worker types,
+    not by the number of rows.
+    """
+    by_tool, by_user, by_worker = {}, {}, {}
+    total = _new_counts()
+    key_of = {ACTION_BORROW: "borrow", ACTION_RETURN: "return", ACTION_DISPOSE: "dispose"}
+
+    cur = conn.cursor()
+    if _is_encoded(conn):
+        # read the ids and decode from the small lookup tables instead of joining per row
+        actions, users, worker_types = (dict(conn.execute(f"SELECT id, name FROM {t}"))
+                                        for t in ("txn_actions", "txn_users", "txn_worker_types"))
+        cur.execute("""
+            SELECT tool_id, action_id, user_id, worker_type_id FROM transactions_data
+            WHERE date >= ? AND date < ?
+        """, (start, end))
+    else:
+        actions = users = worker_types = None
+        cur.execute("""
+            SELECT tool_id, action, user, worker_type FROM transactions
+            WHERE date >= ? AND date < ?
+        """, (start, end))
+    while True:
+        rows = cur.fetchmany(STREAM_ROWS)
+        if not rows:
+            break
+        for tool_id, action, user, worker_type in rows:
+            if actions is not None:
+                action, user, worker_type = actions.get(action), users.get(user), worker_types.get(worker_type)
+            key = key_of.get(action)
+            if key is None:
+                continue
+            for table, k in ((by_tool, tool_id), (by_user, user or "-"), (by_worker, worker_type or "-")):
+                counts = table.get(k)
+                if counts is None:
+                    counts = table[k] = _new_counts()
+                counts[key] += 1
+            total[key] += 1
+
+    cur.execute("SELECT tool_id, quantity FROM disposals WHERE date >= ? AND date < ?", (start, end))
+    while True:
+        rows = cur.fetchmany(STREAM_ROWS)
+        if not rows:
+            break
+        for tool_id, quantity in rows:
+            by_tool.setdefault(tool_id, _new_counts())["disposed_qty"] += quantity or 0
+            total["disposed_qty"] += quantity or 0
+
+    names = {}
+    if by_tool:
+        cur.execute("SELECT id, name, code FROM tools")
+        names = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+    def ordered(table, label):
+        return sorted(((label(k), v) for k, v in table.items()),
+                      key=lambda kv: (-kv[1]["borrow"], str(kv[0])))
+
+    return {
+        "start": start,
+        "end": end,
+        "total": total,
+        "tools": ordered(by_tool, lambda k: "%s (%s)" % names[k] if k in names else f"ID {k} (ลบแล้ว)"),
+        "users": ordered(by_user, str),
+        "worker_types": ordered(by_worker, str),
+    }
+
+
+SECTIONS = (
+    ("tools", "สรุปตามเครื่องมือ", "เครื่องมือ"),
+    ("users", "สรุปตามผู้ใช้", "ผู้ใช้"),
+    ("worker_types", "สรุปตามประเภทช่าง", "ประเภทช่าง"),
+)
+COUNT_HEADERS = ("ยืม", "คืน", "ทิ้ง (ครั้ง)", "ทิ้ง (ชิ้น)")
+COUNT_KEYS = ("borrow", "return", "dispose", "disposed_qty")
+
+
+# ---------------------------
+# Writers
+# ---------------------------
+def write_pdf(summary, path, period):
+    font_name = register_th_font()
+    c = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    left = 18 * mm
+    col_x = [left, left + 95 * mm, left + 115 * mm, left + 135 * mm, left + 155 * mm]
+    line_h = 6 * mm
+
+    def header(title):
+        c.setFont(font_name, 16)
+        c.drawCentredString(width / 2, height - 18 * mm, f"รายงานการใช้งานเครื่องมือ ประจำเดือน {period}")
+        c.setFont(font_name, 10)
+        c.drawRightString(width - left, height - 24 * mm,
+                          "สร้างเมื่อ " + datetime.now().strftime("%Y-%m-%d %H:%M"))
+        c.setFont(font_name, 13)
+        c.drawString(left, height - 32 * mm, title)
+        return height - 40 * mm
+
+    total = summary["total"]
+    y = header("ภาพรวม")
+    c.setFont(font_name, 12)
+    for label, key in zip(COUNT_HEADERS, COUNT_KEYS):
+        c.drawString(left, y, f"{label}: {total[key]:,}")
+        y -= line_h
+
+    for key, title, first_col in SECTIONS:
+        c.showPage()
+        y = header(title)
+        rows = summary[key]
+
+        def table_head(y):
+            c.setFont(font_name, 12)
+            for x, text in zip(col_x, (first_col,) + COUNT_HEADERS):
+                c.drawString(x, y, text)
+            c.line(left, y - 2 * mm, width - left, y - 2 * mm)
+            c.setFont(font_name, 11)
+            return y - line_h - 1 * mm
+
+        y = table_head(y)
+        if not rows:
+            c.drawString(left, y, "ไม่มีรายการในเดือนนี้")
+        for label, counts in rows:
+            if y < 18 * mm:
+                c.showPage()
+                y = table_head(header(title + " (ต่อ)"))
+            c.drawString(col_x[0], y, str(label)[:60])
+            for x, k in zip(col_x[1:], COUNT_KEYS):
+                c.drawString(x, y, f"{counts[k]:,}")
+            y -= line_h
+    c.save()
+
+
+def write_xlsx(summary, path, period):
+    if Workbook is None:
+        raise RuntimeError("ต้องติดตั้ง openpyxl เพื่อสร้างไฟล์ Excel (pip install openpyxl)")
+    wb = Workbook(write_only=True)      # rows are streamed to disk, not held as cell objects
+    ws = wb.create_sheet("ภาพรวม")
+    ws.append([f"รายงานการใช้งานเครื่องมือ ประจำเดือน {period}"])
+    ws.append(["ช่วงเวลา", summary["start"], summary["end"]])
+    for label, key in zip(COUNT_HEADERS, COUNT_KEYS):
+        ws.append([label, summary["total"][key]])
+    for key, title, first_col in SECTIONS:
+        ws = wb.create_sheet(title)
+        ws.append((first_col,) + COUNT_HEADERS)
+        for label, counts in summary[key]:
+            ws.append([label] + [counts[k] for k in COUNT_KEYS])
+    wb.save(path)
+
+
+WRITERS = {"pdf": write_pdf, "xlsx": write_xlsx}
+
+
+# ---------------------------
+# Cached build
+# ---------------------------
+def report_dir_for(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), DEFAULT_REPORT_DIR)
+
+
+def build_report(db_path, period, out_dir=None, formats=REPORT_FORMATS, force=False):
+    """
+    Produce the report files for period unless an up-to-date copy exists.
+    Returns {"period", "files": {fmt: path}, "cached": bool, "seconds"}.
+    """
+    started = datetime.now()
+    out_dir = out_dir or report_dir_for(db_path)
+    os.makedirs(out_dir, exist_ok=True)
+    start, end = month_range(period)
+    base = os.path.join(out_dir, f"report_{period}")
+    manifest_path = base + ".json"
+    files = {fmt: f"{base}.{fmt}" for fmt in formats}
+
+    # read-only: a scheduled run must never take the write lock from a station
+    conn = sqlite3.connect(readonly_uri(db_path), uri=True, timeout=5.0)
+    try:
+        fingerprint = period_fingerprint(conn, start, end)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+        built = manifest.get("built", {})      # format -> fingerprint it was built from
+        stale = [fmt for fmt, path in files.items()
+                 if force or built.get(fmt) != fingerprint or not os.path.exists(path)]
+        if stale:
+            summary = summarize(conn, start, end)
+    finally:
+        conn.close()
+
+    for fmt in stale:
+        tmp = f"{base}.part.{fmt}"
+        WRITERS[fmt](summary, tmp, period)
+        os.replace(tmp, files[fmt])
+        built[fmt] = fingerprint
+    if stale:
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"period": period, "built": built,
+                       "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
+    return {"period": period, "files": files, "cached": not stale,
+            "seconds": (datetime.now() - started).total_seconds()}
+
+
+def main(argv):
+    if not argv or argv[0].startswith("-"):
+        print("usage: python borrow_reports.py DB_FILE [--month YYYY-MM] [--format pdf,xlsx] [--out DIR] [--force]")
+        return 2
+    db_path = argv[0]
+    opts = {"--month": previous_month(), "--format": ",".join(REPORT_FORMATS), "--out": None, "--json": None}
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in opts:
+            opts[arg] = next(args, None)
+        elif arg != "--force":
+            print(f"unknown option: {arg}", file=sys.stderr)
+            return 2
+    formats = [f.strip() for f in (opts["--format"] or "").split(",") if f.strip() in WRITERS]
+    try:
+        result = build_report(db_path, opts["--month"], opts["--out"], formats, force="--force" in argv)
+    except Exception as e:
+        result = {"error": str(e)}
+    # the packaged (windowed) app has no stdout, so it asks for a result file
+    if opts["--json"]:
+        with open(opts["--json"], "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+    if sys.stdout:
+        print(json.dumps(result, ensure_ascii=False))
+    return 1 if "error" in result else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,144 @@
+# borrow_sites.py
+# Read-only federated view over several BorrowMate site databases. Nothing is
+# copied: small combined queries run once over ATTACHed databases, and the
+# history / stats scans run per site on their own connections in parallel
+# (sqlite releases the GIL while a statement runs), each using that site's
+# own indexes, before being merged.
+import heapq
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+MAX_SITES = 10              # SQLite's default SQLITE_MAX_ATTACHED
+SITE_BUSY_TIMEOUT = 5.0
+
+
+def readonly_uri(path):
+    """
+    file: URI opening path read-only. The path is percent-encoded, so names
+    with spaces, '#', '?' or '%' open the right file, and the authority is
+    kept empty: a UNC share becomes file:////nas/share/tools.db, which SQLite
+    accepts where file://nas/share/tools.db is an error.
+    """
+    path = os.path.abspath(path).replace("\\", "/")
+    if not path.startswith("/"):
+        path = "/" + path       # C:/... -> /C:/...
+    return "file://" + quote(path, safe="/:") + "?mode=ro"
+
+
+class SiteFederation:
+    """
+    sites: [(name, path), ...]. Query methods return rows whose first column
+    is the site name, plus a list of (site, error) for sites that failed
+    (e.g. a NAS share that is offline), so one bad site never hides the rest.
+    """
+
+    def __init__(self, sites):
+        if not sites:
+            raise ValueError("ต้องมีอย่างน้อยหนึ่งสาขา")
+        if len(sites) > MAX_SITES:
+            raise ValueError(f"รวมได้สูงสุด {MAX_SITES} สาขา")
+        self.sites = list(sites)
+        self._pool = ThreadPoolExecutor(max_workers=len(self.sites), thread_name_prefix="site-query")
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    # ---- one statement over ATTACHed databases ----
+    def _attached(self):
+        conn = sqlite3.connect(":memory:", uri=True, timeout=SITE_BUSY_TIMEOUT)
+        attached, errors = [], []
+        for i, (name, path) in enumerate(self.sites):
+            try:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+                conn.execute(f"ATTACH DATABASE ? AS s{i}", (readonly_uri(path),))
+                attached.append((i, name))
+            except Exception as e:
+                errors.append((name, str(e)))
+        return conn, attached, errors
+
+    def union_all(self, select_sql, params=()):
+        """
+        Run select_sql once per attached site as one UNION ALL statement.
+        select_sql uses {db} as the schema prefix, e.g. "SELECT id FROM {db}.tools".
+        """
+        conn, attached, errors = self._attached()
+        try:
+            if not attached:
+                return [], errors
+            parts, args = [], []
+            for i, name in attached:
+                parts.append(f"SELECT ? AS site, * FROM ({select_sql.format(db=f's{i}')})")
+                args.append(name)
+                args.extend(params)
+            return conn.execute(" UNION ALL ".join(parts), args).fetchall(), errors
+        finally:
+            conn.close()
+
+    def tools(self):
+        return self.union_all("SELECT id, name, code, total_qty, available_qty FROM {db}.tools")
+
+    def availability(self):
+        """Per-site catalogue totals: (site, tools, total_qty, available_qty, out now)"""
+        return self.union_all("""
+            SELECT COUNT(*), IFNULL(SUM(total_qty), 0), IFNULL(SUM(available_qty), 0),
+                   IFNULL(SUM(total_qty - available_qty), 0)
+            FROM {db}.tools
+        """)
+
+    # ---- same statement per site, in parallel ----
+    def _query_site(self, name, path, sql, params, cancelled):
+        conn = sqlite3.connect(readonly_uri(path), uri=True, timeout=SITE_BUSY_TIMEOUT)
+        try:
+            if callable(sql):
+                sql = sql(conn)         # sites may be on different schema versions
+            if cancelled is not None:
+                conn.set_progress_handler(lambda: 1 if cancelled() else 0, 1000)
+            return [(name,) + tuple(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def per_site(self, sql, params=(), cancelled=None):
+        """
+        [(site rows), ...] in site order, plus errors; cancelled() aborts every
+        running statement. sql may be a callable(conn) returning the statement.
+        """
+        futures = [(name, self._pool.submit(self._query_site, name, path, sql, params, cancelled))
+                   for name, path in self.sites]
+        results, errors = [], []
+        for name, fut in futures:
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                if cancelled is not None and cancelled():
+                    raise
+                errors.append((name, str(e)))
+        return results, errors
+
+    def merged(self, sql, params=(), key=None, reverse=True, cancelled=None):
+        """per_site() results merged into one list; each site's rows must already be sorted by key"""
+        results, errors = self.per_site(sql, params, cancelled)
+        if key is None:
+            return [row for rows in results for row in rows], errors
+        return list(heapq.merge(*results, key=key, reverse=reverse)), errors
+
+    def worker_stats(self):
+        """(site, worker_type, borrow count)"""
+        return self.merged(_worker_stats_sql)
+
+
+def _worker_stats_sql(conn):
+    # dictionary-encoded sites (transactions is a view) group on the ids, index-only
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='transactions_data'").fetchone():
+        return """
+            SELECT w.name, d.n
+            FROM (SELECT worker_type_id, COUNT(*) AS n FROM transactions_data
+                  WHERE action_id=(SELECT id FROM txn_actions WHERE name='ยืม') GROUP BY worker_type_id) d
+            LEFT JOIN txn_worker_types w ON w.id = d.worker_type_id
+        """
+    return """
+        SELECT worker_type, COUNT(*) FROM transactions
+        WHERE action='ยืม' GROUP BY worker_type
+    """
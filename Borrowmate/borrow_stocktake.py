@@ -0,0 +1,202 @@
+# borrow_stocktake.py
+# Stock-take from high-resolution shelf / tool-board photos for BorrowMate.
+# Each photo is cut into overlapping tiles at a few scales, the tiles are
+# decoded with pyzbar across a process pool, detections seen in more than one
+# tile are merged, and the labels found are reconciled against the tools table.
+#
+#   python borrow_stocktake.py tools.db shelf1.jpg shelf2.jpg [--workers 8] [--json result.json]
+#
+# Runs as its own process (the app launches it through this CLI) so the pool
+# workers never import the Tk script.
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from PIL import Image
+from pyzbar import pyzbar
+
+from borrow_sites import readonly_uri
+
+TILE_SIZE = 1280            # px, at the tile's own scale
+TILE_OVERLAP = 320          # px; labels up to this size are whole in at least one tile
+TILE_SCALES = (1.0, 0.5)    # 0.5 catches labels too big for the overlap at full size
+MERGE_DISTANCE = 0.75       # same code closer than this * label size = same label
+EXIF_ORIENTATION = 0x0112
+
+
+def tile_grid(width, height, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(x, y, w, h) windows covering a width x height image with the given overlap"""
+    stride = max(1, tile - overlap)
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        pos = list(range(0, length - tile, stride))
+        pos.append(length - tile)          # last tile flush with the edge
+        return pos
+
+    return [(x, y, min(tile, width - x), min(tile, height - y))
+            for y in starts(height) for x in starts(width)]
+
+
+def plan_tiles(path, width, height, scales=TILE_SCALES):
+    """Decode jobs for one image: (path, scale, x, y, w, h) in scaled coordinates"""
+    jobs = []
+    for scale in scales:
+        sw, sh = int(width * scale), int(height * scale)
+        if min(sw, sh) < 64:
+            continue
+        jobs.extend((path, scale) + window for window in tile_grid(sw, sh))
+    return jobs
+
+
+# ---------------------------
+# Pool worker
+# ---------------------------
+# Each worker keeps the last image it loaded (grayscale, per scale), so a
+# job only carries a path and a window instead of pickled pixels.
+_worker_cache = {"path": None, "images": {}}
+
+
+def _load_scaled(path, scale):
+    if _worker_cache["path"] != path:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"อ่านไฟล์รูปไม่ได้: {path}")
+        _worker_cache["path"] = path
+        _worker_cache["images"] = {1.0: gray}
+    images = _worker_cache["images"]
+    if scale not in images:
+        full = images[1.0]
+        images[scale] = cv2.resize(full, (int(full.shape[1] * scale), int(full.shape[0] * scale)),
+                                   interpolation=cv2.INTER_AREA)
+    return images[scale]
+
+
+def decode_tile(job):
+    """Decode one tile; returns detections as (code, cx, cy, size) in full-resolution pixels"""
+    path, scale, x, y, w, h = job
+    image = _load_scaled(path, scale)
+    found = []
+    for b in pyzbar.decode(image[y:y + h, x:x + w]):
+        r = b.rect
+        found.append((b.data.decode("utf-8", "replace"),
+                      (x + r.left + r.width / 2) / scale,
+                      (y + r.top + r.height / 2) / scale,
+                      max(r.width, r.height, 1) / scale))
+    return path, found
+
+
+def merge_detections(detections, distance=MERGE_DISTANCE):
+    """
+    Collapse the same physical label seen in several tiles / scales. Two
+    detections of a code are one label when their centres are closer than
+    distance * the larger label size. Returns {code: [(cx, cy, size), ...]}.
+    """
+    labels = {}
+    for code, cx, cy, size in detections:
+        seen = labels.setdefault(code, [])
+        for i, (lx, ly, lsize) in enumerate(seen):
+            limit = distance * max(size, lsize)
+            if (cx - lx) ** 2 + (cy - ly) ** 2 <= limit * limit:
+                seen[i] = (lx, ly, max(size, lsize))
+                break
+        else:
+            seen.append((cx, cy, size))
+    return labels
+
+
+def image_size(path):
+    """Width and height from the file header (PIL reads it lazily, no pixel decode)"""
+    with Image.open(path) as img:
+        width, height = img.size
+        # cv2.imread applies the EXIF rotation, so the tiles must too
+        if img.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def scan_images(paths, workers=None, scales=TILE_SCALES, decode=decode_tile):
+    """Decode every tile of every image across a process pool; returns (labels per image, stats)"""
+    started = time.perf_counter()
+    jobs = []
+    for path in paths:
+        width, height = image_size(path)
+        jobs.extend(plan_tiles(path, width, height, scales))
+    workers = workers or os.cpu_count() or 1
+    per_image = {path: [] for path in paths}
+    # consecutive tiles of one image go to the same worker where possible,
+    # so each worker decodes a given photo from disk once
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, found in pool.map(decode, jobs, chunksize=chunksize):
+            per_image[path].extend(found)
+    labels = {path: merge_detections(found) for path, found in per_image.items()}
+    stats = {"images": len(paths), "tiles": len(jobs), "workers": workers,
+             "detections": sum(len(f) for f in per_image.values()),
+             "seconds": round(time.perf_counter() - started, 2)}
+    return labels, stats
+
+
+def reconcile(conn, labels):
+    """
+    Compare labels found (merged across all photos) with the tools table.
+    present: [(code, name, seen, available, total)], missing: tools with
+    available stock and no label seen, unknown: codes not in tools.
+    """
+    seen = {}
+    for per_code in labels.values():
+        for code, found in per_code.items():
+            seen[code] = seen.get(code, 0) + len(found)
+    tools = {code: (name, total, avail) for code, name, total, avail in
+             conn.execute("SELECT code, name, total_qty, available_qty FROM tools")}
+    present, missing = [], []
+    for code, (name, total, avail) in sorted(tools.items(), key=lambda kv: kv[1][0]):
+        if code in seen:
+            present.append((code, name, seen[code], avail, total))
+        elif avail > 0:
+            missing.append((code, name, 0, avail, total))
+    unknown = sorted((code, count) for code, count in seen.items() if code not in tools)
+    return {"present": present, "missing": missing, "unknown": unknown}
+
+
+def run_stocktake(db_path, paths, workers=None):
+    labels, stats = scan_images(paths, workers)
+    conn = sqlite3.connect(readonly_uri(db_path), uri=True, timeout=5.0)
+    try:
+        result = reconcile(conn, labels)
+    finally:
+        conn.close()
+    result["stats"] = stats
+    return result
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0].startswith("-"):
+        print("usage: python borrow_stocktake.py DB_FILE IMAGE [IMAGE ...] [--workers N] [--json FILE]")
+        return 2
+    db_path, images, opts = argv[0], [], {"--workers": None, "--json": None}
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in opts:
+            opts[arg] = next(args, None)
+        else:
+            images.append(arg)
+    try:
+        result = run_stocktake(db_path, images, int(opts["--workers"]) if opts["--workers"] else None)
+    except Exception as e:
+        result = {"error": str(e)}
+    if opts["--json"]:
+        with open(opts["--json"], "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+    if sys.stdout:
+        print(json.dumps(result, ensure_ascii=False))
+    return 1 if "error" in result else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
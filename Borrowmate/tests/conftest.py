@@ -0,0 +1,88 @@
+# Shared fixtures for the BorrowMate tests.
+#
+# Borrowcode.py builds its Tk window at import time, so the app fixture runs
+# only the part above the "Main UI" section (DB layer, writer, monitors) with
+# a fake root whose after() queues callbacks for the test to run.
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+UI_MARKER = "# ---------------------------\n# Main UI"
+# imported at the top of Borrowcode.py for the camera / UI parts
+APP_REQUIREMENTS = ("cv2", "pyzbar.pyzbar", "barcode", "PIL.ImageTk", "tkcalendar",
+                    "reportlab", "matplotlib.backends.backend_tkagg", "numpy")
+
+
+class FakeRoot:
+    """Stands in for tk.Tk: after() records (delay, callback) instead of running it"""
+
+    def __init__(self):
+        self.pending = []
+        self.after_threads = set()
+
+    def after(self, ms, func=None, *args):
+        self.after_threads.add(threading.get_ident())
+        self.pending.append((ms, lambda: func(*args)))
+        return len(self.pending)
+
+    def after_cancel(self, after_id):
+        pass
+
+    def run_pending(self):
+        jobs, self.pending = self.pending, []
+        for _, job in jobs:
+            job()
+        return len(jobs)
+
+
+@pytest.fixture(scope="session")
+def app():
+    for name in APP_REQUIREMENTS:
+        # ImportError too: pyzbar imports fine but fails when the zbar library is missing
+        pytest.importorskip(name, exc_type=ImportError)
+    path = os.path.join(APP_DIR, "Borrowcode.py")
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    module = types.ModuleType("borrowcode_core")
+    module.__file__ = path
+    exec(compile(source[:source.index(UI_MARKER)], path, "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture
+def root(app):
+    fake = FakeRoot()
+    app.root = fake
+    return fake
+
+
+@pytest.fixture
+def ui(app, root, monkeypatch):
+    """A fresh UIUpdater; calling ui.poll() stands in for the Tk tick"""
+    updater = app.UIUpdater()
+    monkeypatch.setattr(app, "ui_updates", updater)
+    return updater
+
+
+@pytest.fixture
+def db_path(app, tmp_path, monkeypatch):
+    """A fresh DB at the current schema, set as the app's DB_FILE"""
+    path = str(tmp_path / "tools.db")
+    monkeypatch.setattr(app, "DB_FILE", path)
+    app.init_db()
+    return path
+
+
+@pytest.fixture
+def conn(app, db_path):
+    """Writer-style connection: autocommit, transactions opened by the test"""
+    c = app.connect_db(db_path)
+    c.isolation_level = None
+    yield c
+    c.close()
@@ -0,0 +1,80 @@
+import calendar
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+import borrow_analytics
+
+
+def epoch(text):
+    return calendar.timegm(datetime.strptime(text, "%Y-%m-%d %H:%M").timetuple())
+
+
+@pytest.fixture
+def history_db(tmp_path):
+    path = str(tmp_path / "tools.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tools (id INTEGER PRIMARY KEY, name TEXT, total_qty INTEGER)")
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY, tool_id INTEGER, user TEXT, action TEXT, date TEXT)")
+    conn.executemany("INSERT INTO tools VALUES (?, ?, ?)", [(1, "สว่าน", 2), (2, "ค้อน", 1)])
+    conn.executemany("INSERT INTO transactions (tool_id, user, action, date) VALUES (?, ?, ?, ?)", [
+        (1, "สมศรี", "ยืม", "2025-03-01 08:00:00"),
+        (1, "มานะ", "ยืม", "2025-03-01 09:00:00"),
+        (1, "สมศรี", "คืน", "2025-03-01 12:00:00"),
+        (1, "มานะ", "คืน", "2025-03-01 10:00:00"),
+        (1, "มานะ", "ทิ้ง", "2025-03-01 11:00:00"),
+    ])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_pair_loans_skips_orphan_returns_and_keeps_open_loans():
+    group = np.array([1, 1, 1, 1, 2])
+    ts = np.array([10, 20, 30, 40, 50])
+    act = np.array([-1, 1, -1, 1, 1])       # return older than the history, then two borrows
+    bpos, rpos = borrow_analytics.pair_loans(group, ts, act)
+    assert dict(zip(bpos.tolist(), rpos.tolist())) == {1: 2, 3: -1, 4: -1}
+
+
+def test_pair_loans_sorts_by_time_within_the_group():
+    bpos, rpos = borrow_analytics.pair_loans(np.array([5, 5, 5, 5]), np.array([40, 10, 30, 20]),
+                                             np.array([-1, 1, -1, 1]))
+    assert dict(zip(bpos.tolist(), rpos.tolist())) == {1: 2, 3: 0}
+    empty = borrow_analytics.pair_loans(np.array([]), np.array([]), np.array([]))
+    assert [len(a) for a in empty] == [0, 0]
+
+
+def test_peak_concurrency_carries_long_loans_across_hours():
+    start, end = epoch("2025-03-01 00:00"), epoch("2025-03-02 00:00")
+    peak = borrow_analytics.peak_concurrency_by_hour(
+        np.array([epoch("2025-03-01 08:00"), epoch("2025-03-01 09:30")]),
+        np.array([epoch("2025-03-01 12:00"), epoch("2025-03-01 10:00")]), start, end)
+    # intervals are half-open: a loan returned at 10:00 no longer counts in hour 10
+    assert peak[7:13].tolist() == [0, 1, 2, 1, 1, 0]
+
+
+def test_rollup_per_tool(history_db):
+    analytics = borrow_analytics.ToolAnalytics(history_db)
+    day = (epoch("2025-03-01 00:00"), epoch("2025-03-02 00:00"))
+    result = analytics.rollup(*day)
+    drill, hammer = result["tools"]
+    assert drill[:4] == (1, "สว่าน", 2, 2)
+    assert drill[4] == pytest.approx(2.5)       # 4 h and 1 h loans
+    assert drill[5] == pytest.approx(5 / (24 * 2))
+    assert result["never_used"] == [(2, "ค้อน", 1)]
+    assert result["open_loans"] == 0
+
+
+def test_rollup_sees_new_rows_in_a_cached_range(history_db):
+    analytics = borrow_analytics.ToolAnalytics(history_db)
+    day = (epoch("2025-03-01 00:00"), epoch("2025-03-02 00:00"))
+    analytics.rollup(*day)
+    conn = sqlite3.connect(history_db)
+    conn.execute("INSERT INTO transactions (tool_id, user, action, date) VALUES (2, 'ปิติ', 'ยืม', '2025-03-01 20:00:00')")
+    conn.commit()
+    conn.close()
+    result = analytics.rollup(*day)
+    assert result["tools"][1][3] == 1 and result["never_used"] == [] and result["open_loans"] == 1
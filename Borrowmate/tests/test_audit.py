@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+
+import pytest
+
+import borrow_audit
+
+KEY = b"station-a"
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, tool_id INTEGER, action TEXT,
+            user TEXT, worker_type TEXT, reason TEXT, date TEXT, due_at TEXT, return_id INTEGER, row_hash TEXT);
+        CREATE TABLE disposals (id INTEGER PRIMARY KEY AUTOINCREMENT, tool_id INTEGER, quantity INTEGER,
+            reason TEXT, date TEXT, row_hash TEXT);
+        CREATE TABLE hash_checkpoints (id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT, last_row_id INTEGER,
+            row_hash TEXT, row_count INTEGER, created_at TEXT, signature TEXT);
+    """)
+    yield conn
+    conn.close()
+
+
+def add_rows(conn, count, start=0):
+    for i in range(start, start + count):
+        cur = conn.execute("INSERT INTO transactions (tool_id, action, user, worker_type, date) VALUES (?, ?, ?, ?, ?)",
+                           (i % 3 + 1, "ยืม", f"user{i}", "ช่างเหล็ก", f"2025-01-01 00:00:{i % 60:02d}"))
+        borrow_audit.chain_row(conn, "transactions", cur.lastrowid)
+
+
+def test_chain_row_matches_backfill(db):
+    add_rows(db, 10)
+    chained = [r[0] for r in db.execute("SELECT row_hash FROM transactions ORDER BY id")]
+    db.execute("UPDATE transactions SET row_hash=NULL")
+    borrow_audit.backfill_chain(db, "transactions")
+    assert [r[0] for r in db.execute("SELECT row_hash FROM transactions ORDER BY id")] == chained
+    assert borrow_audit.verify_chain(db, "transactions", key=KEY)["broken"] is None
+
+
+@pytest.mark.parametrize("tamper, bad_id", [
+    ("UPDATE transactions SET user='someone else' WHERE id=4", 4),
+    ("DELETE FROM transactions WHERE id=6", 7),
+    ("UPDATE transactions SET row_hash=NULL WHERE id=9", 9),
+])
+def test_tampering_is_detected_at_the_first_bad_link(db, tamper, bad_id):
+    add_rows(db, 10)
+    db.execute(tamper)
+    result = borrow_audit.verify_chain(db, "transactions", key=KEY)
+    assert result["broken"][0] == bad_id
+
+
+def test_checkpoint_limits_verification_to_new_rows(db):
+    add_rows(db, 10)
+    borrow_audit.checkpoint_results(db, borrow_audit.verify_all(db, key=KEY), key=KEY)
+    add_rows(db, 5, start=10)
+    result = borrow_audit.verify_chain(db, "transactions", key=KEY)
+    assert result["from_checkpoint"] == 10
+    assert result["checked"] == 5
+    assert result["row_count"] == 15
+    assert result["broken"] is None
+
+
+def test_checkpoint_row_edited_after_checkpoint(db):
+    add_rows(db, 10)
+    borrow_audit.checkpoint_results(db, borrow_audit.verify_all(db, key=KEY), key=KEY)
+    db.execute("UPDATE transactions SET row_hash='x' WHERE id=10")
+    assert borrow_audit.verify_chain(db, "transactions", key=KEY)["broken"][0] == 10
+
+
+def test_other_stations_checkpoints_are_skipped_not_invalid(db):
+    add_rows(db, 10)
+    borrow_audit.checkpoint_results(db, borrow_audit.verify_all(db, key=KEY), key=KEY)
+    result = borrow_audit.verify_chain(db, "transactions", key=b"station-b")
+    assert result["problems"] == []
+    assert result["from_checkpoint"] is None
+    assert result["checked"] == 10 and result["broken"] is None
+
+
+def test_forged_checkpoint_with_own_key_id_is_reported(db):
+    add_rows(db, 10)
+    borrow_audit.checkpoint_results(db, borrow_audit.verify_all(db, key=KEY), key=KEY)
+    db.execute("UPDATE hash_checkpoints SET row_count=row_count+1")
+    result = borrow_audit.verify_chain(db, "transactions", key=KEY)
+    assert len(result["problems"]) == 1
+    assert result["from_checkpoint"] is None
+
+
+def test_run_audit_error_path_releases_the_lock(app, root, ui, tmp_path, monkeypatch):
+    # an unreadable DB path makes verification fail on the worker thread
+    monkeypatch.setattr(app, "DB_FILE", str(tmp_path / "missing" / "tools.db"))
+    app.run_audit(silent=True)
+    for thread in threading.enumerate():
+        if thread.name == "audit":
+            thread.join(5)
+    assert root.pending == []          # handed to the Tk tick, not root.after from the thread
+    assert ui.poll() is True           # used to raise NameError: e is unset after the except block
+    assert app._audit_running is False
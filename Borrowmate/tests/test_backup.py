@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import time
+import types
+
+import pytest
+
+
+@pytest.fixture
+def scheduler(app, db_path, conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "BACKUP_STEP_SLEEP", 0)
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', ?, 1, 1)",
+                     [(f"T{i}",) for i in range(300)])
+    sched = app.BackupScheduler()
+    sched.target_dir = str(tmp_path / "nas")
+    return sched
+
+
+def test_backup_is_a_checked_copy(app, scheduler):
+    report = scheduler.backup_once()
+    assert report["ok"] and report["error"] is None
+    assert os.path.dirname(report["file"]) == scheduler.target_dir
+    assert os.path.getsize(report["file"]) == report["bytes"]
+    copy = sqlite3.connect(report["file"])
+    try:
+        assert copy.execute("SELECT COUNT(*) FROM tools").fetchone()[0] == 300
+        assert copy.execute("PRAGMA user_version").fetchone()[0] == app.SCHEMA_VERSION
+    finally:
+        copy.close()
+    assert not [f for f in os.listdir(scheduler.target_dir) if f.endswith(".part")]
+
+
+def test_writes_during_the_copy_restart_it(app, scheduler, conn, monkeypatch):
+    monkeypatch.setattr(app, "BACKUP_PAGES_PER_STEP", 1)
+    monkeypatch.setattr(app, "BACKUP_MAX_RESTARTS", 2)
+    writes = iter(range(1000))
+
+    def busy_station(*args):
+        # another station writes between every step
+        conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('x', ?, 1, 1)",
+                     (f"W{next(writes)}",))
+    monkeypatch.setattr(app, "time", types.SimpleNamespace(sleep=busy_station, time=time.time))
+    report = scheduler.backup_once()
+    assert report["ok"] and report["restarts"] > 0
+
+
+def test_rotation_keeps_the_newest_generations(app, scheduler, monkeypatch):
+    monkeypatch.setattr(app, "BACKUP_KEEP", 2)
+    os.makedirs(scheduler.target_dir)
+    for stamp in ("20250101_000000", "20250102_000000", "20250103_000000"):
+        open(os.path.join(scheduler.target_dir, f"tools_{stamp}.db"), "w").close()
+    open(os.path.join(scheduler.target_dir, "other_20240101_000000.db"), "w").close()
+    report = scheduler.backup_once()
+    assert sorted(os.listdir(scheduler.target_dir)) == sorted(
+        ["tools_20250103_000000.db", os.path.basename(report["file"]), "other_20240101_000000.db"])
+
+
+def test_unreachable_target_is_reported(app, scheduler, tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    scheduler.target_dir = str(blocker / "nas")
+    report = scheduler.backup_once()
+    assert not report["ok"] and report["error"]
+
+
+def test_reports_say_whether_the_user_asked(app, scheduler, ui):
+    reports = []
+    scheduler.on_report = reports.append
+    assert scheduler.run_once() is None         # woken without a request: nothing to do
+    scheduler.run_now()
+    assert scheduler.run_once()["manual"] is True
+    assert scheduler.run_once(timed_out=True)["manual"] is False
+    assert reports == [] and ui.poll()          # delivered on the Tk tick
+    assert [r["manual"] for r in reports] == [True, False]
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+import borrow_audit
+
+
+def add_tools(conn, rows):
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, ?, ?)", rows)
+
+
+def bulk(app, conn, *args, **kwargs):
+    conn.execute("BEGIN IMMEDIATE")
+    result = app.bulk_update_tools(conn, *args, **kwargs)
+    conn.execute("COMMIT")
+    return result
+
+
+def stock(conn, tool_id):
+    return conn.execute("SELECT total_qty, available_qty FROM tools WHERE id=?", (tool_id,)).fetchone()
+
+
+def test_selection_larger_than_the_old_variable_limit(app, conn):
+    add_tools(conn, [(f"tool {i}", f"T{i}", 1, 1) for i in range(2500)])
+    conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)       # SQLite < 3.32
+    ids = [r[0] for r in conn.execute("SELECT id FROM tools")]
+    assert bulk(app, conn, "add", ids + [99999], 2) == (2500, [(99999, "", "ไม่พบข้อมูลเครื่องมือ")])
+    assert conn.execute("SELECT MIN(total_qty), MAX(available_qty) FROM tools").fetchone() == (3, 3)
+
+
+def test_invalid_rows_are_skipped_and_reported(app, conn):
+    add_tools(conn, [("สว่าน", "T1", 5, 1), ("ค้อน", "T2", 5, 4)])
+    applied, failures = bulk(app, conn, "reduce", [1, 2], 2)
+    assert applied == 1 and [(f[0], f[1]) for f in failures] == [(1, "สว่าน")]
+    assert stock(conn, 1) == (5, 1) and stock(conn, 2) == (5, 2)
+
+
+def test_dispose_logs_chained_rows(app, conn):
+    add_tools(conn, [("สว่าน", "T1", 5, 5), ("ค้อน", "T2", 2, 1)])
+    applied, failures = bulk(app, conn, "dispose", [1, 2], 2, reason="ชำรุด", user="สมศรี", worker_type="ช่างไฟ")
+    assert applied == 2 and failures == []
+    assert stock(conn, 1) == (3, 3) and stock(conn, 2) == (0, 0)
+    assert conn.execute("SELECT tool_id, quantity, reason FROM disposals ORDER BY id").fetchall() == [
+        (1, 2, "ชำรุด"), (2, 2, "ชำรุด")]
+    assert conn.execute("SELECT tool_id, action, user, worker_type FROM transactions ORDER BY id").fetchall() == [
+        (1, "ทิ้ง", "สมศรี", "ช่างไฟ"), (2, "ทิ้ง", "สมศรี", "ช่างไฟ")]
+    for table in ("disposals", "transactions"):
+        assert borrow_audit.verify_chain(conn, table, use_checkpoint=False)["broken"] is None
+
+
+def test_min_and_delete(app, conn):
+    add_tools(conn, [("สว่าน", "T1", 5, 5), ("ค้อน", "T2", 5, 5)])
+    bulk(app, conn, "min", [1, 2], 3)
+    bulk(app, conn, "min", [2], 0)
+    assert conn.execute("SELECT min_available FROM tools ORDER BY id").fetchall() == [(3,), (None,)]
+    assert bulk(app, conn, "delete", [1], 0) == (1, [])
+    assert conn.execute("SELECT id FROM tools").fetchall() == [(2,)]
+
+
+def test_unknown_operation(app, conn):
+    add_tools(conn, [("สว่าน", "T1", 5, 5)])
+    with pytest.raises(ValueError):
+        bulk(app, conn, "rename", [1])
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+
+class FakeTree:
+    def __init__(self):
+        self.rows = []
+
+    def get_children(self):
+        return list(range(len(self.rows)))
+
+    def delete(self, item):
+        self.rows.pop()
+
+    def insert(self, parent, index, values):
+        self.rows.append(values)
+
+
+class FakeVar:
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+def workers_alive():
+    return any(t.name == "history-filter" for t in threading.enumerate())
+
+
+def pump_until_idle(app, root, history, timeout=10):
+    """Run the Tk side; returns the tree size after every tick that added rows"""
+    sizes = []
+    deadline = time.time() + timeout
+    while history._pumping:
+        assert time.time() < deadline, "filter never finished"
+        root.run_pending()
+        if not sizes or sizes[-1] != len(history.tree.rows):
+            sizes.append(len(history.tree.rows))
+        time.sleep(0.001)
+    return [n for n in sizes if n]
+
+
+@pytest.fixture
+def history(app, root, conn, monkeypatch):
+    errors = []
+    monkeypatch.setattr(app, "messagebox", type("Box", (), {"showerror": lambda *a: errors.append(a)}))
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', 'T1', 5, 5)")
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO transactions (tool_id, action, user) VALUES (1, ?, ?)",
+                     [("ยืม" if i % 2 else "คืน", "สมศรี" if i < 1200 else "มานะ") for i in range(1250)])
+    conn.execute("COMMIT")
+    filt = app.HistoryFilter(FakeTree(), FakeVar(""), FakeVar(""), FakeVar(False))
+    filt.errors = errors
+    yield filt
+    filt.cancel()
+
+
+@pytest.mark.parametrize("use_snapshot", [False, True])
+def test_rows_arrive_in_chunks(app, root, history, use_snapshot):
+    history.start("สมศรี", "ทั้งหมด", None, None, use_snapshot=use_snapshot)
+    assert history.status_var.get() == "กำลังกรอง..."
+    sizes = pump_until_idle(app, root, history)
+    # one chunk per tick: the first rows show before the rest are read
+    assert sizes == [500, 1000, 1200] and app.FILTER_CHUNK_ROWS == 500
+    assert {row[3] for row in history.tree.rows} == {"สมศรี"}
+    assert history.status_var.get() == "พบ 1,200 รายการ"
+    assert history.errors == []
+
+
+def test_superseded_filter_rows_are_dropped(app, root, history):
+    history.start("สมศรี", "ทั้งหมด", None, None, use_snapshot=False)
+    while workers_alive():      # every row of the first filter is queued...
+        time.sleep(0.01)
+    history.start("มานะ", "ทั้งหมด", None, None, use_snapshot=False)
+    pump_until_idle(app, root, history)
+    # ...and none of it reaches the tree once the second one started
+    assert len(history.tree.rows) == 50 and {row[3] for row in history.tree.rows} == {"มานะ"}
+    assert history.criteria[0] == "มานะ"
+
+
+def test_cancel_interrupts_a_running_query(app, root, history, monkeypatch):
+    endless = ("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) "
+               "SELECT x, x, x, x, x, x FROM n WHERE x < 0", [])
+    monkeypatch.setattr(app, "_filter_query", lambda *criteria: endless)
+    history.start("สมศรี", "ทั้งหมด", None, None, use_snapshot=False)
+    deadline = time.time() + 5
+    while history._conn is None:
+        assert time.time() < deadline, "query never started"
+        time.sleep(0.01)
+    history.cancel()
+    deadline = time.time() + 5
+    while workers_alive():
+        assert time.time() < deadline, "query was not interrupted"
+        time.sleep(0.01)
+    root.run_pending()
+    # the aborted statement is not reported as a failure
+    assert history._conn is None and history.errors == [] and history.tree.rows == []
@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+
+class FakeVar:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+def wait_for(condition, tick=lambda: None, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        tick()
+        time.sleep(0.002)
+
+
+@pytest.fixture
+def load_test(app, db_path, root, ui, monkeypatch):
+    # stand-ins for the widgets below the Main UI marker
+    for name, value in (("worker_type_var", "ช่างเหล็ก"), ("loan_hours_var", "ไม่กำหนด"), ("pending_var", "")):
+        monkeypatch.setattr(app, name, FakeVar(value), raising=False)
+    for name in ("update_overdue_indicator", "update_stock_indicator", "refresh_tables"):
+        monkeypatch.setattr(app, name, lambda *a: None, raising=False)
+    monkeypatch.setattr(root, "update_idletasks", lambda: None, raising=False)
+    monkeypatch.setattr(app, "loan_scheduler", app.LoanScheduler())
+    monkeypatch.setattr(app, "stock_alerts", app.StockAlertMonitor())
+    monkeypatch.setattr(app, "last_scan_time", {})
+    writer = app.DBWriter()
+    monkeypatch.setattr(app, "db_writer", writer)
+    writer.start()
+    test = app.ScanLoadTest()
+    monkeypatch.setattr(app, "scan_load_test", test)
+    yield test
+    writer.stop()
+
+
+def test_load_test_runs_on_a_scratch_db(app, db_path, conn, root, ui, load_test):
+    finished = []
+    load_test.run(sizes=(200,), rate=200, duration=0.2, on_finished=finished.append)
+    tmpdir = load_test._tmpdir
+    assert app.DB_FILE.startswith(tmpdir)
+
+    # a camera scan during the test is refused, not written to the scratch DB
+    assert app.submit_scan("T-REAL", "สมศรี", "borrow") is False
+    wait_for(lambda: finished, tick=lambda: (root.run_pending(), ui.poll()))
+
+    [result] = finished[0]
+    assert result["sent"] == 40 and result["unfinished"] == 0
+    assert result["completed"] == result["sent"] - result["debounced"]
+    assert result["commit_ms"] and result["visible_ms"]
+    assert app.DB_FILE == db_path and app.loan_scheduler._watch_path == db_path
+    # the writer closed its scratch connection before the directory was removed
+    wait_for(lambda: not os.path.exists(tmpdir))
+    assert load_test.active is False and app.db_writer._conn is None
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM tools").fetchone()[0] == 0
@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import borrow_analytics
+
+
+def legacy_db(app, path, monkeypatch, history):
+    """DB at schema 3 (before loan tracking) holding `history`, then migrated to current"""
+    monkeypatch.setattr(app, "DB_FILE", path)
+    with monkeypatch.context() as m:
+        m.setattr(app, "MIGRATIONS", app.MIGRATIONS[:3])
+        m.setattr(app, "SCHEMA_VERSION", 3)
+        app.init_db()
+    conn = app.connect_db(path)
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, 5, ?)",
+                     [("สว่าน", "T1", 3), ("ค้อน", "T2", 5)])
+    conn.executemany("INSERT INTO transactions (tool_id, action, user) VALUES (?, ?, ?)", history)
+    conn.commit()
+    conn.close()
+    app.init_db()
+    conn = app.connect_db(path)
+    conn.isolation_level = None
+    return conn
+
+
+def return_ids(conn):
+    return dict(conn.execute("SELECT id, return_id FROM transactions WHERE action='ยืม'"))
+
+
+def test_pair_loans_fifo_per_group():
+    group = np.array([7, 7, 7, 7, 9])
+    ts = np.array([1, 2, 3, 4, 5])
+    act = np.array([1, 1, -1, -1, -1])
+    bpos, rpos = borrow_analytics.pair_loans(group, ts, act)
+    assert dict(zip(bpos.tolist(), rpos.tolist())) == {0: 2, 1: 3}
+
+
+def test_match_returns_falls_back_to_colleagues_per_tool():
+    # 1 A borrows, 2 B borrows, 3 B returns, 4 C returns (A's item), 5 A borrows another tool
+    closed, still_out = borrow_analytics.match_returns(
+        [1, 2, 3, 4, 5], [1, 1, 1, 1, 2], [0, 1, 1, 2, 0], [1, 1, -1, -1, 1])
+    assert closed == {2: 3, 1: 4}
+    assert still_out == [5]
+
+
+def test_migration_pairs_legacy_borrows_with_their_returns(app, tmp_path, monkeypatch):
+    conn = legacy_db(app, str(tmp_path / "legacy.db"), monkeypatch, [
+        (1, "ยืม", "สมชาย"),     # 1 returned by สมชาย (4)
+        (1, "ยืม", "สมศรี"),     # 2 returned by a colleague (5)
+        (2, "ยืม", "สมชาย"),     # 3 never returned
+        (1, "คืน", "สมชาย"),
+        (1, "คืน", "มานะ"),
+    ])
+    assert return_ids(conn) == {1: 4, 2: 5, 3: app.LEGACY_OPEN_LOAN}
+    conn.close()
+
+
+def test_return_never_closes_another_users_tracked_loan(app, tmp_path, monkeypatch):
+    conn = legacy_db(app, str(tmp_path / "legacy.db"), monkeypatch, [(1, "ยืม", "คนเก่า")])
+    conn.execute("BEGIN")
+    ok, _, loan = app.borrow_in_db(conn, "T1", "สมศรี", "ช่างปูน", "2030-01-01 08:00:00")
+    assert ok
+    tracked = loan[1]
+    # มานะ has no loan of their own: the migrated loan is the one closed
+    assert app.return_in_db(conn, "T1", "มานะ", "ช่างปูน")[2] == ("close", 1)
+    # nothing legacy left; สมศรี's tracked loan stays open
+    assert app.return_in_db(conn, "T1", "มานะ", "ช่างปูน")[2] is None
+    assert return_ids(conn)[tracked] is None
+    # their own return closes it
+    assert app.return_in_db(conn, "T1", "สมศรี", "ช่างปูน")[2] == ("close", tracked)
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def stamp(delta):
+    return (datetime.now() + delta).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def scheduler(app, db_path, root, monkeypatch):
+    alerts = []
+    monkeypatch.setattr(app, "update_overdue_indicator", alerts.append)
+    sched = app.LoanScheduler()
+    sched.alerts = alerts
+    return sched
+
+
+def test_rebuild_flags_loans_past_due(app, conn, scheduler, root):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', 'T1', 5, 5)")
+    conn.execute("BEGIN")
+    late = app.borrow_in_db(conn, "T1", "สมศรี", "ช่างไฟ", stamp(-timedelta(hours=2)))[2][1]
+    app.borrow_in_db(conn, "T1", "มานะ", "ช่างไฟ", stamp(timedelta(hours=3)))
+    returned = app.borrow_in_db(conn, "T1", "ปิติ", "ช่างไฟ", stamp(-timedelta(hours=1)))[2][1]
+    app.return_in_db(conn, "T1", "ปิติ", "ช่างไฟ")
+    conn.execute("COMMIT")
+    scheduler.rebuild()
+    assert scheduler.overdue == {late} and returned not in scheduler.loans
+    assert scheduler.alerts[-1] == [late]
+    # the timer sleeps until the next deadline, capped so clock changes are noticed
+    assert root.pending[-1][0] == app.OVERDUE_MAX_SLEEP_MS
+    assert [r[0] for r in scheduler.overdue_rows()][0] == late
+
+
+def test_loan_events_keep_the_heap_current(app, scheduler, root):
+    scheduler.rebuild()
+    scheduler.apply(("open", 7, "สว่าน", "สมศรี", stamp(timedelta(seconds=30))))
+    assert 25000 < root.pending[-1][0] <= 30050 and scheduler.overdue == set()
+    scheduler.apply(("open", 8, "ค้อน", "มานะ", stamp(-timedelta(minutes=1))))
+    assert scheduler.overdue == {8} and scheduler.alerts[-1] == [8]
+    scheduler.apply(("close", 8))
+    scheduler.apply(("close", 7))
+    assert scheduler.loans == {} and scheduler.overdue == set()
+    assert root.pending[-1][0] == app.OVERDUE_MAX_SLEEP_MS      # closed loans left the heap
+
+
+def test_poll_drops_loans_returned_at_another_station(app, conn, scheduler, monkeypatch):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', 'T1', 5, 5)")
+    conn.execute("BEGIN")
+    late = app.borrow_in_db(conn, "T1", "สมศรี", "ช่างไฟ", stamp(-timedelta(hours=2)))[2][1]
+    due = app.borrow_in_db(conn, "T1", "มานะ", "ช่างไฟ", stamp(timedelta(hours=3)))[2][1]
+    conn.execute("COMMIT")
+    scheduler.poll()
+    assert scheduler.overdue == {late} and scheduler.alerts == [[late]]
+    rebuilds = []
+    with monkeypatch.context() as m:
+        m.setattr(scheduler, "rebuild", lambda c=None: rebuilds.append(c))
+        scheduler.poll()
+    assert rebuilds == []       # nothing written since: no query
+
+    # another station (its own connection) returns สมศรี's loan
+    other = app.connect_db()
+    other.execute("BEGIN")
+    assert app.return_in_db(other, "T1", "สมศรี", "ช่างไฟ")[2] == ("close", late)
+    other.execute("COMMIT")
+    other.close()
+    scheduler.poll()
+    assert scheduler.loans.keys() == {due} and scheduler.overdue == set()
+    assert scheduler.alerts[-1] == []
+
+    # a change elsewhere does not alert again for a loan that is still overdue
+    conn.execute("BEGIN")
+    late2 = app.borrow_in_db(conn, "T1", "ปิติ", "ช่างไฟ", stamp(-timedelta(hours=1)))[2][1]
+    conn.execute("COMMIT")
+    scheduler.poll()
+    conn.execute("UPDATE tools SET total_qty = 6")
+    scheduler.poll()
+    assert scheduler.overdue == {late2}
+    assert [a for a in scheduler.alerts if a] == [[late], [late2]]
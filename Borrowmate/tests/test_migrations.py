@@ -0,0 +1,194 @@
+import sqlite3
+
+import pytest
+
+import borrow_audit
+
+TXN_COLUMNS = "id, tool_id, action, user, worker_type, reason, date, due_at, return_id, row_hash"
+
+
+def db_at(app, path, monkeypatch, version):
+    """DB migrated only up to `version`, set as the app's DB_FILE"""
+    monkeypatch.setattr(app, "DB_FILE", path)
+    with monkeypatch.context() as m:
+        m.setattr(app, "MIGRATIONS", app.MIGRATIONS[:version])
+        m.setattr(app, "SCHEMA_VERSION", version)
+        app.init_db()
+    conn = app.connect_db(path)
+    conn.isolation_level = None
+    return conn
+
+
+def user_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+@pytest.fixture
+def pre_versioning_db(app, tmp_path, monkeypatch, vacuums):
+    """A DB from before schema versioning: no reason / worker_type columns, user_version 0"""
+    path = str(tmp_path / "tools.db")
+    monkeypatch.setattr(app, "DB_FILE", path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("CREATE TABLE tools (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                 "code TEXT UNIQUE NOT NULL, total_qty INTEGER NOT NULL, available_qty INTEGER NOT NULL, image TEXT)")
+    conn.execute("CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, tool_id INTEGER NOT NULL, "
+                 "action TEXT NOT NULL, user TEXT NOT NULL, date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', 'T1', 2, 1)")
+    conn.executemany("INSERT INTO transactions (tool_id, action, user) VALUES (1, ?, ?)",
+                     [("ยืม", "สมศรี"), ("ยืม", "มานะ"), ("คืน", "สมศรี")])
+    yield conn
+    conn.close()
+
+
+def test_fresh_db_is_current_and_rechecked_with_one_pragma(app, db_path, monkeypatch):
+    statements = []
+    real_connect = app.connect_db
+
+    def traced_connect(path=None):
+        c = real_connect(path)
+        c.set_trace_callback(statements.append)
+        return c
+    monkeypatch.setattr(app, "connect_db", traced_connect)
+    app.init_db()
+    assert statements == ["PRAGMA user_version"]
+    conn = real_connect(db_path)
+    assert user_version(conn) == app.SCHEMA_VERSION
+    conn.close()
+
+
+def test_pre_versioning_db_is_upgraded_in_place(app, pre_versioning_db):
+    progress = []
+    app.init_db(progress=lambda label, done, total: progress.append(label))
+    conn = pre_versioning_db
+    assert user_version(conn) == app.SCHEMA_VERSION
+    assert conn.execute("SELECT id, action, user, worker_type, reason FROM transactions ORDER BY id").fetchall() == [
+        (1, "ยืม", "สมศรี", "ช่างเหล็ก", None), (2, "ยืม", "มานะ", "ช่างเหล็ก", None),
+        (3, "คืน", "สมศรี", "ช่างเหล็ก", None)]
+    # legacy loans paired by who returned them; the unreturned one stays open
+    assert dict(conn.execute("SELECT id, return_id FROM transactions WHERE action='ยืม'")) == {
+        1: 3, 2: app.LEGACY_OPEN_LOAN}
+    for table in ("transactions", "disposals"):
+        assert borrow_audit.verify_chain(conn, table, use_checkpoint=False)["broken"] is None
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {"idx_transactions_tool", "idx_transactions_date", "idx_transactions_action_worker",
+            "idx_disposals_tool", "idx_transactions_open_loans", "idx_stock_alerts_open"} <= indexes
+    assert "hash ประวัติยืมคืน" in progress
+
+
+def test_null_worker_type_backfill(app, tmp_path, monkeypatch):
+    conn = db_at(app, str(tmp_path / "tools.db"), monkeypatch, 2)
+    conn.executemany("INSERT INTO transactions (tool_id, action, user, worker_type) VALUES (1, 'ยืม', ?, ?)",
+                     [("ก", None), ("ข", "ช่างไฟ")] * 3)
+    with monkeypatch.context() as m:
+        m.setattr(app, "MIGRATIONS", app.MIGRATIONS[:3])
+        m.setattr(app, "SCHEMA_VERSION", 3)
+        app.init_db()
+    assert conn.execute("SELECT user, worker_type FROM transactions ORDER BY id LIMIT 2").fetchall() == [
+        ("ก", "ช่างเหล็ก"), ("ข", "ช่างไฟ")]
+    conn.close()
+
+
+def test_failed_migration_rolls_back_and_keeps_the_version(app, pre_versioning_db, monkeypatch):
+    def broken(conn, progress):
+        conn.execute("ALTER TABLE tools ADD COLUMN half_done INTEGER")
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(app, "MIGRATIONS", app.MIGRATIONS[:2] + [(3, "broken", broken)])
+    monkeypatch.setattr(app, "SCHEMA_VERSION", 3)
+    with pytest.raises(RuntimeError):
+        app.init_db()
+    assert user_version(pre_versioning_db) == 2
+    assert "half_done" not in [r[1] for r in pre_versioning_db.execute("PRAGMA table_info(tools)")]
+
+
+@pytest.fixture
+def vacuums(app, monkeypatch):
+    requested = []
+    monkeypatch.setattr(app.backup_scheduler, "vacuum_later", requested.append)
+    return requested
+
+
+@pytest.fixture
+def schema6(app, tmp_path, monkeypatch, vacuums):
+    conn = db_at(app, str(tmp_path / "tools.db"), monkeypatch, 6)
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', 'T1', 5, 4)")
+    conn.executemany(
+        "INSERT INTO transactions (tool_id, action, user, worker_type, reason, date, due_at, return_id) "
+        "VALUES (1, ?, ?, ?, ?, ?, ?, ?)", [
+            ("ยืม", "สมศรี", "ช่างไฟ", None, "2025-03-01 08:00:00", "2025-03-01 17:00:00", 2),
+            ("คืน", "สมศรี", "ช่างไฟ", None, "2025-03-01 16:00:00", None, None),
+            ("ยืม", "มานะ", None, "งานด่วน", "2025-03-02 08:00:00", None, None),
+        ])
+    conn.execute("BEGIN")
+    for row_id in (1, 2, 3):
+        borrow_audit.chain_row(conn, "transactions", row_id)
+    conn.execute("COMMIT")
+    yield conn
+    conn.close()
+
+
+def test_compaction_keeps_every_row(app, schema6, vacuums):
+    before = schema6.execute(f"SELECT {TXN_COLUMNS} FROM transactions ORDER BY id").fetchall()
+    app.init_db()
+    assert schema6.execute(f"SELECT {TXN_COLUMNS} FROM transactions ORDER BY id").fetchall() == before
+    assert schema6.execute("SELECT type FROM sqlite_master WHERE name='transactions'").fetchone() == ("view",)
+    assert borrow_audit.verify_chain(schema6, "transactions", use_checkpoint=False)["broken"] is None
+    assert dict(schema6.execute("SELECT name, id FROM txn_actions")) == {"ยืม": 1, "คืน": 2, "ทิ้ง": 3}
+
+
+def test_writes_through_the_view(app, schema6):
+    app.init_db()
+    schema6.execute("DELETE FROM transactions WHERE id=3")
+    schema6.execute("INSERT INTO transactions (tool_id, action, user) VALUES (1, 'ยืม', 'ใหม่')")
+    row = schema6.execute("SELECT id, user, worker_type, date IS NOT NULL FROM transactions "
+                          "WHERE user='ใหม่'").fetchone()
+    assert row == (4, "ใหม่", "ช่างเหล็ก", 1)   # deleted trailing id not reused; old defaults kept
+    schema6.execute("UPDATE transactions SET user='มานี', return_id=7 WHERE id=4")
+    assert schema6.execute("SELECT user, return_id FROM transactions WHERE id=4").fetchone() == ("มานี", 7)
+    assert schema6.execute("SELECT COUNT(*) FROM txn_users").fetchone()[0] == 4
+
+
+@pytest.mark.parametrize("emptied", [False, True])
+def test_ids_are_not_reused_after_compaction(app, schema6, emptied):
+    # an emptied table keeps its sqlite_sequence row; the copy then leaves none for transactions_data
+    schema6.execute("DELETE FROM transactions" if emptied else "DELETE FROM transactions WHERE id=3")
+    app.init_db()
+    assert schema6.execute("SELECT seq FROM sqlite_sequence WHERE name='transactions_data'").fetchall() == [(3,)]
+    schema6.execute("INSERT INTO transactions (tool_id, action, user) VALUES (1, 'ยืม', 'ใหม่')")
+    assert schema6.execute("SELECT MAX(id) FROM transactions").fetchone()[0] == 4
+
+
+def test_vacuum_is_left_to_the_backup_thread(app, schema6, vacuums, monkeypatch):
+    statements = []
+    real_connect = app.connect_db
+
+    def traced_connect(path=None):
+        c = real_connect(path)
+        c.set_trace_callback(statements.append)
+        return c
+    monkeypatch.setattr(app, "connect_db", traced_connect)
+    app.init_db()
+    assert not [s for s in statements if s.strip().upper() == "VACUUM"]
+    assert vacuums == [app.DB_FILE]
+
+
+def test_backup_thread_vacuum(app, schema6):
+    app.init_db()
+    schema6.execute("BEGIN")
+    schema6.executemany("INSERT INTO disposals (tool_id, quantity, reason) VALUES (1, 1, ?)",
+                        [("x" * 500,)] * 2000)
+    schema6.execute("DELETE FROM disposals")
+    schema6.execute("COMMIT")
+    assert schema6.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    assert app.BackupScheduler().vacuum(app.DB_FILE) is True
+    assert schema6.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_vacuum_gives_up_while_another_station_reads(app, db_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_BUSY_TIMEOUT", 0.1)
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN")
+    other.execute("SELECT COUNT(*) FROM tools").fetchone()
+    try:
+        assert app.BackupScheduler().vacuum(db_path) is False
+    finally:
+        other.close()
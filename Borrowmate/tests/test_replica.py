@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def replica(app, db_path, root, monkeypatch):
+    rep = app.ReadReplica()
+    monkeypatch.setattr(app, "read_replica", rep)
+    rep.set_enabled(True)
+    rep.sync()
+    yield rep
+    rep.set_enabled(False)
+    rep.run_once()
+
+
+def add_tool(conn, code):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', ?, 1, 1)", (code,))
+
+
+def test_reader_waits_for_sync_to_commit(app, replica):
+    master = replica._master
+    master.execute("BEGIN")
+    add_tool(master, "T1")
+    add_tool(master, "T2")
+    seen = []
+    reader = threading.Thread(
+        target=lambda: seen.append(app.connect_read().execute("SELECT COUNT(*) FROM tools").fetchone()[0]))
+    reader.start()
+    time.sleep(0.2)
+    assert seen == []           # half-applied sync is not visible
+    master.execute("COMMIT")
+    reader.join(5)
+    assert seen == [2]
+
+
+def test_delta_sync_retries_while_a_reader_holds_the_table(app, replica, conn):
+    add_tool(conn, "T1")
+    replica.sync()
+    add_tool(conn, "T2")
+    reader = app.connect_read()
+    cur = reader.execute("SELECT id FROM tools UNION ALL SELECT 0")
+    cur.fetchone()              # statement still running: holds its table lock
+    release = threading.Timer(0.2, cur.close)
+    release.start()
+    started = time.monotonic()
+    assert replica.sync() is True
+    assert time.monotonic() - started >= 0.15
+    assert replica.last_error is None
+    release.join()
+    assert reader.execute("SELECT code FROM tools ORDER BY id").fetchall() == [("T1",), ("T2",)]
+    reader.close()
+
+
+def test_writer_leaves_the_sync_to_the_replica_thread(app, replica, root, ui, monkeypatch):
+    synced_on = []
+    real_sync = replica.sync
+    monkeypatch.setattr(replica, "sync", lambda: synced_on.append(threading.current_thread().name) or real_sync())
+    writer = app.DBWriter()
+    writer.start()
+    seen = []
+    fut = writer.submit(lambda c: add_tool(c, "T1"),
+                        on_done=lambda _: seen.append(app.connect_read().execute("SELECT COUNT(*) FROM tools").fetchone()[0]))
+    fut.result(5)
+    assert synced_on == [] and ui.poll() is False      # nothing delivered before the sync
+    replica.run_once()
+    writer.stop()
+    assert synced_on == ["MainThread"]
+    assert ui.poll() is True and seen == [1]
+
+
+def test_disabling_does_not_wait_for_a_running_copy(app, replica):
+    with replica._lock:         # a long copy on the replica thread
+        done = threading.Event()
+        toggler = threading.Thread(target=lambda: (replica.set_enabled(False), done.set()))
+        toggler.start()
+        assert done.wait(1)
+        reader = app.connect_read()     # readers go to the file straight away
+        assert reader.execute("PRAGMA database_list").fetchone()[2] == app.DB_FILE
+        reader.close()
+        assert replica._master is not None
+    replica.run_once()          # the replica thread drops the copy once the lock is free
+    assert replica._master is None and replica.synced_at is None
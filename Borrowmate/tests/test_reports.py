@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("reportlab")
+import borrow_reports
+
+
+@pytest.fixture
+def report_db(conn, db_path):
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, 5, 5)",
+                     [("สว่าน", "T1"), ("ค้อน", "T2")])
+    conn.executemany("INSERT INTO transactions (tool_id, action, user, worker_type, date) VALUES (?, ?, ?, ?, ?)", [
+        (1, "ยืม", "สมศรี", "ช่างไฟ", "2025-03-02 08:00:00"),
+        (1, "คืน", "สมศรี", "ช่างไฟ", "2025-03-02 16:00:00"),
+        (2, "ยืม", "มานะ", "ช่างไม้", "2025-03-31 23:59:59"),
+        (1, "ยืม", "มานะ", "ช่างไม้", "2025-04-01 00:00:00"),    # next month
+    ])
+    conn.execute("INSERT INTO disposals (tool_id, quantity, reason, date) VALUES (2, 3, 'หัก', '2025-03-15 10:00:00')")
+    return db_path
+
+
+def run_cli(*argv):
+    return borrow_reports.main(list(argv))
+
+
+def test_month_range_wraps_the_year():
+    assert borrow_reports.month_range("2024-12") == ("2024-12-01 00:00:00", "2025-01-01 00:00:00")
+    assert borrow_reports.previous_month(borrow_reports.date(2025, 1, 10)) == "2024-12"
+
+
+def test_summary_counts_only_the_month(report_db, conn):
+    summary = borrow_reports.summarize(conn, *borrow_reports.month_range("2025-03"))
+    assert summary["total"] == {"borrow": 2, "return": 1, "dispose": 0, "disposed_qty": 3}
+    assert dict(summary["users"])["มานะ"]["borrow"] == 1
+    assert dict(summary["tools"])["ค้อน (T2)"] == {"borrow": 1, "return": 0, "dispose": 0, "disposed_qty": 3}
+
+
+def test_cli_writes_pdf_and_result_file_then_uses_cache(report_db, tmp_path, capsys):
+    out, result_file = str(tmp_path / "out"), str(tmp_path / "result.json")
+    assert run_cli(report_db, "--month", "2025-03", "--format", "pdf", "--out", out, "--json", result_file) == 0
+    with open(result_file, encoding="utf-8") as f:
+        result = json.load(f)
+    assert result["cached"] is False
+    assert result["files"] == {"pdf": os.path.join(out, "report_2025-03.pdf")}
+    with open(result["files"]["pdf"], "rb") as f:
+        assert f.read(5) == b"%PDF-"
+    assert json.loads(capsys.readouterr().out.strip().splitlines()[-1]) == result
+
+    assert run_cli(report_db, "--month", "2025-03", "--format", "pdf", "--out", out) == 0
+    assert json.loads(capsys.readouterr().out)["cached"] is True
+    assert run_cli(report_db, "--month", "2025-03", "--format", "pdf", "--out", out, "--force") == 0
+    assert json.loads(capsys.readouterr().out)["cached"] is False
+
+
+def test_cli_rebuilds_when_the_month_changes(report_db, conn, tmp_path, capsys):
+    out = str(tmp_path / "out")
+    run_cli(report_db, "--month", "2025-03", "--format", "pdf", "--out", out)
+    conn.execute("INSERT INTO transactions (tool_id, action, user, date) VALUES (2, 'คืน', 'มานะ', '2025-03-31 23:59:59')")
+    capsys.readouterr()
+    run_cli(report_db, "--month", "2025-03", "--format", "pdf", "--out", out)
+    assert json.loads(capsys.readouterr().out)["cached"] is False
+
+
+def test_cli_writes_xlsx(report_db, tmp_path, capsys):
+    openpyxl = pytest.importorskip("openpyxl")
+    out = str(tmp_path / "out")
+    assert run_cli(report_db, "--month", "2025-03", "--format", "xlsx", "--out", out) == 0
+    path = json.loads(capsys.readouterr().out)["files"]["xlsx"]
+    rows = [row[:2] for row in openpyxl.load_workbook(path).worksheets[0].values]
+    assert ("ยืม", 2) in rows and ("ทิ้ง (ชิ้น)", 3) in rows
+
+
+def test_cli_reports_errors(tmp_path, capsys):
+    assert run_cli(str(tmp_path / "missing.db"), "--month", "2025-03", "--format", "pdf",
+                   "--out", str(tmp_path)) == 1
+    assert "error" in json.loads(capsys.readouterr().out)
+    assert run_cli(str(tmp_path / "x.db"), "--bogus") == 2
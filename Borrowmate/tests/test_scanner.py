@@ -0,0 +1,90 @@
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+
+class FakeCapture:
+    """cv2.VideoCapture stand-in: a frame every few ms; source "bad" does not open"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def isOpened(self):
+        return self.source != "bad"
+
+    def read(self):
+        time.sleep(0.005)
+        return True, np.zeros((4, 4), np.uint8)
+
+    def release(self):
+        pass
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def scanner(app, ui, monkeypatch):
+    decoders = set()
+
+    def decode(frame):
+        decoders.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return []
+    monkeypatch.setattr(app, "cv2", types.SimpleNamespace(VideoCapture=FakeCapture))
+    monkeypatch.setattr(app, "_decode_frame", decode)
+    # the scan button lives below the Main UI marker
+    monkeypatch.setattr(app, "update_scan_button_state", lambda: None, raising=False)
+    manager = app.ScannerManager()
+    manager.decoders = decoders
+    yield manager
+    manager.stop()
+    wait_for(lambda: not manager.cameras)
+
+
+def test_cameras_share_one_decode_pool(app, scanner):
+    cams = [scanner.add_camera("กล้อง 1", 0), scanner.add_camera("กล้อง 2", 1)]
+    wait_for(lambda: all(c.decoded >= 3 for c in cams))
+    assert scanner.running
+    assert len(scanner.decoders) <= app.DECODE_WORKERS
+    assert all(name.startswith("decode") for name in scanner.decoders)
+    pool = scanner._pool
+    scanner.stop()
+    wait_for(lambda: not scanner.cameras)
+    assert not scanner.running and scanner._pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(print)      # shut down with the last camera
+
+
+def test_stopped_camera_leaves_the_list(app, scanner):
+    first = scanner.add_camera("กล้อง 1", 0)
+    second = scanner.add_camera("กล้อง 2", 1)
+    first.stop()
+    wait_for(lambda: scanner.cameras == [second])
+    assert scanner._pool is not None        # the other camera still decodes
+    assert scanner.add_camera("กล้อง 1", 0).name == "กล้อง 1"
+
+
+def test_duplicate_source_and_name(app, scanner):
+    first = scanner.add_camera("กล้อง 1", 0)
+    assert scanner.add_camera("กล้อง 0", 0) is None
+    # the add-camera dialog names cameras "กล้อง <source>", which can clash with CAMERA_SOURCES
+    assert scanner.add_camera("กล้อง 1", 1).name == "กล้อง 1 (2)"
+    assert scanner.add_camera("กล้อง 1", 2).name == "กล้อง 1 (3)"
+    assert first.name == "กล้อง 1" and len(scanner.cameras) == 3
+
+
+def test_failed_camera_is_reported_and_removed(app, scanner, ui):
+    toasts = []
+    ui.on_toasts = toasts.extend
+    scanner.add_camera("กล้อง NAS", "bad")
+    wait_for(lambda: not scanner.cameras)
+    ui.poll()
+    assert toasts == [("กล้อง NAS: เปิดกล้องไม่ได้", "warning")]
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+
+import pytest
+
+import borrow_sites
+
+HISTORY_SQL = """
+    SELECT tr.id, tl.name, tr.action, tr.user, tr.date
+    FROM transactions tr JOIN tools tl ON tr.tool_id = tl.id
+    ORDER BY tr.date DESC, tr.id DESC
+"""
+
+
+def make_site(app, path, monkeypatch, tools, history, version=None):
+    monkeypatch.setattr(app, "DB_FILE", path)
+    with monkeypatch.context() as m:
+        if version is not None:
+            m.setattr(app, "MIGRATIONS", app.MIGRATIONS[:version])
+            m.setattr(app, "SCHEMA_VERSION", version)
+        app.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, ?, ?)", tools)
+    conn.executemany("INSERT INTO transactions (tool_id, action, user, worker_type, date) VALUES (?, ?, ?, ?, ?)",
+                     history)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def sites(app, tmp_path, monkeypatch):
+    # awkward names on purpose: they must survive the file: URI
+    north = make_site(app, str(tmp_path / "site north #1.db"), monkeypatch,
+                      [("สว่าน", "T1", 5, 3)],
+                      [(1, "ยืม", "สมศรี", "ช่างไฟ", "2025-03-01 08:00:00"),
+                       (1, "ยืม", "มานะ", "ช่างไฟ", "2025-03-03 08:00:00")])
+    south = make_site(app, str(tmp_path / "site 100% south.db"), monkeypatch,
+                      [("ค้อน", "T9", 2, 2), ("เลื่อย", "T8", 1, 0)],
+                      [(2, "ยืม", "ปิติ", "ช่างไม้", "2025-03-02 08:00:00")],
+                      version=6)        # not yet dictionary-encoded
+    fed = borrow_sites.SiteFederation([("เหนือ", north), ("ใต้", south)])
+    yield fed
+    fed.close()
+
+
+def test_readonly_uri_encodes_the_path(tmp_path):
+    path = tmp_path / "a b#c%41?.db"
+    sqlite3.connect(str(path)).close()
+    uri = borrow_sites.readonly_uri(str(path))
+    assert uri.startswith("file:///") and uri.endswith("?mode=ro")
+    assert "#" not in uri and " " not in uri and "%41" not in uri
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        assert conn.execute("PRAGMA database_list").fetchone()[2] == str(path)
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("CREATE TABLE t (x)")
+    finally:
+        conn.close()
+    assert not os.path.exists(str(tmp_path / "a b"))
+
+
+def test_union_all_tags_rows_with_their_site(sites):
+    rows, errors = sites.tools()
+    assert errors == []
+    assert {(site, code) for site, _, _, code, _, _ in rows} == {("ใต้", "T8"), ("ใต้", "T9"), ("เหนือ", "T1")}
+    assert set(sites.availability()[0]) == {("เหนือ", 1, 5, 3, 2), ("ใต้", 2, 3, 2, 1)}
+
+
+def test_merged_history_is_in_date_order(sites):
+    rows, errors = sites.merged(HISTORY_SQL, key=lambda r: (r[5], r[0]))
+    assert errors == []
+    assert [(site, user) for site, _, _, _, user, _ in rows] == [("เหนือ", "มานะ"), ("ใต้", "ปิติ"), ("เหนือ", "สมศรี")]
+
+
+def test_worker_stats_across_schema_versions(sites):
+    rows, errors = sites.worker_stats()
+    assert errors == []
+    assert set(rows) == {("เหนือ", "ช่างไฟ", 2), ("ใต้", "ช่างไม้", 1)}
+
+
+def test_offline_site_is_reported_not_fatal(sites, tmp_path):
+    fed = borrow_sites.SiteFederation(sites.sites + [("NAS", str(tmp_path / "offline" / "tools.db"))])
+    try:
+        rows, errors = fed.tools()
+        assert len(rows) == 3 and [site for site, _ in errors] == ["NAS"]
+        rows, errors = fed.merged(HISTORY_SQL)
+        assert len(rows) == 3 and [site for site, _ in errors] == ["NAS"]
+    finally:
+        fed.close()
+
+
+def test_sites_are_never_written(sites):
+    rows, errors = sites.per_site("DELETE FROM tools")
+    assert rows == [] and len(errors) == 2
+    assert len(sites.tools()[0]) == 3
+
+
+def test_site_limit():
+    with pytest.raises(ValueError):
+        borrow_sites.SiteFederation([])
+    with pytest.raises(ValueError):
+        borrow_sites.SiteFederation([(str(i), "x.db") for i in range(borrow_sites.MAX_SITES + 1)])
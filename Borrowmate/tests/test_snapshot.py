@@ -0,0 +1,63 @@
+import calendar
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from borrow_analytics import TransactionSnapshot
+
+# the history pane's SQL filter, which the snapshot has to agree with
+SQL = """
+    SELECT tr.id, tl.name, tr.action, tr.user, IFNULL(tr.reason, ''), tr.date
+    FROM transactions tr JOIN tools tl ON tr.tool_id = tl.id
+    WHERE (? IS NULL OR tr.user LIKE '%' || ? || '%') AND (? IS NULL OR tr.action = ?)
+      AND (? IS NULL OR (tr.date >= ? AND tr.date < ?))
+    ORDER BY tr.id DESC
+"""
+
+
+@pytest.fixture
+def history(conn):
+    conn.executemany("INSERT INTO tools (name, code, total_qty, available_qty) VALUES (?, ?, 5, 5)",
+                     [("สว่าน", "T1"), ("ค้อน", "T2"), ("เลื่อย", "T3")])
+    users = ["สมศรี", "Somchai", "มานะ", "somsak"]
+    rows = [(1 + i % 3, ("ยืม", "คืน", "ทิ้ง")[i % 3 if i % 7 else 0], users[i % 4],
+             "ชำรุด" if i % 5 == 0 else None, f"2025-03-{1 + i % 20:02d} {i % 24:02d}:15:00")
+            for i in range(200)]
+    conn.executemany("INSERT INTO transactions (tool_id, action, user, reason, date) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.execute("DELETE FROM tools WHERE id=3")        # its history drops out, like the JOIN
+    return conn
+
+
+def sql_filter(conn, user, action, start, end):
+    bounds = (start.strftime("%Y-%m-%d"), (end + timedelta(days=1)).strftime("%Y-%m-%d")) if start else (None, None)
+    return conn.execute(SQL, (user, user, action, action, bounds[0]) + bounds).fetchall()
+
+
+@pytest.mark.parametrize("user, action, start, end", [
+    (None, None, None, None),
+    ("som", None, None, None),
+    ("สม", "ยืม", None, None),
+    (None, "ทิ้ง", date(2025, 3, 5), date(2025, 3, 9)),
+    ("มานะ", "คืน", date(2025, 3, 1), date(2025, 3, 1)),
+    ("nobody", None, None, None),
+])
+def test_snapshot_matches_the_sql_filter(app, history, user, action, start, end):
+    snap = TransactionSnapshot(app.DB_FILE, connect=app.connect_read)
+    snap.extend()
+    tool_names = dict(history.execute("SELECT id, name FROM tools"))
+    start_ts = end_ts = None
+    if start:
+        start_ts = calendar.timegm(start.timetuple())
+        end_ts = calendar.timegm((end + timedelta(days=1)).timetuple())
+    positions = snap.filter(user=user, action=action, start=start_ts, end=end_ts, tool_ids=tool_names.keys())
+    assert snap.rows(positions, tool_names) == sql_filter(history, user, action, start, end)
+
+
+def test_extend_reads_only_new_rows(app, history):
+    snap = TransactionSnapshot(app.DB_FILE, connect=app.connect_read)
+    assert snap.extend() == 200 and snap.extend() == 0
+    history.execute("INSERT INTO transactions (tool_id, action, user) VALUES (1, 'ยืม', 'ใหม่')")
+    assert snap.extend() == 1 and len(snap) == 201
+    assert len(snap.filter(user="ใหม่")) == 1
+    assert snap.filter(action="ไม่มี").size == 0
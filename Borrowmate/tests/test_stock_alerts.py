@@ -0,0 +1,76 @@
+import pytest
+
+
+def alerts(conn):
+    return conn.execute("SELECT tool_id, kind, available_qty, min_available, cleared_at IS NOT NULL "
+                        "FROM stock_alerts ORDER BY id").fetchall()
+
+
+@pytest.fixture
+def tool(conn):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty, min_available) "
+                 "VALUES ('สว่าน', 'T1', 5, 5, 2)")
+    return 1
+
+
+def set_available(conn, tool_id, qty):
+    conn.execute("UPDATE tools SET available_qty=? WHERE id=?", (qty, tool_id))
+
+
+def test_alert_only_on_threshold_crossings(conn, tool):
+    set_available(conn, tool, 2)            # at the minimum is not low
+    assert alerts(conn) == []
+    set_available(conn, tool, 1)
+    set_available(conn, tool, 0)            # still low: no second alert
+    assert alerts(conn) == [(1, "low", 1, 2, 0)]
+    set_available(conn, tool, 3)
+    assert alerts(conn) == [(1, "low", 1, 2, 1), (1, "clear", 3, 2, 0)]
+
+
+def test_threshold_changes_and_no_threshold(conn, tool):
+    conn.execute("UPDATE tools SET min_available=6 WHERE id=1")
+    conn.execute("UPDATE tools SET min_available=NULL WHERE id=1")
+    assert [a[1] for a in alerts(conn)] == ["low", "clear"]
+    set_available(conn, tool, 0)            # no threshold, no alert
+    assert len(alerts(conn)) == 2
+
+
+def test_insert_below_minimum_and_delete(conn):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty, min_available) "
+                 "VALUES ('ค้อน', 'T2', 1, 1, 3)")
+    assert alerts(conn) == [(1, "low", 1, 3, 0)]
+    conn.execute("DELETE FROM tools WHERE id=1")
+    assert alerts(conn) == [(1, "low", 1, 3, 1), (1, "clear", 1, 3, 0)]
+
+
+def test_failed_write_logs_nothing(conn, tool):
+    conn.execute("BEGIN")
+    set_available(conn, tool, 0)
+    conn.execute("ROLLBACK")
+    assert alerts(conn) == []
+
+
+def test_monitor_reads_alerts_incrementally(app, conn, tool, root, monkeypatch):
+    monkeypatch.setattr(app, "update_stock_indicator", lambda: None)
+    notes = []
+    monkeypatch.setattr(app.ui_updates, "notify", lambda msg, level="info": notes.append(msg))
+    monitor = app.StockAlertMonitor()
+    set_available(conn, tool, 1)
+    monitor.rebuild()
+    assert list(monitor.open) == [1] and notes == []     # already open at startup: no toast
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty, min_available) "
+                 "VALUES ('ค้อน', 'T2', 4, 4, 2)")
+    conn.execute("UPDATE tools SET available_qty=0 WHERE id=2")
+    set_available(conn, tool, 5)
+    monitor.poll()
+    assert list(monitor.open) == [2] and len(notes) == 1 and "ค้อน" in notes[0]
+    last = monitor.last_id
+    monitor.poll()
+    assert monitor.last_id == last and len(notes) == 1
+
+
+def test_bulk_min_update_goes_through_the_triggers(app, conn, tool):
+    conn.execute("BEGIN IMMEDIATE")
+    app.bulk_update_tools(conn, "min", [tool], 9)
+    conn.execute("COMMIT")
+    assert alerts(conn) == [(1, "low", 5, 9, 0)]
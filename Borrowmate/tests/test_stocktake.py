@@ -0,0 +1,76 @@
+import sqlite3
+
+import pytest
+
+for name in ("cv2", "PIL.Image", "pyzbar.pyzbar"):
+    pytest.importorskip(name, exc_type=ImportError)
+from PIL import Image
+
+import borrow_stocktake
+
+LABEL = (1000.0, 700.0, 40.0)   # one label at this full-resolution centre / size
+
+
+def fake_decode(job):
+    """Stands in for decode_tile: reports LABEL from every tile that contains it"""
+    path, scale, x, y, w, h = job
+    cx, cy, size = LABEL
+    if x <= cx * scale < x + w and y <= cy * scale < y + h:
+        # a little jitter per tile, as real decodes of the same label give
+        return path, [("T1", cx + x % 7, cy - y % 5, size)]
+    return path, []
+
+
+@pytest.mark.parametrize("width, height", [(4000, 3000), (1280, 900), (1281, 5000), (100, 100)])
+def test_tile_grid_covers_the_image_with_overlap(width, height):
+    tiles = borrow_stocktake.tile_grid(width, height)
+    covered = set()
+    for x, y, w, h in tiles:
+        assert 0 <= x and 0 <= y and x + w <= width and y + h <= height
+        covered.update((cx, cy) for cx in range(x // 10, (x + w) // 10) for cy in range(y // 10, (y + h) // 10))
+    assert len(covered) == (width // 10) * (height // 10)
+    xs = sorted({x for x, _, _, _ in tiles})
+    # neighbouring tiles overlap by at least TILE_OVERLAP, so a label that size is whole in one
+    assert all(b - a <= borrow_stocktake.TILE_SIZE - borrow_stocktake.TILE_OVERLAP for a, b in zip(xs, xs[1:]))
+
+
+def test_plan_tiles_skips_scales_too_small_to_decode():
+    jobs = borrow_stocktake.plan_tiles("p.jpg", 200, 200, scales=(1.0, 0.5))
+    assert {job[1] for job in jobs} == {1.0, 0.5}
+    assert {job[1] for job in borrow_stocktake.plan_tiles("p.jpg", 200, 200, scales=(1.0, 0.25))} == {1.0}
+
+
+def test_merge_detections_per_physical_label():
+    merged = borrow_stocktake.merge_detections([
+        ("T1", 100, 100, 40), ("T1", 110, 95, 44),     # same label seen by two tiles
+        ("T1", 900, 100, 40),                          # second label with the same code
+        ("T2", 105, 100, 40),
+    ])
+    assert merged == {"T1": [(100, 100, 44), (900, 100, 40)], "T2": [(105, 100, 40)]}
+
+
+def test_scan_images_merges_overlapping_tiles(tmp_path):
+    path = str(tmp_path / "shelf.png")
+    Image.new("L", (3000, 2000), 255).save(path)
+    labels, stats = borrow_stocktake.scan_images([path], workers=2, decode=fake_decode)
+    assert stats["detections"] > 1                  # seen by several tiles and both scales
+    assert list(labels[path]) == ["T1"] and len(labels[path]["T1"]) == 1
+
+
+def test_image_size_follows_exif_rotation(tmp_path):
+    path = str(tmp_path / "portrait.jpg")
+    exif = Image.Exif()
+    exif[borrow_stocktake.EXIF_ORIENTATION] = 6
+    Image.new("RGB", (300, 200)).save(path, exif=exif)
+    assert borrow_stocktake.image_size(path) == (200, 300)
+
+
+def test_reconcile():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE tools (code TEXT, name TEXT, total_qty INTEGER, available_qty INTEGER)")
+    conn.executemany("INSERT INTO tools VALUES (?, ?, ?, ?)",
+                     [("T1", "สว่าน", 3, 2), ("T2", "ค้อน", 1, 1), ("T3", "เลื่อย", 1, 0)])
+    labels = {"a.jpg": {"T1": [(1, 1, 1)], "X9": [(5, 5, 1)]}, "b.jpg": {"T1": [(2, 2, 1)]}}
+    result = borrow_stocktake.reconcile(conn, labels)
+    assert result == {"present": [("T1", "สว่าน", 2, 2, 3)], "missing": [("T2", "ค้อน", 0, 1, 1)],
+                      "unknown": [("X9", 1)]}
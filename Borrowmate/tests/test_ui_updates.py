@@ -0,0 +1,70 @@
+import threading
+
+
+def test_worker_threads_never_call_tk(app, root):
+    updater = app.UIUpdater()
+    seen = []
+    updater.register("tools", lambda: seen.append("tools"))
+    updater.start()
+
+    def post():
+        for _ in range(2000):
+            updater.request("tools")
+            updater.notify("x")
+
+    workers = [threading.Thread(target=post) for _ in range(4)]
+    for w in workers:
+        w.start()
+    # the Tk side keeps flushing while the workers post; with root.after
+    # called under the updater's lock this used to deadlock at once
+    while any(w.is_alive() for w in workers):
+        updater.poll()
+    for w in workers:
+        w.join(5)
+    updater.poll()
+    assert root.after_threads == {threading.get_ident()}
+    assert seen and updater.requests == 4 * 2000 * 2
+
+
+def test_requests_in_one_frame_are_coalesced(app, root):
+    updater = app.UIUpdater()
+    calls = []
+    updater.register("tools", lambda: calls.append("tools"))
+    updater.register("transactions", lambda: calls.append("transactions"))
+    for _ in range(50):
+        updater.request("tools", "transactions")
+    assert updater.poll() is True
+    assert calls == ["tools", "transactions"]
+    assert updater.max_batch == 100
+    assert updater.poll() is False
+
+
+def test_failing_handler_does_not_drop_the_frame(app, root):
+    updater = app.UIUpdater()
+    toasts, calls, done = [], [], []
+    updater.on_toasts = toasts.extend
+
+    def broken():
+        raise RuntimeError("boom")
+
+    updater.register("tools", broken)
+    updater.register("transactions", lambda: calls.append("transactions"))
+    updater.request("tools", "transactions")
+    updater.after_flush(lambda: done.append(True))
+    updater.poll()
+    assert calls == ["transactions"]
+    assert done == [True]
+    assert any("boom" in message for message, _ in toasts)
+
+
+def test_camera_scans_are_handled_on_the_tk_tick(app, root, ui, monkeypatch):
+    handled = []
+    monkeypatch.setattr(app, "handle_scanned_code",
+                        lambda code, user, mode, probe: handled.append((code, threading.current_thread().name)))
+    monkeypatch.setattr(app, "last_scan_time", {})
+    camera = threading.Thread(target=lambda: app.submit_scan("T1", "สมศรี", "borrow"), name="camera-0")
+    camera.start()
+    camera.join(5)
+    assert root.pending == [] and handled == []
+    ui.poll()
+    assert handled == [("T1", "MainThread")]
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def writer(app, db_path, root, ui):
+    w = app.DBWriter()
+    w.start()
+    yield w
+    w.stop()
+
+
+def add_tool(conn, code):
+    conn.execute("INSERT INTO tools (name, code, total_qty, available_qty) VALUES ('สว่าน', ?, 1, 1)", (code,))
+    return threading.current_thread().name
+
+
+def codes(app):
+    conn = app.connect_db()
+    try:
+        return [r[0] for r in conn.execute("SELECT code FROM tools ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_jobs_run_in_order_and_report_on_the_tk_tick(app, writer, root, ui):
+    done = []
+    futures = [writer.submit(add_tool, f"T{i}", on_done=lambda r: done.append((r, threading.current_thread().name)))
+               for i in range(5)]
+    assert [f.result(5) for f in futures] == ["db-writer"] * 5
+    assert done == [] and root.pending == []        # the writer thread never calls Tk
+    assert ui.poll() is True
+    assert done == [("db-writer", "MainThread")] * 5
+    assert codes(app) == [f"T{i}" for i in range(5)]
+    assert writer.pending == 0
+
+
+def test_failed_job_is_rolled_back(app, writer, root, ui):
+    def half_done(conn):
+        add_tool(conn, "T1")
+        raise ValueError("boom")
+    errors = []
+    fut = writer.submit(half_done, on_error=errors.append)
+    with pytest.raises(ValueError):
+        fut.result(5)
+    assert errors == []
+    ui.poll()
+    assert [str(e) for e in errors] == ["boom"] and codes(app) == []
+
+
+def test_locked_file_is_retried(app, writer, root, db_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_BUSY_TIMEOUT", 0.05)
+    monkeypatch.setattr(app, "DB_RETRY_BACKOFF", 0.05)
+    other = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")        # another station mid-write
+    threading.Timer(0.2, lambda: other.execute("COMMIT")).start()
+    try:
+        assert writer.submit(add_tool, "T1").result(10) == "db-writer"
+    finally:
+        other.close()
+    assert codes(app) == ["T1"]
+
+
+def test_gives_up_after_the_retries(app, writer, root, ui, db_path, monkeypatch):
+    monkeypatch.setattr(app, "DB_BUSY_TIMEOUT", 0.01)
+    monkeypatch.setattr(app, "DB_RETRY_BACKOFF", 0.01)
+    other = sqlite3.connect(db_path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    errors = []
+    try:
+        fut = writer.submit(add_tool, "T1", on_error=errors.append)
+        with pytest.raises(sqlite3.OperationalError):
+            fut.result(10)
+    finally:
+        other.close()
+    ui.poll()
+    assert len(errors) == 1 and app._is_lock_error(errors[0])
+